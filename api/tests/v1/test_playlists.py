@@ -1,5 +1,7 @@
 from django.core.urlresolvers import reverse
+from mock import patch
 
+from api.v1 import pagination
 from pipeline.tests import factories
 from .base import BaseAuthenticatedTests
 
@@ -11,6 +13,22 @@ class PlaylistTests(BaseAuthenticatedTests):
         playlists = response.json()
         self.assertEqual([], playlists)
 
+    def test_list_playlists_page_size(self):
+        for _ in range(3):
+            factories.PlaylistFactory(owner=self.user)
+        url = reverse('api:v1:playlist-list')
+
+        with patch.object(pagination.CursorPagination, 'max_page_size', 2):
+            response_default = self.client.get(url)
+            response_small = self.client.get(url, data={'page_size': 1})
+            response_large = self.client.get(url, data={'page_size': 10})
+
+        self.assertEqual(3, len(response_default.json()))
+        self.assertFalse(response_default.has_header('Link'))
+        self.assertEqual(1, len(response_small.json()))
+        self.assertIn('rel="next"', response_small['Link'])
+        self.assertEqual(2, len(response_large.json()))
+
     def test_get_playlist(self):
         playlist = factories.PlaylistFactory(name="Funkadelic playlist", owner=self.user)
         response = self.client.get(reverse('api:v1:playlist-detail', kwargs={'id': playlist.public_id}))
@@ -0,0 +1,148 @@
+import re
+from time import time
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase
+from django.utils.timezone import now
+from mock import Mock
+
+from api.v1 import views
+from pipeline import models
+
+
+@skipUnless(connection.vendor == 'sqlite', "Query plans are inspected with sqlite EXPLAIN QUERY PLAN")
+class QueryPlanTests(TestCase):
+    """
+    Check that the hot queries of the API do not scan the video, video
+    document, processing state, subtitle, playlist and upload url tables.
+    Tables are populated with enough rows, and analyzed, such that the query
+    planner prefers indexes over full scans, just like it would in production.
+    """
+
+    USER_COUNT = 20
+    VIDEO_COUNT = 2000
+    SCANNED_TABLES = [
+        models.Video._meta.db_table,
+        models.VideoDocument._meta.db_table,
+        models.ProcessingState._meta.db_table,
+        models.Subtitle._meta.db_table,
+        models.Playlist._meta.db_table,
+        models.Playlist.videos.through._meta.db_table,
+        models.VideoUploadUrl._meta.db_table,
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create([
+            User(username="user{}".format(u)) for u in range(cls.USER_COUNT)
+        ])
+        users = list(User.objects.all())
+        cls.user = users[0]
+
+        # Note that bulk_create does not send post_save signals, so that
+        # processing states need to be created explicitly
+        models.Video.objects.bulk_create([
+            models.Video(title="video{}".format(v), owner=users[v % len(users)])
+            for v in range(cls.VIDEO_COUNT)
+        ])
+        videos = list(models.Video.objects.all())
+        statuses = [models.ProcessingState.STATUS_SUCCESS] * 17 + [
+            models.ProcessingState.STATUS_FAILED,
+            models.ProcessingState.STATUS_RESTART,
+            models.ProcessingState.STATUS_PROCESSING,
+        ]
+        models.ProcessingState.objects.bulk_create([
+            models.ProcessingState(video=video, status=statuses[v % len(statuses)])
+            for v, video in enumerate(videos)
+        ])
+        models.Subtitle.objects.bulk_create([
+            models.Subtitle(video=video, language='fr') for video in videos
+        ])
+        models.VideoDocument.objects.bulk_create([
+            models.VideoDocument(
+                video=video,
+                public_id=video.public_id,
+                owner_id=video.owner_id,
+                processing_status=statuses[v % len(statuses)],
+                content='{}',
+            )
+            for v, video in enumerate(videos)
+        ])
+
+        models.Playlist.objects.bulk_create([
+            models.Playlist(name="playlist{}".format(p), owner=users[p % len(users)])
+            for p in range(cls.VIDEO_COUNT // 10)
+        ])
+        playlists = list(models.Playlist.objects.all())
+        cls.playlist = playlists[0]
+        models.Playlist.videos.through.objects.bulk_create([
+            models.Playlist.videos.through(playlist=playlists[v % len(playlists)], video=video)
+            for v, video in enumerate(videos)
+        ])
+
+        timestamp = int(time())
+        models.VideoUploadUrl.objects.bulk_create([
+            models.VideoUploadUrl(
+                owner=users[u % len(users)],
+                expires_at=timestamp + 3600 - 10 * u,
+                was_used=u % 3 == 0,
+            )
+            for u in range(cls.VIDEO_COUNT)
+        ])
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertNoFullScan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        for detail in plan:
+            match = re.match(r'^SCAN (TABLE )?(\w+)', detail)
+            if match and match.group(2) in self.SCANNED_TABLES:
+                self.fail("Full scan of {} in query plan {} of query: {}".format(
+                    match.group(2), plan, sql
+                ))
+
+    def get_queryset(self, viewset_class):
+        return viewset_class(request=Mock(user=self.user)).get_queryset()
+
+    def test_video_list(self):
+        queryset = self.get_queryset(views.VideoListViewSet).order_by('-video_id')
+        self.assertNoFullScan(queryset)
+        self.assertNoFullScan(queryset.filter(video__playlists__public_id=self.playlist.public_id))
+
+    def test_video_detail(self):
+        video = models.Video.objects.filter(owner=self.user).first()
+        self.assertNoFullScan(models.VideoDocument.objects.filter(owner=self.user, public_id=video.public_id))
+        self.assertNoFullScan(self.get_queryset(views.VideoViewSet).filter(public_id=video.public_id))
+
+    def test_video_document_rebuild(self):
+        video_ids = list(models.Video.objects.filter(owner=self.user).values_list('id', flat=True))
+        self.assertNoFullScan(models.Subtitle.objects.filter(video_id__in=video_ids).order_by('id'))
+
+    def test_subtitles(self):
+        subtitle = models.Subtitle.objects.filter(video__owner=self.user).first()
+        queryset = self.get_queryset(views.SubtitleViewSet)
+        self.assertNoFullScan(queryset)
+        self.assertNoFullScan(queryset.filter(public_id=subtitle.public_id))
+
+    def test_playlists(self):
+        self.assertNoFullScan(self.get_queryset(views.PlaylistViewSet))
+
+    def test_video_upload_urls(self):
+        self.assertNoFullScan(self.get_queryset(views.VideoUploadUrlViewSet))
+        self.assertNoFullScan(models.VideoUploadUrl.objects.available())
+        self.assertNoFullScan(models.VideoUploadUrl.objects.obsolete())
+
+    def test_restart_queue(self):
+        self.assertNoFullScan(
+            models.ProcessingState.objects.filter(
+                Q(restart_claimed_until__isnull=True) | Q(restart_claimed_until__lt=now()),
+                status=models.ProcessingState.STATUS_RESTART,
+            ).order_by('id').values_list('id', flat=True)[:100]
+        )
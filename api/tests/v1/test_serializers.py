@@ -0,0 +1,62 @@
+import json
+
+from django.core.urlresolvers import reverse
+
+from api.v1 import serializers
+from pipeline import models
+from pipeline.tests.utils import override_plugin_backend
+from pipeline.tests import factories
+from .base import BaseAuthenticatedTests
+
+
+@override_plugin_backend(
+    video_url=lambda video_id, format_name: "http://example.com/{}/{}.mp4".format(video_id, format_name),
+    subtitle_url=lambda video_id, subtitle_id, language: "http://example.com/{}/{}.{}.vtt".format(
+        video_id, subtitle_id, language
+    ),
+    thumbnail_url=lambda video_id, thumb_id: "http://example.com/{}/{}.jpg".format(video_id, thumb_id),
+    poster_frames_url=lambda video_id, poster_id: "http://example.com/{}/{}.vtt".format(video_id, poster_id),
+)
+class VideoDocumentsTests(BaseAuthenticatedTests):
+    """
+    Listed videos are rendered from video documents, and not with the
+    VideoSerializer: both representations must be identical.
+    """
+
+    def assertSameRepresentation(self, num_videos):
+        queryset = models.Video.objects.select_related(
+            'processing_state', 'metadata'
+        ).prefetch_related(
+            'subtitles', 'formats'
+        ).order_by('-id')
+        # Compare rendered json, and not python objects
+        expected = json.loads(json.dumps(serializers.VideoSerializer(queryset, many=True).data))
+        actual = self.client.get(reverse("api:v1:video-list")).json()
+        self.assertEqual(num_videos, len(actual))
+        self.assertEqual(expected, actual)
+
+    def test_parity_with_video_serializer(self):
+        video1 = factories.VideoFactory(title="video 1", owner=self.user)
+        video1.subtitles.create(language="fr")
+        video1.subtitles.create(language="en")
+        video1.formats.create(name="SD", bitrate=128)
+        video1.formats.create(name="HD", bitrate=256)
+        models.VideoMetadata.objects.create(video=video1, duration=42.5)
+        # Documents are rebuilt on save, and not on queryset updates
+        processing_state = video1.processing_state
+        processing_state.status = models.ProcessingState.STATUS_SUCCESS
+        processing_state.progress = 100
+        processing_state.save()
+
+        # Video without metadata, subtitles nor formats
+        video2 = factories.VideoFactory(title="video 2", owner=self.user)
+        video2.formats.create(name="SD", bitrate=64.5)
+
+        # Video without processing state
+        video3 = factories.VideoFactory(title="video 3", owner=self.user)
+        video3.processing_state.delete()
+
+        self.assertSameRepresentation(3)
+
+    def test_no_video(self):
+        self.assertSameRepresentation(0)
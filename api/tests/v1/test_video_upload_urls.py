@@ -104,6 +104,7 @@ class VideoUploadUrlTests(BaseAuthenticatedTests):
             start_transcoding=start_transcoding,
             iter_formats=Mock(return_value=[]),
             create_thumbnail=create_thumbnail,
+            create_poster_frames=Mock(),
         ):
             response = self.client.post(
                 reverse("api:v1:video-upload", kwargs={'video_id': video_upload_url.public_video_id}),
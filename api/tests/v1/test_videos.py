@@ -31,11 +31,9 @@ class VideosTests(BaseAuthenticatedTests):
     # 1) django session
     # 2) user authentication
     VIDEOS_LIST_NUM_QUERIES_AUTH = 2
-    # 3) video + transcoding job
-    VIDEOS_LIST_NUM_QUERIES_EMPTY_RESULT = VIDEOS_LIST_NUM_QUERIES_AUTH + 1
-    # 4) subtitles prefetch
-    # 5) formats prefetch
-    VIDEOS_LIST_NUM_QUERIES = VIDEOS_LIST_NUM_QUERIES_EMPTY_RESULT + 2
+    # 3) video documents: whatever the number of videos, subtitles and formats
+    VIDEOS_LIST_NUM_QUERIES = VIDEOS_LIST_NUM_QUERIES_AUTH + 1
+    VIDEOS_LIST_NUM_QUERIES_EMPTY_RESULT = VIDEOS_LIST_NUM_QUERIES
 
     def test_list_videos(self):
         url = reverse("api:v1:video-list")
@@ -72,6 +70,7 @@ class VideosTests(BaseAuthenticatedTests):
         factories.VideoFactory(public_id='videoid', title="Some title", owner=self.user)
         started_at = datetime(2016, 1, 1, 12, 13, 14, 1516, get_current_timezone())
         models.ProcessingState.objects.filter(video__public_id='videoid').update(started_at=started_at)
+        models.update_video_document('videoid')
 
         response = self.client.get(reverse('api:v1:video-detail', kwargs={'id': 'videoid'}))
         video = response.json()
@@ -113,15 +112,55 @@ class VideosTests(BaseAuthenticatedTests):
         self.assertEqual(200, response_list.status_code)
         self.assertEqual([], response_list.json())
 
-    def test_get_video_with_cache(self):
+    def test_get_video_reads_document(self):
         factories.VideoFactory(public_id="videoid", title="Some title", owner=self.user)
         with self.assertNumQueries(self.VIDEOS_LIST_NUM_QUERIES):
-            response1 = self.client.get(reverse('api:v1:video-detail', kwargs={'id': 'videoid'}))
-        with self.assertNumQueries(self.VIDEOS_LIST_NUM_QUERIES_AUTH):
-            response2 = self.client.get(reverse('api:v1:video-detail', kwargs={'id': 'videoid'}))
+            response = self.client.get(reverse('api:v1:video-detail', kwargs={'id': 'videoid'}))
 
-        self.assertEqual(200, response1.status_code)
-        self.assertEqual(200, response2.status_code)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("Some title", response.json()['title'])
+
+    def test_get_unknown_video(self):
+        response = self.client.get(reverse('api:v1:video-detail', kwargs={'id': 'unknownvideoid'}))
+        self.assertEqual(404, response.status_code)
+
+    def test_list_videos_after_update(self):
+        video = factories.VideoFactory(public_id="videoid", title="Some title", owner=self.user)
+        url = reverse("api:v1:video-list")
+        self.client.get(url)
+
+        video.title = "Other title"
+        video.save()
+        videos = self.client.get(url).json()
+
+        self.assertEqual("Other title", videos[0]['title'])
+
+    def test_list_videos_pagination(self):
+        for video_index in range(3):
+            factories.VideoFactory(public_id="videoid{}".format(video_index), owner=self.user)
+        url = reverse("api:v1:video-list")
+
+        response1 = self.client.get(url, data={'page_size': 2})
+        next_url = response1['Link'].split(';')[0].strip('<>')
+        response2 = self.client.get(next_url)
+
+        # Most recent videos come first
+        self.assertEqual(['videoid2', 'videoid1'], [video['id'] for video in response1.json()])
+        self.assertIn('rel="next"', response1['Link'])
+        self.assertEqual(['videoid0'], [video['id'] for video in response2.json()])
+        self.assertNotIn('rel="next"', response2['Link'])
+        self.assertIn('rel="previous"', response2['Link'])
+
+    def test_list_videos_pagination_is_stable_under_inserts(self):
+        for video_index in range(3):
+            factories.VideoFactory(public_id="videoid{}".format(video_index), owner=self.user)
+        url = reverse("api:v1:video-list")
+
+        response1 = self.client.get(url, data={'page_size': 2})
+        factories.VideoFactory(public_id="videoid3", owner=self.user)
+        response2 = self.client.get(response1['Link'].split(';')[0].strip('<>'))
+
+        self.assertEqual(['videoid0'], [video['id'] for video in response2.json()])
 
     def test_list_failed_videos(self):
         video = factories.VideoFactory(public_id="videoid", title='videotitle', owner=self.user)
@@ -142,19 +181,23 @@ class VideosTests(BaseAuthenticatedTests):
         )
         self.assertEqual(405, response.status_code) # method not allowed
 
-    @override_plugin_backend(
-        start_transcoding=lambda video_id: [],
-        iter_formats=lambda video_id: [],
-    )
+    @override_plugin_backend(upload_video=lambda video_id, file_object: None)
     def test_get_video_that_was_just_uploaded(self):
         factories.VideoUploadUrlFactory(
             public_video_id="videoid",
             expires_at=time() + 3600,
             owner=self.user
         )
+        # Transcoding has not started yet
+        with patch('pipeline.tasks.send_task'):
+            self.client.post(
+                reverse("api:v1:video-upload", kwargs={'video_id': 'videoid'}),
+                {'name': 'video.mp4', 'file': BytesIO(b'some video content')},
+            )
         response = self.client.get(reverse("api:v1:video-detail", kwargs={'id': 'videoid'}))
 
         self.assertEqual(200, response.status_code)
+        self.assertEqual('pending', response.json()['processing']['status'])
 
     def test_update_video_title(self):
         factories.VideoFactory(public_id="videoid", title='videotitle', owner=self.user)
@@ -227,6 +270,101 @@ class VideosTests(BaseAuthenticatedTests):
             },
         ], video['formats'])
 
+    def test_list_videos_reads_documents_only(self):
+        with override_plugin_backend(
+            video_url=lambda video_id, format_name: "http://example.com/{}/{}.mp4".format(video_id, format_name),
+            subtitle_url=lambda video_id, subtitle_id, language: "http://example.com/{}/{}.{}.vtt".format(
+                video_id, subtitle_id, language
+            ),
+        ):
+            for video_id in ["videoid1", "videoid2"]:
+                video = factories.VideoFactory(public_id=video_id, owner=self.user)
+                video.formats.create(name="SD", bitrate=128)
+                video.formats.create(name="HD", bitrate=256)
+                video.subtitles.create(language="fr", public_id=video_id + "sub")
+
+        # Asset urls were built when the videos were modified: the default
+        # backend, which cannot build urls, is not called.
+        with self.assertNumQueries(self.VIDEOS_LIST_NUM_QUERIES):
+            videos = self.client.get(reverse('api:v1:video-list')).json()
+
+        self.assertEqual(['videoid2', 'videoid1'], [video['id'] for video in videos])
+        self.assertEqual(
+            ["http://example.com/videoid2/SD.mp4", "http://example.com/videoid2/HD.mp4"],
+            [video_format['url'] for video_format in videos[0]['formats']]
+        )
+        self.assertEqual("http://example.com/videoid2/videoid2sub.fr.vtt", videos[0]['subtitles'][0]['url'])
+
+    def test_list_videos_urls_are_built_in_bulk(self):
+        video_urls = Mock(side_effect=lambda video_formats: [
+            "http://example.com/{}/{}.mp4".format(*args) for args in video_formats
+        ])
+        subtitle_urls = Mock(side_effect=lambda subtitles: [
+            "http://example.com/{}/{}.{}.vtt".format(*args) for args in subtitles
+        ])
+        thumbnail_urls = Mock(side_effect=lambda thumbnails: [
+            "http://example.com/{}/{}.jpg".format(*args) for args in thumbnails
+        ])
+        with override_plugin_backend(
+            video_urls=video_urls, subtitle_urls=subtitle_urls, thumbnail_urls=thumbnail_urls
+        ):
+            for video_id in ["videoid1", "videoid2"]:
+                video = factories.VideoFactory(
+                    public_id=video_id, public_thumbnail_id=video_id + "thumb", owner=self.user
+                )
+                video.formats.create(name="SD", bitrate=128)
+                video.formats.create(name="HD", bitrate=256)
+                video.subtitles.create(language="fr", public_id=video_id + "sub")
+            video_urls.reset_mock()
+            subtitle_urls.reset_mock()
+            thumbnail_urls.reset_mock()
+
+            # E.g: rebuild-video-documents command
+            models.rebuild_video_documents(models.Video.objects.all())
+
+        video_urls.assert_called_once()
+        subtitle_urls.assert_called_once()
+        thumbnail_urls.assert_called_once()
+        videos = self.client.get(reverse('api:v1:video-list')).json()
+        self.assertEqual(['videoid2', 'videoid1'], [video['id'] for video in videos])
+        self.assertEqual(
+            ["http://example.com/videoid2/SD.mp4", "http://example.com/videoid2/HD.mp4"],
+            [video_format['url'] for video_format in videos[0]['formats']]
+        )
+        self.assertEqual("http://example.com/videoid2/videoid2sub.fr.vtt", videos[0]['subtitles'][0]['url'])
+        self.assertEqual("http://example.com/videoid1/videoid1thumb.jpg", videos[1]['thumbnail'])
+
+    def test_list_videos_rebuilds_stale_documents(self):
+        video = factories.VideoFactory(public_id="videoid", owner=self.user)
+        # The default backend cannot build video urls
+        video.formats.create(name="SD", bitrate=128)
+
+        # Documents are not served without their urls
+        self.assertRaises(NotImplementedError, self.client.get, reverse('api:v1:video-list'))
+        self.assertRaises(
+            NotImplementedError,
+            self.client.get, reverse('api:v1:video-detail', kwargs={'id': 'videoid'})
+        )
+
+        with override_plugin_backend(
+            video_url=lambda video_id, format_name: "http://example.com/{}/{}.mp4".format(video_id, format_name)
+        ):
+            videos = self.client.get(reverse('api:v1:video-list')).json()
+        self.assertEqual("http://example.com/videoid/SD.mp4", videos[0]['formats'][0]['url'])
+        # The rebuilt document is served without calling the backend again
+        with self.assertNumQueries(self.VIDEOS_LIST_NUM_QUERIES):
+            video = self.client.get(reverse('api:v1:video-detail', kwargs={'id': 'videoid'})).json()
+        self.assertEqual("http://example.com/videoid/SD.mp4", video['formats'][0]['url'])
+
+    def test_get_video_duration(self):
+        video = factories.VideoFactory(public_id="videoid", owner=self.user)
+        models.VideoMetadata.objects.create(video=video, duration=42.5)
+
+        with self.assertNumQueries(self.VIDEOS_LIST_NUM_QUERIES):
+            video = self.client.get(reverse("api:v1:video-detail", kwargs={'id': 'videoid'})).json()
+
+        self.assertEqual(42.5, video['duration'])
+
     def test_list_videos_in_playlist(self):
         playlist = factories.PlaylistFactory(name="Funkadelic playlist", owner=self.user)
         video_in_playlist = factories.VideoFactory(owner=self.user)
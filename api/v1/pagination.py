@@ -0,0 +1,50 @@
+from rest_framework import pagination
+from rest_framework.response import Response
+
+
+class CursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination, from the most recent to the oldest objects. Pages are
+    delimited by an opaque cursor that encodes the id of the last listed
+    object, such that pages are stable under concurrent inserts, and listing a
+    page requires neither an OFFSET scan nor a COUNT query.
+
+    Pages are returned as plain lists, just like non-paginated lists. The urls
+    of the next and previous pages are passed in a Link header (RFC 5988), e.g:
+
+        Link: <http://example.com/api/v1/videos/?cursor=cD0xMjM%3D>; rel="next"
+
+    The number of objects per page may be set with the `page_size` query
+    parameter, up to `max_page_size`. Defaults to the PAGE_SIZE setting.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        return super(CursorPagination, self).paginate_queryset(queryset, request, view=view)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.__class__.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_paginated_response(self, data):
+        links = [
+            '<{}>; rel="{}"'.format(url, rel)
+            for url, rel in [(self.get_next_link(), 'next'), (self.get_previous_link(), 'previous')]
+            if url is not None
+        ]
+        headers = {'Link': ', '.join(links)} if links else None
+        return Response(data, headers=headers)
+
+
+class VideoDocumentPagination(CursorPagination):
+    """
+    Video documents are identified by the id of their video: pages of video
+    documents are delimited by the same cursors as pages of videos.
+    """
+    ordering = '-video_id'
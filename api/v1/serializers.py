@@ -1,12 +1,57 @@
 from time import time
 
 from django.contrib.auth.models import User
+from django.db.models import Manager
 from rest_framework import serializers
 
+from pipeline import backend
 from pipeline import models
 from . import utils
 
 
+def get_asset_url(serializer, urls_name, key, default):
+    """
+    Look up an asset url among the urls that were resolved by the root video
+    serializer. Serializers that are not nested in a video serializer, e.g:
+    subtitle serializers, fall back to the url property of the object.
+    """
+    asset_urls = serializer.context.get('asset_urls')
+    if asset_urls is not None:
+        url = getattr(asset_urls, urls_name).get(key)
+        if url is not None:
+            return url
+    return default()
+
+
+class AssetUrls(object):
+    """
+    Urls of the thumbnails, poster frames, subtitles and formats of a set of
+    videos. Urls are built with a single call to each of the bulk url methods
+    of the backend, instead of one backend call per url.
+
+    Subtitles and formats are expected to be prefetched.
+    """
+
+    def __init__(self, videos):
+        videos = list(videos)
+        subtitles = [
+            (video.public_id, subtitle.public_id, subtitle.language)
+            for video in videos for subtitle in video.subtitles.all()
+        ]
+        formats = [
+            (video.public_id, video_format.name)
+            for video in videos for video_format in video.formats.all()
+        ]
+        thumbnails = [(video.public_id, video.public_thumbnail_id) for video in videos]
+        poster_frames = [(video.public_id, video.public_poster_frames_id) for video in videos]
+
+        plugin_backend = backend.get()
+        self.subtitles = dict(zip(subtitles, plugin_backend.subtitle_urls(subtitles)))
+        self.formats = dict(zip(formats, plugin_backend.video_urls(formats)))
+        self.thumbnails = dict(zip(thumbnails, plugin_backend.thumbnail_urls(thumbnails)))
+        self.poster_frames = dict(zip(poster_frames, plugin_backend.poster_frames_urls(poster_frames)))
+
+
 class PlaylistSerializer(serializers.ModelSerializer):
     id = serializers.CharField(source='public_id', read_only=True)
     owner = serializers.HiddenField(default=serializers.CurrentUserDefault())
@@ -17,7 +62,7 @@ class PlaylistSerializer(serializers.ModelSerializer):
 
 
 class ProcessingStateSerializer(serializers.ModelSerializer):
-    started_at = serializers.DateTimeField(format="%Y-%m-%dT%H:%M:%SZ")
+    started_at = serializers.DateTimeField(format=models.VideoDocument.DATETIME_FORMAT)
 
     class Meta:
         fields = ('status', 'progress', 'started_at')
@@ -27,12 +72,17 @@ class ProcessingStateSerializer(serializers.ModelSerializer):
 class SubtitleSerializer(serializers.ModelSerializer):
     id = serializers.CharField(source='public_id', read_only=True)
     video_id = serializers.CharField(source='video__id', read_only=True)
-    url = serializers.CharField(read_only=True)
+    url = serializers.SerializerMethodField()
 
     class Meta:
         fields = ('id', 'language', 'video_id', 'url')
         model = models.Subtitle
 
+    def get_url(self, obj):
+        return get_asset_url(
+            self, 'subtitles', (obj.video.public_id, obj.public_id, obj.language), lambda: obj.url
+        )
+
 
 class VideoUploadUrlSerializer(serializers.ModelSerializer):
     class RelatedPlaylistField(serializers.SlugRelatedField):
@@ -69,22 +119,52 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class VideoFormatSerializer(serializers.ModelSerializer):
-    url = serializers.CharField(read_only=True)
+    url = serializers.SerializerMethodField()
     bitrate = serializers.FloatField(read_only=True)
 
     class Meta:
         fields = ('name', 'url', 'bitrate',)
         model = models.VideoFormat
 
+    def get_url(self, obj):
+        return get_asset_url(self, 'formats', (obj.video.public_id, obj.name), lambda: obj.url)
+
+
+class VideoListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        # Resolve the asset urls of all videos at once
+        videos = list(data.all() if isinstance(data, Manager) else data)
+        self.context['asset_urls'] = AssetUrls(videos)
+        return super(VideoListSerializer, self).to_representation(videos)
+
 
 class VideoSerializer(serializers.ModelSerializer):
     id = serializers.CharField(source='public_id', read_only=True)
     processing = ProcessingStateSerializer(source='processing_state', read_only=True)
     subtitles = SubtitleSerializer(many=True, read_only=True)
     formats = VideoFormatSerializer(many=True, read_only=True)
-    thumbnail = serializers.CharField(source='thumbnail_url', read_only=True)
-    poster_frames = serializers.CharField(source='poster_frames_url', read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+    poster_frames = serializers.SerializerMethodField()
+    duration = serializers.FloatField(read_only=True)
 
     class Meta:
-        fields = ('id', 'title', 'processing', 'subtitles', 'formats', 'thumbnail', 'poster_frames',)
+        fields = ('id', 'title', 'processing', 'subtitles', 'formats', 'thumbnail', 'poster_frames', 'duration',)
         model = models.Video
+        list_serializer_class = VideoListSerializer
+
+    def to_representation(self, instance):
+        if self.parent is None:
+            self.context['asset_urls'] = AssetUrls([instance])
+        return super(VideoSerializer, self).to_representation(instance)
+
+    def get_thumbnail(self, obj):
+        return get_asset_url(
+            self, 'thumbnails', (obj.public_id, obj.public_thumbnail_id), lambda: obj.thumbnail_url
+        )
+
+    def get_poster_frames(self, obj):
+        return get_asset_url(
+            self, 'poster_frames', (obj.public_id, obj.public_poster_frames_id), lambda: obj.poster_frames_url
+        )
+
@@ -2,6 +2,7 @@
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import transaction
+from django.shortcuts import get_object_or_404
 import django_filters
 from rest_framework import filters
 from rest_framework import mixins
@@ -14,10 +15,10 @@ from rest_framework.response import Response
 from rest_framework.schemas import SchemaGenerator
 from rest_framework_swagger.renderers import OpenAPIRenderer, SwaggerUIRenderer
 
-from pipeline import cache
 from pipeline import exceptions
 from pipeline import models
 from pipeline import tasks
+from . import pagination
 from . import serializers
 
 
@@ -54,6 +55,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
     permission_classes = PERMISSION_CLASSES
 
     serializer_class = serializers.PlaylistSerializer
+    pagination_class = pagination.CursorPagination
 
     lookup_field = 'public_id'
     lookup_url_kwarg = 'id'
@@ -164,8 +166,10 @@ class UserViewSet(mixins.RetrieveModelMixin,
     authentication_classes = AUTHENTICATION_CLASSES
     permission_classes = (IsAuthenticated, IsAdminUser)
 
-    queryset = User.objects.all().order_by('-date_joined').select_related('auth_token')
+    # Users are listed from the most recent to the oldest, by pagination
+    queryset = User.objects.all().select_related('auth_token')
     serializer_class = serializers.UserSerializer
+    pagination_class = pagination.CursorPagination
 
     lookup_field = 'username'
     lookup_url_kwarg = 'username'
@@ -176,12 +180,12 @@ class UserViewSet(mixins.RetrieveModelMixin,
 
 class VideoFilter(filters.FilterSet):
     """
-    Filter videos by playlist public id.
+    Filter video documents by playlist public id.
     """
-    playlist_id = django_filters.CharFilter(name="playlists", lookup_expr="public_id")
+    playlist_id = django_filters.CharFilter(name="video__playlists", lookup_expr="public_id")
 
     class Meta:
-        model = models.Video
+        model = models.VideoDocument
         fields = ['playlist_id']
 
 
@@ -190,7 +194,7 @@ class VideoQuerysetMixin(object):
     def get_queryset(self):
         # Note that here we do not exclude failed videos
         queryset = models.Video.objects.select_related(
-            'processing_state'
+            'processing_state', 'metadata'
         ).prefetch_related(
             'subtitles', 'formats'
         ).filter(
@@ -201,11 +205,13 @@ class VideoQuerysetMixin(object):
 
 
 class VideoListViewSet(mixins.ListModelMixin,
-                       VideoQuerysetMixin,
                        viewsets.GenericViewSet):
     """
     List available videos. Note that you may obtain only the videos that belong
     to a certain playlist by passing the argument `?playlist_id=xxxx`.
+
+    Videos are paginated, from the most recent to the oldest: the url of the
+    next page is passed in the Link header of the response.
     """
     # Similar to a generic model viewset, but without creation features. Video
     # creation is only available through upload.
@@ -214,16 +220,26 @@ class VideoListViewSet(mixins.ListModelMixin,
     permission_classes = PERMISSION_CLASSES
 
     serializer_class = serializers.VideoSerializer
+    pagination_class = pagination.VideoDocumentPagination
 
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = VideoFilter
 
 
     def get_queryset(self):
-        return super(VideoListViewSet, self).get_queryset().exclude(
-            processing_state__status=models.ProcessingState.STATUS_FAILED
+        return models.VideoDocument.objects.filter(
+            owner=self.request.user
+        ).exclude(
+            processing_status=models.ProcessingState.STATUS_FAILED
         )
 
+    def list(self, request, *args, **kwargs):
+        # Videos are listed from their documents, which are maintained on
+        # write: there is nothing to serialize.
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        documents = models.refresh_stale_video_documents(page)
+        return self.get_paginated_response([document.data for document in documents])
+
 
 class VideoViewSet(mixins.RetrieveModelMixin,
                    mixins.UpdateModelMixin,
@@ -247,16 +263,14 @@ class VideoViewSet(mixins.RetrieveModelMixin,
 
 
     def retrieve(self, request, *args, **kwargs):
-        # We override the `retrieve` method in order to cache API results for
-        # /video/<videoid> calls.
-        public_video_id = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
-        response_data = cache.get(public_video_id)
-        if response_data is None:
-            instance = self.get_object()
-            serializer = self.get_serializer(instance)
-            response_data = serializer.data
-            cache.set(public_video_id, response_data)
-        return Response(response_data)
+        # We override the `retrieve` method in order to read API results for
+        # /video/<videoid> calls from video documents, just like video lists.
+        document = get_object_or_404(
+            models.VideoDocument.objects.filter(owner=request.user),
+            public_id=self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        )
+        document = models.refresh_stale_video_documents([document])[0]
+        return Response(document.data)
 
     def perform_destroy(self, instance):
         # Delete external resources
@@ -336,6 +350,7 @@ class VideoUploadUrlViewSet(viewsets.ModelViewSet):
     permission_classes = PERMISSION_CLASSES
 
     serializer_class = serializers.VideoUploadUrlSerializer
+    pagination_class = pagination.CursorPagination
 
     lookup_field = 'public_video_id'
     lookup_url_kwarg = 'id'
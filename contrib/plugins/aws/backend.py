@@ -1,4 +1,5 @@
 from tempfile import NamedTemporaryFile
+import threading
 
 from botocore.exceptions import ClientError
 import boto3
@@ -6,6 +7,8 @@ from django.conf import settings
 
 import pipeline.backend
 from pipeline.exceptions import TranscodingFailed
+import pipeline.media
+import pipeline.models
 import pipeline.utils
 
 
@@ -19,6 +22,10 @@ class Backend(pipeline.backend.BaseBackend):
         self._session = None
         self._s3_client = None
         self._elastictranscoder_client = None
+        # The backend is shared by all threads of a process (see
+        # `pipeline.backend.get`). Boto3 clients, and their connection pools,
+        # are thread-safe, but sessions are not: they are created only once.
+        self._clients_lock = threading.RLock()
 
     @property
     def session(self):
@@ -26,22 +33,30 @@ class Backend(pipeline.backend.BaseBackend):
         Boto3 authenticated session
         """
         if self._session is None:
-            self._session = boto3.Session(
-                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
-            )
+            with self._clients_lock:
+                if self._session is None:
+                    self._session = boto3.Session(
+                        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
+                    )
         return self._session
 
     @property
     def s3_client(self):
         if self._s3_client is None:
-            self._s3_client = self.session.client('s3', region_name=settings.AWS_REGION)
+            with self._clients_lock:
+                if self._s3_client is None:
+                    self._s3_client = self.session.client('s3', region_name=settings.AWS_REGION)
         return self._s3_client
 
     @property
     def elastictranscoder_client(self):
         if self._elastictranscoder_client is None:
-            self._elastictranscoder_client = self.session.client('elastictranscoder', region_name=settings.AWS_REGION)
+            with self._clients_lock:
+                if self._elastictranscoder_client is None:
+                    self._elastictranscoder_client = self.session.client(
+                        'elastictranscoder', region_name=settings.AWS_REGION
+                    )
         return self._elastictranscoder_client
 
     @classmethod
@@ -81,6 +96,17 @@ class Backend(pipeline.backend.BaseBackend):
             return objects['Contents'][0]['Key']
         return None
 
+    def get_src_url(self, src_file_key):
+        """
+        Temporary url from which the source file can be downloaded, e.g: by
+        ffprobe.
+        """
+        return self.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': settings.S3_PRIVATE_BUCKET, 'Key': src_file_key},
+            ExpiresIn=3600
+        )
+
     def _get_download_base_url(self):
         cloudfront = getattr(settings, 'CLOUDFRONT_DOMAIN_NAME', None)
         if cloudfront:
@@ -119,13 +145,31 @@ class Backend(pipeline.backend.BaseBackend):
             Key=self.get_video_folder_key(public_video_id) + 'src/' + file_object.name,
         )
 
-    def start_transcoding(self, public_video_id):
+    def probe_source(self, public_video_id):
+        src_file_key = self.get_src_file_key(public_video_id)
+        if src_file_key is None:
+            return None
+        return pipeline.media.probe(self.get_src_url(src_file_key))
+
+    def start_transcoding(self, public_video_id, skip_formats=None):
         pipeline_id = settings.ELASTIC_TRANSCODER_PIPELINE_ID
         src_file_key = self.get_src_file_key(public_video_id)
+        presets = self.select_presets(public_video_id, src_file_key)
+
+        # If the thumbnails preset was skipped, generate thumbnails with the
+        # preset that has the highest bitrate
+        thumbnails_preset_id = settings.ELASTIC_TRANSCODER_THUMBNAILS_PRESET
+        preset_ids = [preset_id for _resolution, preset_id, _bitrate in presets]
+        all_preset_ids = [preset_id for _resolution, preset_id, _bitrate in settings.ELASTIC_TRANSCODER_PRESETS]
+        if thumbnails_preset_id in all_preset_ids and thumbnails_preset_id not in preset_ids:
+            thumbnails_preset_id = max(presets, key=lambda preset: preset[2])[1]
+
+        # Formats that were already transcoded are not transcoded again
+        presets = [preset for preset in presets if preset[0] not in (skip_formats or [])]
 
         # Start transcoding jobs
         jobs = []
-        for resolution, preset_id, _bitrate in settings.ELASTIC_TRANSCODER_PRESETS:
+        for resolution, preset_id, _bitrate in presets:
             output = {
                 # Note that the transcoded video should have public-read
                 # permissions or be accessible by cloudfront
@@ -133,7 +177,7 @@ class Backend(pipeline.backend.BaseBackend):
                 'PresetId': preset_id
             }
             # Generate thumbnails
-            if preset_id == settings.ELASTIC_TRANSCODER_THUMBNAILS_PRESET:
+            if preset_id == thumbnails_preset_id:
                 output['ThumbnailPattern'] = self.get_video_folder_key(public_video_id) + 'thumbs/{count}'
 
             job = self.elastictranscoder_client.create_job(
@@ -144,6 +188,70 @@ class Backend(pipeline.backend.BaseBackend):
             jobs.append(job['Job'])
         return jobs
 
+    def get_job_formats(self, job):
+        return [
+            resolution for resolution, preset_id, _bitrate in settings.ELASTIC_TRANSCODER_PRESETS
+            if preset_id == job['Output']['PresetId']
+        ]
+
+    def get_format_checksum(self, public_video_id, format_name):
+        """
+        The checksum of a transcoded video is the ETag of the S3 object.
+        """
+        try:
+            response = self.s3_client.head_object(
+                Bucket=settings.S3_BUCKET,
+                Key=self.get_video_key(public_video_id, format_name)
+            )
+        except ClientError:
+            return None
+        return response['ETag']
+
+    def select_presets(self, public_video_id, src_file_key):
+        """
+        If ELASTIC_TRANSCODER_SKIP_UPSCALING is True, skip the presets that
+        would be upscaled from the source video, as probed before transcoding.
+        Transcoded videos of skipped presets are deleted.
+
+        Returns:
+            presets (list): selection of ELASTIC_TRANSCODER_PRESETS
+        """
+        presets = settings.ELASTIC_TRANSCODER_PRESETS
+        if not getattr(settings, 'ELASTIC_TRANSCODER_SKIP_UPSCALING', False):
+            return presets
+
+        media_info = pipeline.models.VideoMetadata.objects.get_media_info(public_video_id)
+        if media_info is None:
+            # Source could not be probed before transcoding
+            media_info = pipeline.media.probe(self.get_src_url(src_file_key))
+        source_size = pipeline.media.get_video_size(media_info)
+        if source_size is None:
+            return presets
+
+        selected_resolutions = pipeline.utils.select_formats(
+            [(resolution, self.get_preset_size(preset_id)) for resolution, preset_id, _bitrate in presets],
+            source_size
+        )
+        for resolution, _preset_id, _bitrate in presets:
+            if resolution not in selected_resolutions:
+                self.s3_client.delete_object(
+                    Bucket=settings.S3_BUCKET,
+                    Key=self.get_video_key(public_video_id, resolution)
+                )
+        return [preset for preset in presets if preset[0] in selected_resolutions]
+
+    def get_preset_size(self, preset_id):
+        """
+        Returns the (max width, max height) of an Elastic Transcoder preset, or
+        None if it is undefined.
+        """
+        video = self.elastictranscoder_client.read_preset(Id=preset_id)['Preset']['Video']
+        try:
+            return int(video['MaxWidth']), int(video['MaxHeight'])
+        except (KeyError, ValueError):
+            # Sizes may be 'auto'
+            return None
+
     def check_progress(self, job):
         job_id = job['Id']
         job_update = self.elastictranscoder_client.read_job(Id=job_id)
@@ -249,3 +357,23 @@ class Backend(pipeline.backend.BaseBackend):
     def thumbnail_url(self, video_id, thumb_id):
         # Use the first generated thumbnail as the video thumbnail
         return self._get_download_base_url() + '/' + self.get_thumbnail_key(video_id, thumb_id)
+
+    def video_urls(self, video_formats):
+        base_url = self._get_download_base_url() + '/'
+        return [
+            base_url + self.VIDEO_KEY_PATTERN.format(video_id=video_id, resolution=format_name)
+            for video_id, format_name in video_formats
+        ]
+
+    def subtitle_urls(self, subtitles):
+        base_url = self._get_download_base_url() + '/'
+        return [
+            base_url + self.SUBTITLE_KEY_PATTERN.format(
+                video_id=video_id, subtitle_id=subtitle_id, language=language
+            )
+            for video_id, subtitle_id, language in subtitles
+        ]
+
+    def thumbnail_urls(self, thumbnails):
+        base_url = self._get_download_base_url() + '/'
+        return [base_url + self.get_thumbnail_key(video_id, thumb_id) for video_id, thumb_id in thumbnails]
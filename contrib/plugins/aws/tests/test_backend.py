@@ -68,6 +68,25 @@ class VideoUploadUrlTests(TestCase):
         url = backend.video_url('videoid', 'SD')
         self.assertEqual("https://cloudfrontid.cloudfront.net/videos/videoid/SD.mp4", url)
 
+    def test_bulk_urls(self):
+        backend = aws_backend.Backend()
+        video_formats = [('videoid1', 'SD'), ('videoid2', 'HD')]
+        subtitles = [('videoid1', 'subid', 'fr')]
+        thumbnails = [('videoid1', 'thumbid1'), ('videoid2', 'thumbid2')]
+
+        self.assertEqual(
+            [backend.video_url(*args) for args in video_formats],
+            backend.video_urls(video_formats)
+        )
+        self.assertEqual(
+            [backend.subtitle_url(*args) for args in subtitles],
+            backend.subtitle_urls(subtitles)
+        )
+        self.assertEqual(
+            [backend.thumbnail_url(*args) for args in thumbnails],
+            backend.thumbnail_urls(thumbnails)
+        )
+
 
 @utils.override_s3_settings
 class TranscodeTests(TestCase):
@@ -132,6 +151,81 @@ class TranscodeTests(TestCase):
             },
         )
 
+    @override_settings(
+        ELASTIC_TRANSCODER_PIPELINE_ID='pipelineid',
+        ELASTIC_TRANSCODER_PRESETS=[('SD', 'sdpresetid', 128), ('HD', 'presetid-000001', 256)],
+        ELASTIC_TRANSCODER_THUMBNAILS_PRESET='presetid-000001'
+    )
+    def test_start_transcoding_skip_formats(self):
+        create_job_fixture = utils.load_json_fixture('elastictranscoder_create_job.json')
+        create_job_fixture['Job']['Output']['PresetId'] = 'presetid-000001'
+        backend = aws_backend.Backend()
+        backend.get_src_file_key = Mock(return_value='videos/videoid/src/Some video file.mpg')
+        backend._elastictranscoder_client = Mock(
+            create_job=Mock(return_value=create_job_fixture),
+        )
+
+        jobs = backend.start_transcoding('videoid', skip_formats=['SD'])
+
+        self.assertEqual(1, len(jobs))
+        self.assertEqual(['HD'], backend.get_job_formats(jobs[0]))
+        backend.elastictranscoder_client.create_job.assert_called_once_with(
+            PipelineId='pipelineid',
+            Input={'Key': 'videos/videoid/src/Some video file.mpg'},
+            Output={
+                'PresetId': 'presetid-000001',
+                'Key': 'videos/videoid/HD.mp4',
+                'ThumbnailPattern': 'videos/videoid/thumbs/{count}'
+            },
+        )
+
+    def test_get_format_checksum(self):
+        backend = aws_backend.Backend()
+        backend._s3_client = Mock(head_object=Mock(return_value={'ETag': '"etag"'}))
+
+        self.assertEqual('"etag"', backend.get_format_checksum('videoid', 'SD'))
+        backend.s3_client.head_object.side_effect = ClientError({'Error': {}}, 'head_object')
+        self.assertIsNone(backend.get_format_checksum('videoid', 'SD'))
+
+    @override_settings(
+        ELASTIC_TRANSCODER_PIPELINE_ID='pipelineid',
+        ELASTIC_TRANSCODER_PRESETS=[('SD', 'sdpresetid', 128), ('HD', 'hdpresetid', 256)],
+        ELASTIC_TRANSCODER_THUMBNAILS_PRESET='hdpresetid',
+        ELASTIC_TRANSCODER_SKIP_UPSCALING=True,
+    )
+    @patch('pipeline.media.probe', return_value={'streams': [{'codec_type': 'video', 'width': 854, 'height': 480}]})
+    def test_start_transcoding_skips_upscaled_presets(self, mock_probe):
+        create_job_fixture = utils.load_json_fixture('elastictranscoder_create_job.json')
+        preset_sizes = {
+            'sdpresetid': {'MaxWidth': '854', 'MaxHeight': '480'},
+            'hdpresetid': {'MaxWidth': '1280', 'MaxHeight': '720'},
+        }
+        backend = aws_backend.Backend()
+        backend.get_src_file_key = Mock(return_value='videos/videoid/src/Some video file.mpg')
+        backend._s3_client = Mock(generate_presigned_url=Mock(return_value='https://presignedurl'))
+        backend._elastictranscoder_client = Mock(
+            create_job=Mock(return_value=create_job_fixture),
+            read_preset=lambda Id: {'Preset': {'Video': preset_sizes[Id]}},
+        )
+
+        jobs = backend.start_transcoding('videoid')
+
+        self.assertEqual(1, len(jobs))
+        mock_probe.assert_called_once_with('https://presignedurl')
+        # SD + Thumbnails
+        backend.elastictranscoder_client.create_job.assert_called_once_with(
+            PipelineId='pipelineid',
+            Input={'Key': 'videos/videoid/src/Some video file.mpg'},
+            Output={
+                'PresetId': 'sdpresetid',
+                'Key': 'videos/videoid/SD.mp4',
+                'ThumbnailPattern': 'videos/videoid/thumbs/{count}'
+            },
+        )
+        backend.s3_client.delete_object.assert_called_once_with(
+            Bucket='publics3bucket', Key='videos/videoid/HD.mp4'
+        )
+
     def test_check_progress(self):
         job = utils.load_json_fixture('elastictranscoder_create_job.json')
         read_job_fixture = utils.load_json_fixture('elastictranscoder_read_job_complete.json')
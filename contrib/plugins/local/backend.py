@@ -8,13 +8,24 @@ from django.conf import settings
 
 from pipeline.backend import BaseBackend
 import pipeline.exceptions
+import pipeline.media
+import pipeline.models
+import pipeline.utils
+from . import progress
 from . import tasks
+from . import utils
 
 
 class Backend(BaseBackend):
 
     THUMBNAILS_DIRNAME = "thumbs"
     SUBTITLES_DIRNAME = "subs"
+    SEGMENTS_DIRNAME = "segments"
+    HLS_DIRNAME = "hls"
+    HLS_MASTER_PLAYLIST_NAME = "master.m3u8"
+    HLS_PLAYLIST_NAME = "index.m3u8"
+    # Name of the format associated to the HLS master playlist
+    HLS_FORMAT_NAME = "HLS"
 
     @staticmethod
     def make_file_path(*args):
@@ -27,6 +38,17 @@ class Backend(BaseBackend):
             os.makedirs(directory)
         return path
 
+    @staticmethod
+    def make_dir(*args):
+        """
+        Same as get_file_path, for directories. Create the directory if it does
+        not exist.
+        """
+        path = Backend.get_file_path(*args)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
     @staticmethod
     def get_video_file_path(video_id, video_format):
         return Backend.get_file_path(video_id, Backend.get_video_file_name(video_format))
@@ -62,6 +84,26 @@ class Backend(BaseBackend):
     def get_poster_frames_file_name(poster_id):
         return "{}.vtt".format(poster_id)
 
+    @staticmethod
+    def get_hls_dir(video_id, format_name):
+        """
+        Directory that contains the HLS playlist and segments of a single format.
+        """
+        return Backend.get_file_path(video_id, Backend.HLS_DIRNAME, format_name)
+
+    @staticmethod
+    def get_hls_file_path(video_id, path):
+        """
+        Raises ValueError if `path` is not inside the HLS directory of the
+        video: HLS paths are passed by clients, and they must not give access
+        to other files, such as the source videos.
+        """
+        hls_dir = Backend.get_file_path(video_id, Backend.HLS_DIRNAME)
+        file_path = Backend.get_file_path(video_id, Backend.HLS_DIRNAME, path)
+        if not file_path.startswith(hls_dir + os.sep):
+            raise ValueError("Cannot access path {} outside of {}".format(file_path, hls_dir))
+        return file_path
+
     @staticmethod
     def get_file_path(*args):
         """
@@ -106,6 +148,14 @@ class Backend(BaseBackend):
         self._rm(video_id)
 
     def video_url(self, video_id, format_name):
+        if format_name == self.HLS_FORMAT_NAME:
+            return urllib.parse.urljoin(
+                getattr(settings, 'ASSETS_ROOT_URL', ''),
+                reverse("backend:storage-hls", kwargs={
+                    'video_id': video_id,
+                    'path': self.HLS_MASTER_PLAYLIST_NAME
+                })
+            )
         return urllib.parse.urljoin(
             getattr(settings, 'ASSETS_ROOT_URL', ''),
             reverse("backend:storage-video", kwargs={'video_id': video_id, 'format_name': format_name})
@@ -142,35 +192,247 @@ class Backend(BaseBackend):
     def delete_thumbnail(self, video_id, thumb_id):
         self._rm(video_id, self.THUMBNAILS_DIRNAME, self.get_thumbnail_file_name(thumb_id))
 
-    def start_transcoding(self, video_id):
-        # Note that this will trigger a KeyError if the file does not exist
-        src_path = glob(self.get_file_path(video_id, "src", "*"))[0]
+    def probe_source(self, video_id):
+        return pipeline.media.probe(self._get_src_file_path(video_id))
+
+    def start_transcoding(self, video_id, skip_formats=None):
+        src_path = self._get_src_file_path(video_id)
+        media_info = self._get_source_media_info(video_id, src_path)
+        formats = self._select_formats(video_id, media_info)
+        transcoded_formats = [
+            (format_name, ffmpeg_settings) for format_name, ffmpeg_settings in formats
+            if format_name not in (skip_formats or [])
+        ]
+
+        # Transcoded videos will be packaged in HLS format, too. The HLS
+        # playlists of skipped formats are kept.
+        hls_dirs = {format_name: None for format_name, _ffmpeg_settings in transcoded_formats}
+        for format_name, _ffmpeg_settings in transcoded_formats:
+            self._rm(video_id, self.HLS_DIRNAME, format_name)
+        if getattr(settings, 'FFMPEG_HLS', False):
+            self._write_hls_master_playlist(video_id, formats)
+            hls_dirs = {
+                format_name: self.make_dir(video_id, self.HLS_DIRNAME, format_name)
+                for format_name, _ffmpeg_settings in transcoded_formats
+            }
+        else:
+            self._rm(video_id, self.HLS_DIRNAME, self.HLS_MASTER_PLAYLIST_NAME)
+        if not transcoded_formats:
+            return []
+
+        segment_duration = getattr(settings, 'FFMPEG_SEGMENT_DURATION', None)
+        if segment_duration and (pipeline.media.get_duration(media_info) or 0) > 2 * segment_duration:
+            # Long videos are transcoded in parallel, segment by segment
+            return self._start_segmented_transcoding(
+                video_id, src_path, transcoded_formats, hls_dirs, segment_duration
+            )
+
+        if getattr(settings, 'FFMPEG_SINGLE_PASS', False):
+            # Decode the source only once for all formats
+            outputs = [
+                (self.get_video_file_path(video_id, format_name), ffmpeg_settings)
+                for format_name, ffmpeg_settings in transcoded_formats
+            ]
+            async_result = tasks.ffmpeg_transcode_video_multi.delay(
+                src_path, outputs, video_id=video_id,
+                hls_dirs=[hls_dirs[format_name] for format_name, _ffmpeg_settings in transcoded_formats],
+                media_info=media_info
+            )
+            return [Job(async_result.id, [format_name for format_name, _ffmpeg_settings in transcoded_formats])]
+
         jobs = []
-        for format_name, ffmpeg_settings in settings.FFMPEG_PRESETS.items():
+        for format_name, ffmpeg_settings in transcoded_formats:
             dst_path = self.get_video_file_path(video_id, format_name)
-            async_result = tasks.ffmpeg_transcode_video.delay(src_path, dst_path, ffmpeg_settings)
-            jobs.append(async_result)
+            async_result = tasks.ffmpeg_transcode_video.delay(
+                src_path, dst_path, ffmpeg_settings, video_id=video_id, hls_dir=hls_dirs[format_name],
+                media_info=media_info
+            )
+            jobs.append(Job(async_result.id, [format_name]))
         return jobs
 
+    def get_job_formats(self, job):
+        return job.format_names
+
+    def clean_transcoding(self, video_id):
+        # The source segments are shared by all formats, and the transcoded
+        # segments of failed jobs are never concatenated.
+        self._rm(video_id, self.SEGMENTS_DIRNAME)
+
+    def get_format_checksum(self, video_id, format_name):
+        return utils.file_checksum(self.get_video_file_path(video_id, format_name))
+
+    def _get_src_file_path(self, video_id):
+        # Note that this will trigger an IndexError if the file does not exist
+        return glob(self.get_file_path(video_id, "src", "*"))[0]
+
+    @staticmethod
+    def _get_source_media_info(video_id, src_path):
+        """
+        Source video properties, as probed before transcoding. The source file
+        is probed again only if it could not be probed then.
+        """
+        return (
+            pipeline.models.VideoMetadata.objects.get_media_info(video_id) or
+            pipeline.media.probe(src_path)
+        )
+
+    def _select_formats(self, video_id, media_info):
+        """
+        Select the FFMPEG_PRESETS formats that would not be upscaled from the
+        source video, unless FFMPEG_SKIP_UPSCALING is False. Existing files of
+        skipped formats are removed.
+
+        Returns:
+            formats (list): (format_name, ffmpeg_settings) tuples
+        """
+        formats = list(settings.FFMPEG_PRESETS.items())
+        if not getattr(settings, 'FFMPEG_SKIP_UPSCALING', True):
+            return formats
+
+        selected_format_names = pipeline.utils.select_formats(
+            [
+                (format_name, utils.parse_size(ffmpeg_settings.get('size')))
+                for format_name, ffmpeg_settings in formats
+            ],
+            pipeline.media.get_video_size(media_info)
+        )
+        for format_name, _ffmpeg_settings in formats:
+            if format_name not in selected_format_names:
+                self._rm(video_id, self.get_video_file_name(format_name))
+        return [
+            (format_name, ffmpeg_settings) for format_name, ffmpeg_settings in formats
+            if format_name in selected_format_names
+        ]
+
+    def _start_segmented_transcoding(self, video_id, src_path, formats, hls_dirs, segment_duration):
+        """
+        Split the source video in segments, and create one transcoding task per
+        segment and per format. The last segment task of each format to finish
+        concatenates the transcoded segments. Segments are removed once all
+        jobs are finished (see `clean_transcoding`).
+        """
+        self._rm(video_id, self.SEGMENTS_DIRNAME)
+        src_segments_dir = self.make_dir(video_id, self.SEGMENTS_DIRNAME, 'src')
+        src_segment_paths = tasks.ffmpeg_split_video(src_path, src_segments_dir, segment_duration)
+
+        jobs = []
+        for format_name, ffmpeg_settings in formats:
+            dst_segments_dir = self.make_dir(video_id, self.SEGMENTS_DIRNAME, format_name)
+            dst_segment_paths = [
+                os.path.join(dst_segments_dir, os.path.basename(path).rsplit('.', 1)[0] + '.mp4')
+                for path in src_segment_paths
+            ]
+            segment_ids = [
+                tasks.ffmpeg_transcode_segment.delay(
+                    src_segment_path, dst_segment_path, ffmpeg_settings,
+                    dst_segment_paths, self.get_video_file_path(video_id, format_name),
+                    video_id=video_id, hls_dir=hls_dirs[format_name]
+                ).id for src_segment_path, dst_segment_path in zip(src_segment_paths, dst_segment_paths)
+            ]
+            jobs.append(SegmentedJob(segment_ids, [format_name]))
+        return jobs
+
+    def _write_hls_master_playlist(self, video_id, formats):
+        """
+        The master playlist lists the playlists of all formats, which are
+        written by the transcoding tasks.
+        """
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+        for format_name, ffmpeg_settings in formats:
+            lines.append('#EXT-X-STREAM-INF:BANDWIDTH={},RESOLUTION={}'.format(
+                format_bitrate(ffmpeg_settings), ffmpeg_settings['size']
+            ))
+            lines.append('{}/{}'.format(format_name, self.HLS_PLAYLIST_NAME))
+        master_playlist_path = self.make_file_path(video_id, self.HLS_DIRNAME, self.HLS_MASTER_PLAYLIST_NAME)
+        with open(master_playlist_path, 'w') as master_playlist:
+            master_playlist.write('\n'.join(lines) + '\n')
+
     def check_progress(self, job):
+        result = self.check_progress_many([job])[0]
+        if isinstance(result, pipeline.exceptions.TranscodingFailed):
+            raise result
+        return result
+
+    def check_progress_many(self, jobs):
+        """
+        Here, jobs are Job or SegmentedJob objects. Their progress and final
+        state are stored by the ffmpeg tasks (see `progress.track`): the
+        progress of the tasks of all jobs is fetched in a single cache request.
+        Jobs that are over are not checked again, so that the states of their
+        tasks are deleted.
         """
-        Here, the job is in fact a celery AsyncResult.
+        job_task_ids = [get_task_ids(job) for job in jobs]
+        states = progress.get_states([task_id for task_ids in job_task_ids for task_id in task_ids])
+        results = []
+        over_task_ids = []
+        for task_ids in job_task_ids:
+            try:
+                result = self._check_tasks_progress([states[task_id] for task_id in task_ids])
+            except pipeline.exceptions.TranscodingFailed as e:
+                result = e
+                over_task_ids += task_ids
+            else:
+                if result[1]:
+                    over_task_ids += task_ids
+            results.append(result)
+        progress.delete_states(over_task_ids)
+        return results
+
+    @staticmethod
+    def _check_tasks_progress(task_states):
         """
-        if job.failed():
-            raise pipeline.exceptions.TranscodingFailed(job.result)
+        Progress of a job is the average progress of its tasks. Note that the
+        last segment task of a segmented job only succeeds once all segments
+        have been concatenated.
 
-        progress = 100 if job.successful() else 0
-        return progress, job.successful()
+        Args:
+            task_states (list): (status, progress, message) tuples, as returned
+            by `progress.get_states`.
+        """
+        for status, _task_progress, message in task_states:
+            if status == progress.STATUS_FAILED:
+                raise pipeline.exceptions.TranscodingFailed(message)
+        return (
+            sum([task_progress for _status, task_progress, _message in task_states]) * 1. / len(task_states),
+            all([status == progress.STATUS_SUCCESS for status, _task_progress, _message in task_states])
+        )
 
     def iter_formats(self, video_id):
+        bitrates = []
+        hls_available = os.path.exists(self.get_hls_file_path(video_id, self.HLS_MASTER_PLAYLIST_NAME))
         for format_name, ffmpeg_settings in settings.FFMPEG_PRESETS.items():
             if os.path.exists(self.get_video_file_path(video_id, format_name)):
-                bitrate = bitrate_value(ffmpeg_settings['video_bitrate'])
-                bitrate += bitrate_value(ffmpeg_settings['audio_bitrate'])
+                bitrate = format_bitrate(ffmpeg_settings)
+                bitrates.append(bitrate)
+                hls_playlist_path = os.path.join(self.get_hls_dir(video_id, format_name), self.HLS_PLAYLIST_NAME)
+                hls_available = hls_available and os.path.exists(hls_playlist_path)
                 yield format_name, bitrate
 
-    def create_thumbnail(self, video_id, thumb_id):
+        # The bitrate of the HLS stream is the highest bitrate of its formats
+        if bitrates and hls_available:
+            yield self.HLS_FORMAT_NAME, max(bitrates)
+
+    def _get_thumbnails_video_file_path(self, video_id):
+        """
+        Thumbnails are created from the FFMPEG_THUMBNAILS_PRESET format. If
+        that format was skipped because the source video is too small, the
+        largest available format is used instead.
+        """
         video_file_path = self.get_video_file_path(video_id, settings.FFMPEG_THUMBNAILS_PRESET)
+        if os.path.exists(video_file_path):
+            return video_file_path
+        available_formats = [
+            (format_name, utils.parse_size(ffmpeg_settings.get('size')) or (0, 0))
+            for format_name, ffmpeg_settings in settings.FFMPEG_PRESETS.items()
+            if os.path.exists(self.get_video_file_path(video_id, format_name))
+        ]
+        if not available_formats:
+            return video_file_path
+        largest_format_name, _size = max(available_formats, key=lambda format_size: format_size[1][0] * format_size[1][1])
+        return self.get_video_file_path(video_id, largest_format_name)
+
+    def create_thumbnail(self, video_id, thumb_id):
+        video_file_path = self._get_thumbnails_video_file_path(video_id)
         thumbnail_file_path = self.make_file_path(
             video_id,
             self.THUMBNAILS_DIRNAME,
@@ -179,7 +441,7 @@ class Backend(BaseBackend):
         tasks.ffmpeg_create_thumbnail(video_file_path, thumbnail_file_path)
 
     def create_poster_frames(self, video_id, poster_id):
-        video_file_path = self.get_video_file_path(video_id, settings.FFMPEG_THUMBNAILS_PRESET)
+        video_file_path = self._get_thumbnails_video_file_path(video_id)
         poster_frames_vtt_file_path = self.make_file_path(
             video_id,
             self.THUMBNAILS_DIRNAME,
@@ -188,7 +450,10 @@ class Backend(BaseBackend):
         tasks.ffmpeg_create_poster_frames(
             video_file_path,
             poster_frames_vtt_file_path,
-            self.get_poster_frames_file_name(poster_id)
+            self.get_poster_frames_file_name(poster_id),
+            duration=pipeline.media.get_duration(
+                pipeline.models.VideoMetadata.objects.get_media_info(video_id)
+            )
         )
 
     def thumbnail_url(self, video_id, thumb_id):
@@ -209,6 +474,105 @@ class Backend(BaseBackend):
             })
         )
 
+    def video_urls(self, video_formats):
+        # Templates are compiled at every call, and not once and for all,
+        # because they depend on the url configuration and settings.
+        video_template = UrlTemplate("backend:storage-video", 'video_id', 'format_name')
+        hls_template = UrlTemplate("backend:storage-hls", 'video_id', path=self.HLS_MASTER_PLAYLIST_NAME)
+        return [
+            hls_template.format(video_id=video_id) if format_name == self.HLS_FORMAT_NAME
+            else video_template.format(video_id=video_id, format_name=format_name)
+            for video_id, format_name in video_formats
+        ]
+
+    def subtitle_urls(self, subtitles):
+        template = UrlTemplate("backend:storage-subtitle", 'video_id', 'subtitle_id', 'language_code')
+        return [
+            template.format(video_id=video_id, subtitle_id=subtitle_id, language_code=language_code)
+            for video_id, subtitle_id, language_code in subtitles
+        ]
+
+    def thumbnail_urls(self, thumbnails):
+        template = UrlTemplate("backend:storage-thumbnail", 'video_id', 'thumbnail_id')
+        return [
+            template.format(video_id=video_id, thumbnail_id=thumb_id)
+            for video_id, thumb_id in thumbnails
+        ]
+
+    def poster_frames_urls(self, poster_frames):
+        template = UrlTemplate("backend:storage-poster-frames", 'video_id', 'poster_id')
+        return [
+            template.format(video_id=video_id, poster_id=poster_id)
+            for video_id, poster_id in poster_frames
+        ]
+
+
+class UrlTemplate(object):
+    """
+    Asset url pattern that is resolved once, and then formatted for every
+    asset. This is much faster than calling `reverse` for every asset url, and
+    it produces the same urls.
+
+    Args:
+        url_name (str): name of the url pattern
+        arg_names (str): names of the url arguments that are passed to `format`
+        kwargs: url arguments that are the same for all assets
+    """
+
+    PLACEHOLDER = "URLTEMPLATE{}PLACEHOLDER"
+    # Characters that are not quoted by `reverse`
+    SAFE_CHARS = "!$&'()*+,;=" + "/~:@"
+
+    def __init__(self, url_name, *arg_names, **kwargs):
+        placeholders = {name: self.PLACEHOLDER.format(index) for index, name in enumerate(arg_names)}
+        kwargs.update(placeholders)
+        url = urllib.parse.urljoin(
+            getattr(settings, 'ASSETS_ROOT_URL', ''),
+            reverse(url_name, kwargs=kwargs)
+        )
+        template = url.replace('{', '{{').replace('}', '}}')
+        for name, placeholder in placeholders.items():
+            template = template.replace(placeholder, '{' + name + '}')
+        self.template = template
+
+    def format(self, **kwargs):
+        return self.template.format(**{
+            name: urllib.parse.quote(str(value), safe=self.SAFE_CHARS)
+            for name, value in kwargs.items()
+        })
+
+
+class Job(object):
+    """
+    Transcoding job made of a single celery task, which produces one or more
+    formats.
+    """
+
+    def __init__(self, task_id, format_names):
+        self.task_id = task_id
+        self.format_names = format_names
+
+
+class SegmentedJob(object):
+    """
+    Transcoding job for a single format, made of one celery task per segment.
+    """
+
+    def __init__(self, segment_ids, format_names=None):
+        self.segment_ids = segment_ids
+        self.format_names = format_names or []
+
+
+def get_task_ids(job):
+    """
+    Returns:
+        task_ids (list of str): ids of the celery tasks of a Job or
+        SegmentedJob object.
+    """
+    if isinstance(job, SegmentedJob):
+        return job.segment_ids
+    return [job.task_id]
+
 def copy_content(file_object, path):
     """
     Copy content of file object to binary file. Write is performed chunk by
@@ -222,10 +586,8 @@ def copy_content(file_object, path):
                 break
             out_f.write(chunk)
 
-def bitrate_value(str_bitrate):
+def format_bitrate(ffmpeg_settings):
     """
-    Convert a bitrate string to integer.
+    Total bitrate of a transcoded video format, in bits per second.
     """
-    if 'k' in str_bitrate:
-        return int(str_bitrate.replace("k", "")) * 1024
-    return int(str_bitrate)
+    return utils.bitrate_value(ffmpeg_settings['video_bitrate']) + utils.bitrate_value(ffmpeg_settings['audio_bitrate'])
@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from contrib.plugins.local import scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the encode slot occupancy of this node in json format: number of"
+        " cores, number of reserved threads, number of running encodings and"
+        " occupancy ratio."
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(scheduler.occupancy(), sort_keys=True))
@@ -0,0 +1,153 @@
+import json
+import os
+import resource
+import shutil
+import subprocess
+import tempfile
+from time import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from contrib.plugins.local import backend as local_backend
+from contrib.plugins.local import utils
+import pipeline.exceptions
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the transcoding throughput of the local backend on synthetic"
+        " videos generated with the ffmpeg lavfi test sources. For every source"
+        " size, each FFMPEG_PRESETS format is transcoded separately, then the"
+        " thumbnail and the poster frames are created. Wall time, cpu time"
+        " (including ffmpeg processes) and realtime factor (video duration"
+        " divided by wall time) of each stage are printed in json format."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-d', '--duration', type=int, default=60,
+            help='Duration of the synthetic videos, in seconds. Default: 60.'
+        )
+        parser.add_argument(
+            '-s', '--size', action='append', dest='sizes',
+            help="Size of the synthetic videos, e.g: '1280x720'. May be repeated. Default: 1280x720."
+        )
+        parser.add_argument(
+            '-r', '--rate', type=int, default=25,
+            help='Frame rate of the synthetic videos. Default: 25.'
+        )
+        parser.add_argument(
+            '-o', '--output',
+            help='Write results to this file instead of stdout.'
+        )
+
+    def handle(self, *args, **options):
+        duration = options['duration']
+        sizes = options['sizes'] or ['1280x720']
+        work_dir = tempfile.mkdtemp(prefix='videofront-benchmark-')
+        results = []
+        try:
+            for size in sizes:
+                results += self.benchmark_source(work_dir, size, duration, options['rate'])
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        report = json.dumps({
+            'ffmpeg': ffmpeg_version(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(report)
+        else:
+            self.stdout.write(report)
+
+    def benchmark_source(self, work_dir, size, duration, rate):
+        """
+        Returns:
+            results (list of dict): measurements of each stage
+        """
+        src_path = os.path.join(work_dir, 'src-{}.mp4'.format(size))
+        video_id = 'benchmark-{}'.format(size)
+        measurement = {'size': size, 'duration': duration}
+        results = [
+            dict(measurement, stage='source', preset=None, **measure(generate_source, src_path, size, duration, rate))
+        ]
+
+        # Tasks are run synchronously, and transcoding notifications are not
+        # sent to the workers.
+        with override_settings(
+                VIDEO_STORAGE_ROOT=os.path.join(work_dir, 'storage'),
+                CELERY_ALWAYS_EAGER=True,
+                FFMPEG_SKIP_UPSCALING=False):
+            backend = local_backend.Backend()
+            with open(src_path, 'rb') as src_file:
+                backend.upload_video(video_id, src_file)
+
+            for format_name, ffmpeg_settings in sorted(settings.FFMPEG_PRESETS.items()):
+                with override_settings(FFMPEG_PRESETS={format_name: ffmpeg_settings}):
+                    metrics = measure(transcode, backend, video_id)
+                results.append(dict(measurement, stage='transcode', preset=format_name, **metrics))
+
+            metrics = measure(backend.create_thumbnail, video_id, 'thumbnail')
+            results.append(dict(measurement, stage='thumbnail', preset=None, **metrics))
+            metrics = measure(backend.create_poster_frames, video_id, 'posterframes')
+            results.append(dict(measurement, stage='poster_frames', preset=None, **metrics))
+
+        for result in results:
+            result['realtime_factor'] = duration / result['wall_time'] if result['wall_time'] else None
+        return results
+
+
+def measure(func, *args):
+    """
+    Run a function and measure its wall time and cpu time, in seconds. Cpu time
+    includes the time spent in the (terminated) child processes, e.g: ffmpeg.
+    """
+    cpu_time_start = cpu_time()
+    wall_time_start = time()
+    func(*args)
+    return {
+        'wall_time': time() - wall_time_start,
+        'cpu_time': cpu_time() - cpu_time_start,
+    }
+
+def cpu_time():
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum([u.ru_utime + u.ru_stime for u in usage])
+
+def generate_source(dst_path, size, duration, rate):
+    """
+    Generate an h264/aac video from the lavfi test sources.
+    """
+    command = [
+        utils.ffmpeg_binary(),
+        '-y',# overwrite without asking
+        '-loglevel', 'error',
+        '-f', 'lavfi', '-i', 'testsrc2=size={}:rate={}:duration={}'.format(size, rate, duration),
+        '-f', 'lavfi', '-i', 'sine=frequency=1000:duration={}'.format(duration),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-strict', 'experimental',
+        '-shortest',
+        dst_path,
+    ]
+    if subprocess.call(command) != 0:
+        raise CommandError("Could not generate synthetic source video {}".format(dst_path))
+
+def transcode(backend, video_id):
+    # Jobs are complete once start_transcoding returns
+    for job in backend.start_transcoding(video_id):
+        try:
+            backend.check_progress(job)
+        except pipeline.exceptions.TranscodingFailed as e:
+            raise CommandError("Transcoding failed: {}".format(e))
+
+def ffmpeg_version():
+    try:
+        output = subprocess.check_output([utils.ffmpeg_binary(), '-version'])
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('utf-8', 'replace').split('\n')[0]
@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+import json
+import os
+
+from celery.exceptions import Retry
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Running jobs that do not publish their progress for this long appear to have
+# made no progress
+PROGRESS_CACHE_TIMEOUT = 24 * 3600
+
+STATUS_RUNNING = 'running'
+STATUS_SUCCESS = 'success'
+STATUS_FAILED = 'failed'
+
+
+def _cache():
+    """
+    The progress of running jobs is stored in the FFMPEG_JOBS_CACHE Django
+    cache. Cache entries may be evicted: this is harmless for progress, but not
+    for final states, which are stored in files.
+    """
+    return caches[getattr(settings, 'FFMPEG_JOBS_CACHE', 'default')]
+
+def _cache_key(job_id):
+    return "FFMPEG_PROGRESS:" + job_id
+
+def _jobs_dir():
+    """
+    Final job states are stored in the FFMPEG_JOBS_DIR directory, which must be
+    shared by all nodes. They are deleted once they have been read by the
+    transcoding task of the video.
+    """
+    return getattr(settings, 'FFMPEG_JOBS_DIR', None) or os.path.join(settings.VIDEO_STORAGE_ROOT, 'jobs')
+
+def _final_state_path(job_id):
+    return os.path.join(_jobs_dir(), job_id + '.json')
+
+
+def set(job_id, progress):
+    """
+    Store the progress percentage of a running ffmpeg job.
+    """
+    _cache().set(_cache_key(job_id), progress, PROGRESS_CACHE_TIMEOUT)
+
+def get(job_id):
+    """
+    Returns the last progress percentage stored for this job, or 0.
+    """
+    return get_states([job_id])[job_id][1]
+
+def succeed(job_id):
+    _set_final_state(job_id, STATUS_SUCCESS, 100)
+
+def fail(job_id, message):
+    _set_final_state(job_id, STATUS_FAILED, get(job_id), message)
+
+def _set_final_state(job_id, status, progress, message=None):
+    path = _final_state_path(job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Readers never see a partially written state
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump([status, progress, message], f)
+    os.replace(tmp_path, path)
+    _cache().delete(_cache_key(job_id))
+
+def _get_final_state(job_id):
+    try:
+        with open(_final_state_path(job_id)) as f:
+            return tuple(json.load(f))
+    except FileNotFoundError:
+        return None
+
+def get_states(job_ids):
+    """
+    Fetch the state of multiple jobs. The progress of running jobs is fetched
+    in a single cache request.
+
+    Returns:
+        states (dict): (status, progress, message) tuple of each job id. Jobs
+        that did not start yet are running with 0 progress.
+    """
+    states = {}
+    running_job_ids = []
+    for job_id in job_ids:
+        state = _get_final_state(job_id)
+        if state is None:
+            running_job_ids.append(job_id)
+        else:
+            states[job_id] = state
+    progresses = _cache().get_many([_cache_key(job_id) for job_id in running_job_ids])
+    for job_id in running_job_ids:
+        states[job_id] = (STATUS_RUNNING, progresses.get(_cache_key(job_id), 0), None)
+    return states
+
+def delete_states(job_ids):
+    """
+    Delete the progress and final state of jobs that are over.
+    """
+    _cache().delete_many([_cache_key(job_id) for job_id in job_ids])
+    for job_id in job_ids:
+        try:
+            os.remove(_final_state_path(job_id))
+        except FileNotFoundError:
+            pass
+
+@contextmanager
+def track(job_id):
+    """
+    Context manager that stores the final state of a job: failed if the wrapped
+    code raises an exception, successful otherwise. Tasks that are retried are
+    still running. Nothing is stored for tasks that are called directly, and
+    not through celery, because they have no id.
+    """
+    if job_id is None:
+        yield
+        return
+    try:
+        yield
+    except Retry:
+        raise
+    except Exception as e:
+        fail(job_id, str(e))
+        raise
+    succeed(job_id)
@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+import fcntl
+import json
+import math
+import os
+import tempfile
+from time import time
+import uuid
+
+from django.conf import settings
+
+from . import utils
+
+
+class NoCapacity(Exception):
+    pass
+
+
+def enabled():
+    return getattr(settings, 'FFMPEG_ENCODE_SCHEDULER', True)
+
+def cpu_count():
+    return getattr(settings, 'FFMPEG_CPU_COUNT', None) or os.cpu_count() or 1
+
+def retry_delay():
+    """
+    Delay before encoding tasks that were not admitted are retried, in seconds.
+    """
+    return getattr(settings, 'FFMPEG_ENCODE_SCHEDULER_RETRY_DELAY', 10)
+
+def thread_budget(ffmpeg_presets_list):
+    """
+    Number of ffmpeg threads assigned to an encoding, proportional to the
+    number of encoded pixels: one thread per FFMPEG_PIXELS_PER_THREAD (640x360
+    by default), and at most the number of cores of the node.
+
+    Args:
+        ffmpeg_presets_list (list of dict): presets of all the formats that are
+        produced by the encoding.
+    """
+    pixels_per_thread = getattr(settings, 'FFMPEG_PIXELS_PER_THREAD', 640 * 360)
+    threads = 0
+    for ffmpeg_presets in ffmpeg_presets_list:
+        width, height = utils.parse_size(ffmpeg_presets.get('size')) or (0, 0)
+        threads += max(1, int(math.ceil(width * height * 1. / pixels_per_thread)))
+    return max(1, min(cpu_count(), threads))
+
+def _state_path():
+    directory = getattr(
+        settings, 'FFMPEG_ENCODE_SCHEDULER_DIR',
+        os.path.join(tempfile.gettempdir(), 'videofront')
+    )
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, 'encode-slots.json')
+
+@contextmanager
+def _locked_state():
+    """
+    Context manager that yields the scheduler state of the node, with an
+    exclusive lock on the state file. The state is saved on exit.
+
+    The state is a dict of {slot_id: {'pid': int, 'threads': int, 'started_at': float}}.
+    """
+    with open(_state_path(), 'a+') as state_file:
+        fcntl.flock(state_file, fcntl.LOCK_EX)
+        try:
+            state_file.seek(0)
+            content = state_file.read()
+            state = json.loads(content) if content else {}
+            # Slots of processes that died without releasing them are freed
+            for slot_id in list(state.keys()):
+                if not _is_process_alive(state[slot_id]['pid']):
+                    del state[slot_id]
+            yield state
+            state_file.seek(0)
+            state_file.truncate()
+            state_file.write(json.dumps(state))
+        finally:
+            fcntl.flock(state_file, fcntl.LOCK_UN)
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def acquire(threads):
+    """
+    Reserve cores for an encoding. ffmpeg processes that run concurrently on
+    the same node share its cores: each encoding is assigned a thread budget
+    (see `thread_budget`), and is admitted only if the node has enough free
+    cores. An encoding is always admitted on an idle node, even if it requires
+    more threads than there are cores. The reservations are stored in a file
+    that is shared by all worker processes of the node.
+
+    Args:
+        threads (int): thread budget of the encoding
+
+    Returns:
+        slot_id (str): to be passed to `release` once the encoding is over
+
+    Raises:
+        NoCapacity if the node does not have enough free cores.
+    """
+    with _locked_state() as state:
+        threads_in_use = sum([slot['threads'] for slot in state.values()])
+        if state and threads_in_use + threads > cpu_count():
+            raise NoCapacity()
+        slot_id = uuid.uuid4().hex
+        state[slot_id] = {'pid': os.getpid(), 'threads': threads, 'started_at': time()}
+    return slot_id
+
+def release(slot_id):
+    """
+    Free the cores that were reserved by `acquire`. Does nothing if `slot_id`
+    is None.
+    """
+    if slot_id is None:
+        return
+    with _locked_state() as state:
+        state.pop(slot_id, None)
+
+def occupancy():
+    """
+    Occupancy metrics of the node.
+
+    Returns:
+        metrics (dict): 'cpu_count', 'threads_in_use', 'encodings' and
+        'occupancy' (ratio of threads in use to cores, which may exceed 1)
+    """
+    with _locked_state() as state:
+        threads_in_use = sum([slot['threads'] for slot in state.values()])
+        encodings = len(state)
+    return {
+        'cpu_count': cpu_count(),
+        'threads_in_use': threads_in_use,
+        'encodings': encodings,
+        'occupancy': threads_in_use * 1. / cpu_count(),
+    }
@@ -1,33 +1,421 @@
-import subprocess
-import time
+from contextlib import contextmanager
+from glob import glob
+import math
 import os
+import shutil
+import subprocess
+from tempfile import TemporaryFile
 
 from celery import shared_task
+from celery.exceptions import Retry
+from django.conf import settings
 
+import pipeline.backend
+import pipeline.media
+from pipeline.exceptions import TranscodingFailed
+from . import progress
+from . import scheduler
 from . import utils
 
 
-@shared_task(name='ffmpeg_transcode_video')
-def ffmpeg_transcode_video(src_path, dst_path, ffmpeg_presets):
+# Poster frames fit in POSTER_FRAMES_SIZE (width, height) boxes.
+POSTER_FRAMES_SIZE = (160, 90)
+
+
+@shared_task(name='ffmpeg_transcode_video', bind=True, ignore_result=True)
+def ffmpeg_transcode_video(self, src_path, dst_path, ffmpeg_presets, video_id=None, hls_dir=None,
+                           media_info=None):
+    """
+    Transcoding progress and final state are stored along with the task id,
+    and can be obtained with `progress.get_states`.
+
+    Args:
+        video_id (str): if defined, the transcoding task of this video will be
+        notified once transcoding is over.
+        hls_dir (str): if defined, the transcoded video will be packaged in HLS
+        format in this directory.
+        media_info (dict): output of `pipeline.media.probe` for the source
+        video, as stored before transcoding. If undefined, the source video is
+        probed.
+
+    When the source video already fits the presets, its streams are copied
+    instead of being re-encoded (see `output_options`).
+    """
     # E.g:
     # ffmpeg -y -i src.mp4 -c:v libx264 -c:a aac -strict experimental \
-    #   -r 30 -s 1280x720 -vb 5120k -ab 384k -ar 48000 dst.mp4
+    #   -r 30 -vb 5120k -ab 384k -ar 48000 -s 1280x720 dst.mp4
+    with track_encoding(self, video_id):
+        media_info = media_info or pipeline.media.probe(src_path)
+        command = [
+            utils.ffmpeg_binary(),
+            '-y',# overwrite without asking
+            '-loglevel', 'error',
+            '-nostats',
+            '-progress', 'pipe:1',# write machine-readable progress to stdout
+            '-i', src_path,# input path
+        ] + output_options(media_info, ffmpeg_presets) + [
+            dst_path,
+        ]
+        slot_id = acquire_encode_slot(self, encode_threads(media_info, [ffmpeg_presets]))
+        try:
+            run_with_progress(command, pipeline.media.get_duration(media_info), self.request.id)
+            if hls_dir is not None:
+                ffmpeg_package_hls(dst_path, hls_dir)
+        finally:
+            scheduler.release(slot_id)
+
+@shared_task(name='ffmpeg_transcode_video_multi', bind=True, ignore_result=True)
+def ffmpeg_transcode_video_multi(self, src_path, outputs, video_id=None, hls_dirs=None, media_info=None):
+    """
+    Transcode a video to multiple formats at once. The source video is decoded
+    only once, and the decoded frames are scaled to each format in a single
+    filter graph.
+
+    Args:
+        outputs (list): (dst_path, ffmpeg_presets) tuples
+        video_id (str): same as for `ffmpeg_transcode_video`
+        hls_dirs (list): HLS directory of each output, or None
+        media_info (dict): same as for `ffmpeg_transcode_video`
+    """
+    # E.g:
+    # ffmpeg -y -i src.mp4 \
+    #   -filter_complex "[0:v]split=2[in0][in1];[in0]scale=1280:720[out0];[in1]scale=640:360[out1]" \
+    #   -map [out0] -map 0:a? -c:v libx264 -c:a aac ... HD.mp4 \
+    #   -map [out1] -map 0:a? -c:v libx264 -c:a aac ... LD.mp4
+    # Outputs that fit the source video are copied and do not go through the
+    # filter graph.
+    with track_encoding(self, video_id):
+        media_info = media_info or pipeline.media.probe(src_path)
+        copied_outputs = []
+        encoded_outputs = []
+        for dst_path, ffmpeg_presets in outputs:
+            if is_stream_copy(media_info, ffmpeg_presets):
+                copied_outputs.append(dst_path)
+            else:
+                encoded_outputs.append((dst_path, ffmpeg_presets))
+
+        command = [
+            utils.ffmpeg_binary(),
+            '-y',# overwrite without asking
+            '-loglevel', 'error',
+            '-nostats',
+            '-progress', 'pipe:1',# write machine-readable progress to stdout
+            '-i', src_path,# input path
+        ]
+        if encoded_outputs:
+            command += [
+                '-filter_complex',
+                split_scale_filter([ffmpeg_presets['size'] for _, ffmpeg_presets in encoded_outputs]),
+            ]
+        for output_index, (dst_path, ffmpeg_presets) in enumerate(encoded_outputs):
+            command += [
+                '-map', '[out{}]'.format(output_index),
+                '-map', '0:a?',# audio stream, if any
+            ] + encoding_options(ffmpeg_presets) + [
+                dst_path,
+            ]
+        for dst_path in copied_outputs:
+            command += stream_copy_options() + [dst_path]
+        slot_id = acquire_encode_slot(
+            self, scheduler.thread_budget([ffmpeg_presets for _, ffmpeg_presets in encoded_outputs])
+        )
+        try:
+            run_with_progress(command, pipeline.media.get_duration(media_info), self.request.id)
+            for (dst_path, _ffmpeg_presets), hls_dir in zip(outputs, hls_dirs or [None] * len(outputs)):
+                if hls_dir is not None:
+                    ffmpeg_package_hls(dst_path, hls_dir)
+        finally:
+            scheduler.release(slot_id)
+
+def ffmpeg_split_video(src_path, dst_dir, segment_duration):
+    """
+    Split a video in segments without re-encoding it. Because streams are
+    copied, segments are cut on keyframes, so that their duration is only
+    approximately equal to `segment_duration`.
+
+    Returns:
+        segment_paths (list of str): sorted segment file paths
+    """
+    command = [
+        utils.ffmpeg_binary(),
+        '-y',# overwrite without asking
+        '-loglevel', 'error',
+        '-i', src_path,# input path
+        '-map', '0:v:0',# first video stream
+        '-map', '0:a:0?',# first audio stream, if any
+        '-c', 'copy',
+        '-f', 'segment',
+        '-segment_time', str(segment_duration),
+        '-reset_timestamps', '1',
+        os.path.join(dst_dir, '%05d.mkv'),
+    ]
+    run(command)
+    return sorted(glob(os.path.join(dst_dir, '*.mkv')))
+
+@shared_task(name='ffmpeg_transcode_segment', bind=True, ignore_result=True)
+def ffmpeg_transcode_segment(self, src_path, dst_path, ffmpeg_presets,
+                             all_dst_paths, concat_dst_path, video_id=None, hls_dir=None):
+    """
+    Transcode a single video segment. Once all segments have been transcoded,
+    the task that transcoded the last segment concatenates them to
+    `concat_dst_path`.
+
+    Args:
+        all_dst_paths (list of str): sorted paths of all transcoded segments of
+        the same video and format, including `dst_path`.
+        concat_dst_path (str)
+        video_id (str): same as for `ffmpeg_transcode_video`
+        hls_dir (str): same as for `ffmpeg_transcode_video`
+    """
+    with track_encoding(self, video_id):
+        # Segments are written to a temporary file first, such that the
+        # existence of `dst_path` means that the segment was entirely
+        # transcoded.
+        dst_dir, dst_name = os.path.split(dst_path)
+        tmp_path = os.path.join(dst_dir, 'tmp_' + dst_name)
+        media_info = pipeline.media.probe(src_path)
+        command = [
+            utils.ffmpeg_binary(),
+            '-y',# overwrite without asking
+            '-loglevel', 'error',
+            '-nostats',
+            '-progress', 'pipe:1',# write machine-readable progress to stdout
+            '-i', src_path,# input path
+        ] + output_options(media_info, ffmpeg_presets) + [
+            tmp_path,
+        ]
+        slot_id = acquire_encode_slot(self, encode_threads(media_info, [ffmpeg_presets]))
+        try:
+            run_with_progress(command, pipeline.media.get_duration(media_info), self.request.id)
+            os.rename(tmp_path, dst_path)
+
+            # Exactly one of the segment tasks creates the lock file and
+            # concatenates the segments.
+            if all([os.path.exists(path) for path in all_dst_paths]) and \
+                    utils.create_file_exclusive(os.path.join(dst_dir, 'concat.lock')):
+                ffmpeg_concat_segments(all_dst_paths, concat_dst_path)
+                shutil.rmtree(dst_dir)
+                if hls_dir is not None:
+                    ffmpeg_package_hls(concat_dst_path, hls_dir)
+        finally:
+            scheduler.release(slot_id)
+
+def ffmpeg_concat_segments(segment_paths, dst_path):
+    """
+    Concatenate transcoded video segments without re-encoding them.
+    """
+    list_path = dst_path + '.segments.txt'
+    with open(list_path, 'w') as list_file:
+        for segment_path in segment_paths:
+            list_file.write("file '{}'\n".format(segment_path.replace("'", "'\\''")))
+    command = [
+        utils.ffmpeg_binary(),
+        '-y',# overwrite without asking
+        '-loglevel', 'error',
+        '-f', 'concat',
+        '-safe', '0',# allow absolute paths in the segment list
+        '-i', list_path,
+        '-c', 'copy',
+        '-movflags', '+faststart',# make the video playable before it is entirely downloaded
+        dst_path,
+    ]
+    try:
+        run(command)
+    finally:
+        os.remove(list_path)
+
+def ffmpeg_package_hls(src_path, dst_dir):
+    """
+    Split a transcoded video in HLS segments, without re-encoding it, and write
+    the corresponding playlist.
+    """
     command = [
         utils.ffmpeg_binary(),
         '-y',# overwrite without asking
         '-loglevel', 'error',
         '-i', src_path,# input path
+        '-c', 'copy',
+        '-bsf:v', 'h264_mp4toannexb',# required for copying h264 streams to mpeg-ts
+        '-f', 'hls',
+        '-hls_time', str(hls_segment_duration()),
+        '-hls_list_size', '0',# keep all segments in the playlist
+        '-hls_segment_filename', os.path.join(dst_dir, '%05d.ts'),
+        os.path.join(dst_dir, 'index.m3u8'),
+    ]
+    run(command)
+
+def hls_segment_duration():
+    return getattr(settings, 'FFMPEG_HLS_SEGMENT_DURATION', 6)
+
+def stream_copy_enabled():
+    """
+    Sources that fit a preset can be copied instead of re-encoded, unless
+    videos are packaged in HLS format: copied streams do not have keyframes
+    aligned with the other formats.
+    """
+    return getattr(settings, 'FFMPEG_STREAM_COPY', True) and not getattr(settings, 'FFMPEG_HLS', False)
+
+def is_stream_copy(media_info, ffmpeg_presets):
+    return stream_copy_enabled() and utils.can_stream_copy(media_info, ffmpeg_presets)
+
+def output_options(media_info, ffmpeg_presets):
+    """
+    Output options of a single-format transcoding command: streams are copied
+    if the source video fits the presets, and encoded otherwise.
+
+    Args:
+        media_info (dict): output of `pipeline.media.probe` for the source video
+        ffmpeg_presets (dict)
+    """
+    if is_stream_copy(media_info, ffmpeg_presets):
+        return stream_copy_options()
+    return encoding_options(ffmpeg_presets) + [
+        '-s', ffmpeg_presets['size'],# 16:9 video size
+    ]
+
+def stream_copy_options():
+    """
+    Output options to copy the source streams to an mp4 container without
+    re-encoding them.
+    """
+    return [
+        '-map', '0:v:0',# first video stream
+        '-map', '0:a:0?',# first audio stream, if any
+        '-c', 'copy',
+        '-movflags', '+faststart',# make the video playable before it is entirely downloaded
+    ]
+
+def encoding_options(ffmpeg_presets):
+    """
+    Output options shared by all transcoding commands, except for the video size.
+    """
+    options = [
         '-c:v', 'libx264',# video codec
         '-c:a', 'aac',# audio codec
         '-strict', 'experimental',# allow experimental 'aac' codec
         '-r', ffmpeg_presets.get('framerate', '30'),
-        '-s', ffmpeg_presets['size'],# 16:9 video size
         '-vb', ffmpeg_presets['video_bitrate'],
         '-ab', ffmpeg_presets['audio_bitrate'],
         '-ar', ffmpeg_presets.get('audio_rate', '48000'),# audio sampling rate
-        dst_path,
+        '-threads', str(scheduler.thread_budget([ffmpeg_presets])),# avoid oversubscribing the node cores
     ]
-    subprocess.call(command)
+    if getattr(settings, 'FFMPEG_HLS', False):
+        # Keyframes must be aligned across formats for players to switch
+        # formats between HLS segments
+        options += [
+            '-force_key_frames', 'expr:gte(t,n_forced*{})'.format(hls_segment_duration()),
+        ]
+    return options
+
+def encode_threads(media_info, ffmpeg_presets_list):
+    """
+    Number of cores that should be reserved for an encoding. Stream copies are
+    not cpu-intensive and require a single core.
+    """
+    encoded_presets_list = [
+        ffmpeg_presets for ffmpeg_presets in ffmpeg_presets_list
+        if not is_stream_copy(media_info, ffmpeg_presets)
+    ]
+    if not encoded_presets_list:
+        return 1
+    return scheduler.thread_budget(encoded_presets_list)
+
+@contextmanager
+def track_encoding(task, video_id):
+    """
+    Context manager that wraps the whole body of an encoding task. The final
+    state of the job is stored (see `progress.track`), including when the
+    source cannot be probed or the command cannot be built, and the
+    transcoding task of the video is then notified. Retried tasks are still
+    running: their video is not notified.
+
+    Args:
+        task: bound celery task
+        video_id (str): if defined, the transcoding task of this video will be
+        notified once the job is over.
+    """
+    try:
+        with progress.track(task.request.id):
+            yield
+    except Retry:
+        raise
+    except Exception:
+        notify_progress(video_id)
+        raise
+    notify_progress(video_id)
+
+def notify_progress(video_id):
+    if video_id is not None:
+        pipeline.backend.get().notify_progress(video_id)
+
+def acquire_encode_slot(task, threads):
+    """
+    Reserve cores of this node for an encoding task. If the node does not have
+    enough free cores, the task is retried later: workers never wait for cores
+    to become available.
+
+    Returns:
+        slot_id (str): to be passed to `scheduler.release`, or None if the
+        scheduler is disabled.
+    """
+    if not scheduler.enabled():
+        return None
+    try:
+        return scheduler.acquire(threads)
+    except scheduler.NoCapacity:
+        raise task.retry(countdown=scheduler.retry_delay(), max_retries=None)
+
+def split_scale_filter(sizes):
+    """
+    Filter graph that splits the input video stream in as many streams as there
+    are sizes, and scales each of them. The output streams are labeled out0,
+    out1, etc.
+
+    Args:
+        sizes (list of str): e.g: ['1280x720', '640x360']
+    """
+    split = '[0:v]split={}{}'.format(
+        len(sizes),
+        ''.join(['[in{}]'.format(index) for index in range(len(sizes))])
+    )
+    scales = [
+        '[in{index}]scale={size}[out{index}]'.format(index=index, size=size.replace('x', ':'))
+        for index, size in enumerate(sizes)
+    ]
+    return ';'.join([split] + scales)
+
+def run_with_progress(command, duration, job_id):
+    """
+    Run an ffmpeg command that writes its progress to stdout. The progress
+    percentage is stored each time it increases by at least
+    FFMPEG_PROGRESS_STEP. Raises TranscodingFailed in case of non-zero return
+    code.
+    """
+    progress_step = getattr(settings, 'FFMPEG_PROGRESS_STEP', 1)
+    with TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, universal_newlines=True)
+        last_progress = 0
+        for current_progress in utils.iter_progress(process.stdout, duration):
+            if current_progress - last_progress >= progress_step:
+                last_progress = current_progress
+                progress.set(job_id, current_progress)
+        process.wait()
+        check_returncode(process, stderr)
+
+def run(command):
+    """
+    Run an ffmpeg command. Raises TranscodingFailed in case of non-zero return
+    code.
+    """
+    with TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=stderr)
+        process.wait()
+        check_returncode(process, stderr)
+
+def check_returncode(process, stderr):
+    if process.returncode != 0:
+        stderr.seek(0)
+        raise TranscodingFailed(stderr.read().decode('utf-8', 'replace').strip())
 
 @shared_task(name='ffmpeg_create_thumbnail')
 def ffmpeg_create_thumbnail(src_path, dst_path):
@@ -43,49 +431,108 @@ def ffmpeg_create_thumbnail(src_path, dst_path):
     subprocess.call(command)
 
 @shared_task(name='ffmpeg_create_poster_frames')
-def ffmpeg_create_poster_frames(src_path, dst_path, pf_file):
+def ffmpeg_create_poster_frames(src_path, dst_path, pf_file, duration=None):
+    """
+    Poster frames are extracted at regular intervals (see
+    `poster_frames_interval`), scaled and tiled into sprite sheets in a single
+    ffmpeg pass. Each sprite sheet contains FFMPEG_POSTER_FRAMES_SPRITE_COLUMNS
+    x FFMPEG_POSTER_FRAMES_SPRITE_ROWS frames. The sprite sheets are stored
+    next to the vtt file, and their names are prefixed by `pf_file`.
+
+    Args:
+        src_path (str): path of the source video file
+        dst_path (str): path of the vtt file
+        pf_file (str): name of the vtt file
+        duration (float): duration of the video, in seconds. If undefined, the
+        source video is probed.
+    """
+    duration = duration or utils.probe_duration(src_path)
+    if not duration:
+        raise TranscodingFailed("Could not determine the duration of {}".format(src_path))
+    interval = poster_frames_interval(duration)
+    width, height = POSTER_FRAMES_SIZE
+    columns, rows = poster_frames_sprite_size()
     command = [
         utils.ffmpeg_binary(),
         '-y',# overwrite without asking
         '-loglevel', 'error',
         '-i', src_path,# input path
-        '-vf', 'fps=1/10',# make thumbs every 10 seconds
-        '-q:v', '2',#Set quality of thumbs(lower is better)
+        '-vf', poster_frames_filter(interval, width, height, columns, rows),
+        '-q:v', '2',#Set quality of sprites(lower is better)
         dst_path + '_%d.jpg',
     ]
-    subprocess.call(command)
+    run(command)
 
-    #Calculate video duration
-    command = 'ffprobe -i {} -show_entries format=duration -v quiet -of csv="p=0"'.format(src_path)
-    output = subprocess.check_output(
-        command,
-        shell=True, # Let this run in the shell
-        stderr=subprocess.STDOUT
+    with open(dst_path, 'w') as vtt_file:
+        vtt_file.write(poster_frames_vtt(pf_file, duration, interval, columns, rows))
+
+def poster_frames_interval(duration):
+    """
+    Interval between poster frames, in seconds. The interval is as short as
+    possible, down to FFMPEG_POSTER_FRAMES_MIN_INTERVAL seconds, such that
+    short videos still get a useful number of frames, but it is stretched such
+    that there are at most FFMPEG_POSTER_FRAMES_MAX_COUNT frames per video: the
+    frame count remains bounded for long videos.
+
+    Args:
+        duration (float): duration of the video, in seconds
+
+    Returns:
+        interval (int)
+    """
+    min_interval = getattr(settings, 'FFMPEG_POSTER_FRAMES_MIN_INTERVAL', 1)
+    max_count = getattr(settings, 'FFMPEG_POSTER_FRAMES_MAX_COUNT', 200)
+    return max(min_interval, int(math.ceil(duration * 1. / max_count)))
+
+def poster_frames_sprite_size():
+    """
+    Returns:
+        (columns, rows) (int, int): number of poster frames per sprite sheet row
+        and column
+    """
+    return (
+        getattr(settings, 'FFMPEG_POSTER_FRAMES_SPRITE_COLUMNS', 10),
+        getattr(settings, 'FFMPEG_POSTER_FRAMES_SPRITE_ROWS', 10),
     )
-    duration = float(output)
-    thumb_count = int(duration / 10)
-    if duration > thumb_count * 10:
-        thumb_count += 1
-
-    # resize thumbs
-    for i in range(1, thumb_count+1):
-        image_path = '{}_{}.jpg'.format(dst_path, i)
-        if os.path.exists(image_path):
-            utils.resize_image(image_path, image_path, 160)
-        else:
-            thumb_count -= 1#Number of thumbs were overestimated
-    
-    # Create the vtt file
-    f = open(dst_path, 'w')
-    f.write('WEBVTT\n\n')
-    for i in range(1,thumb_count):
-        f.write('{}.000 --> {}.000\n'.format(
-            time.strftime('%H:%M:%S', time.gmtime((i-1) * 10)),
-            time.strftime('%H:%M:%S', time.gmtime(i * 10))
+
+def poster_frames_filter(interval, width, height, columns, rows):
+    """
+    Filter that samples one frame every `interval` seconds, fits it in a
+    `width`x`height` box without distorting it, and tiles the frames in sprite
+    sheets.
+    """
+    return (
+        'fps=1/{interval},'
+        'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+        'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,'
+        'tile={columns}x{rows}'
+    ).format(interval=interval, width=width, height=height, columns=columns, rows=rows)
+
+def poster_frames_vtt(pf_file, duration, interval, columns, rows):
+    """
+    Content of the poster frames vtt file. Each cue points to a region of a
+    sprite sheet, e.g: "poster.vtt_2.jpg#xywh=160,90,160,90".
+    """
+    width, height = POSTER_FRAMES_SIZE
+    frames_per_sprite = columns * rows
+    frame_count = max(1, int(math.ceil(duration * 1. / interval)))
+    cues = []
+    for frame in range(frame_count):
+        position = frame % frames_per_sprite
+        cues.append('{} --> {}\n{}_{}.jpg#xywh={},{},{},{}'.format(
+            vtt_timestamp(frame * interval),
+            vtt_timestamp(min((frame + 1) * interval, duration)),
+            pf_file, frame // frames_per_sprite + 1,
+            (position % columns) * width, (position // columns) * height, width, height
         ))
-        f.write('{}_{}.jpg#xywh=0,0,160,90\n\n'.format(pf_file, i))
-    f.write('{}.000 --> {}.000\n'.format(
-        time.strftime('%H:%M:%S', time.gmtime((thumb_count - 1) * 10)),
-        time.strftime('%H:%M:%S', time.gmtime(duration))
-    ))
-    f.write('{}_{}.jpg#xywh=0,0,160,90'.format(pf_file, thumb_count))
+    return 'WEBVTT\n\n' + '\n\n'.join(cues)
+
+def vtt_timestamp(seconds):
+    """
+    E.g: 3723.5 -> "01:02:03.500"
+    """
+    milliseconds = int(round(seconds * 1000))
+    return '{:02d}:{:02d}:{:02d}.{:03d}'.format(
+        milliseconds // 3600000, milliseconds // 60000 % 60,
+        milliseconds // 1000 % 60, milliseconds % 1000
+    )
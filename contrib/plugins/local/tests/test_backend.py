@@ -9,9 +9,11 @@ from django.conf import settings
 from django.core.urlresolvers import reverse, clear_url_caches
 from django.test import TestCase
 from django.test.utils import override_settings
-from mock import patch
+from mock import Mock, patch
 
 from contrib.plugins.local import backend as local_backend
+from contrib.plugins.local import progress
+import pipeline.exceptions
 import pipeline.tasks
 
 
@@ -141,9 +143,11 @@ class LocalBackendTests(TestCase):
         file_object.name = "somevideo.mp4"
 
         # Patch transcoding function
-        def ffmpeg_transcode_video(src_path, dst_path, ffmpeg_settings):
+        def ffmpeg_transcode_video(src_path, dst_path, ffmpeg_settings, video_id=None, hls_dir=None,
+                                   media_info=None):
             with open(dst_path, 'wb') as f:
                 f.write(b'transcoded content')
+            return Mock(id='jobid')
         mock_ffmpeg_transcode_video.delay = ffmpeg_transcode_video
 
         backend.upload_video('videoid', file_object)
@@ -157,6 +161,340 @@ class LocalBackendTests(TestCase):
         self.assertEqual(200, response.status_code)
         self.assertEqual(b"transcoded content", response.getvalue())
 
+    @override_settings(FFMPEG_SINGLE_PASS=True, FFMPEG_PRESETS={
+        'HD': {
+            'size': '1280x720',
+            'video_bitrate': '5120k',
+            'audio_bitrate': '384k',
+        },
+        'LD': {
+            'size': '640x360',
+            'video_bitrate': '896k',
+            'audio_bitrate': '64k',
+        },
+    })
+    @patch("contrib.plugins.local.tasks.ffmpeg_transcode_video_multi")
+    @patch("contrib.plugins.local.tasks.ffmpeg_transcode_video")
+    def test_start_transcoding_single_pass(self, mock_ffmpeg_transcode_video, mock_ffmpeg_transcode_video_multi):
+        backend = local_backend.Backend()
+        file_object = BytesIO(b"some content")
+        file_object.name = "somevideo.mp4"
+        backend.upload_video('videoid', file_object)
+
+        jobs = backend.start_transcoding('videoid')
+
+        self.assertEqual(1, len(jobs))
+        mock_ffmpeg_transcode_video.delay.assert_not_called()
+        mock_ffmpeg_transcode_video_multi.delay.assert_called_once()
+        outputs = mock_ffmpeg_transcode_video_multi.delay.call_args[0][1]
+        self.assertEqual(
+            sorted([backend.get_video_file_path('videoid', 'HD'), backend.get_video_file_path('videoid', 'LD')]),
+            sorted([dst_path for dst_path, _ffmpeg_settings in outputs])
+        )
+
+    @override_settings(FFMPEG_SEGMENT_DURATION=60, FFMPEG_PRESETS={
+        'HD': {
+            'size': '1280x720',
+            'video_bitrate': '5120k',
+            'audio_bitrate': '384k',
+        },
+    })
+    @patch("contrib.plugins.local.tasks.ffmpeg_transcode_segment")
+    @patch("contrib.plugins.local.tasks.ffmpeg_split_video")
+    @patch("pipeline.media.probe", return_value={'format': {'duration': '7200'}, 'streams': []})
+    def test_start_segmented_transcoding(self, _mock_probe, mock_split_video, mock_transcode_segment):
+        backend = local_backend.Backend()
+        file_object = BytesIO(b"some content")
+        file_object.name = "somevideo.mp4"
+        backend.upload_video('videoid', file_object)
+        mock_split_video.return_value = [
+            media_path('videoid', 'segments', 'src', '00000.mkv'),
+            media_path('videoid', 'segments', 'src', '00001.mkv'),
+        ]
+
+        jobs = backend.start_transcoding('videoid')
+
+        self.assertEqual(1, len(jobs))
+        self.assertIsInstance(jobs[0], local_backend.SegmentedJob)
+        self.assertEqual(['HD'], backend.get_job_formats(jobs[0]))
+        self.assertEqual(2, len(jobs[0].segment_ids))
+        self.assertEqual(2, mock_transcode_segment.delay.call_count)
+        args = mock_transcode_segment.delay.call_args[0]
+        self.assertEqual(media_path('videoid', 'segments', 'src', '00001.mkv'), args[0])
+        self.assertEqual(media_path('videoid', 'segments', 'HD', '00001.mp4'), args[1])
+        self.assertEqual([
+            media_path('videoid', 'segments', 'HD', '00000.mp4'),
+            media_path('videoid', 'segments', 'HD', '00001.mp4'),
+        ], args[3])
+        self.assertEqual(media_path('videoid', 'HD.mp4'), args[4])
+
+    def test_clean_transcoding(self):
+        backend = local_backend.Backend()
+        for path in [
+                ('videoid', 'segments', 'src', '00000.mkv'),
+                # Segments of a failed job, which were not concatenated
+                ('videoid', 'segments', 'HD', '00000.mp4'),
+                ('videoid', 'HD.mp4'),
+        ]:
+            with open(backend.make_file_path(*path), 'wb') as f:
+                f.write(b'content')
+
+        backend.clean_transcoding('videoid')
+
+        self.assertFalse(os.path.exists(media_path('videoid', 'segments')))
+        self.assertTrue(os.path.exists(media_path('videoid', 'HD.mp4')))
+
+    def test_check_segmented_job_progress(self):
+        backend = local_backend.Backend()
+        job = local_backend.SegmentedJob(['segment0', 'segment1'])
+
+        progress.succeed('segment0')
+        self.assertEqual((50, False), backend.check_progress(job))
+        progress.set('segment1', 50)
+        self.assertEqual((75, False), backend.check_progress(job))
+        progress.succeed('segment1')
+        self.assertEqual((100, True), backend.check_progress(job))
+        progress.fail('segment0', 'ffmpeg error')
+        self.assertRaises(pipeline.exceptions.TranscodingFailed, backend.check_progress, job)
+
+    def test_check_progress(self):
+        backend = local_backend.Backend()
+        job = local_backend.Job('jobid', ['HD'])
+
+        self.assertEqual((0, False), backend.check_progress(job))
+        progress.set('jobid', 42)
+        self.assertEqual((42, False), backend.check_progress(job))
+        progress.succeed('jobid')
+        self.assertEqual((100, True), backend.check_progress(job))
+
+    def test_check_progress_failed_job(self):
+        backend = local_backend.Backend()
+        job = local_backend.Job('jobid', ['HD'])
+
+        with self.assertRaises(ValueError):
+            with progress.track('jobid'):
+                progress.set('jobid', 42)
+                raise ValueError('ffmpeg error')
+
+        self.assertEqual((progress.STATUS_FAILED, 42, 'ffmpeg error'), progress.get_states(['jobid'])['jobid'])
+        with self.assertRaises(pipeline.exceptions.TranscodingFailed) as context:
+            backend.check_progress(job)
+        self.assertEqual('ffmpeg error', context.exception.args[0])
+
+    def test_check_progress_final_states_are_not_evicted(self):
+        backend = local_backend.Backend()
+        job = local_backend.Job('jobid', ['HD'])
+        progress.succeed('jobid')
+
+        with patch('contrib.plugins.local.progress._cache') as mock_cache:
+            mock_cache.return_value.get_many.return_value = {}
+            self.assertEqual((100, True), backend.check_progress(job))
+
+    def test_check_progress_deletes_states_of_jobs_that_are_over(self):
+        backend = local_backend.Backend()
+        jobs = [
+            local_backend.Job('job0', ['HD']),
+            local_backend.Job('job1', ['SD']),
+            local_backend.SegmentedJob(['segment0', 'segment1'], ['LD']),
+        ]
+        progress.set('job0', 42)
+        progress.fail('job1', 'ffmpeg error')
+        progress.succeed('segment0')
+        progress.succeed('segment1')
+
+        backend.check_progress_many(jobs)
+
+        self.assertEqual((progress.STATUS_RUNNING, 42, None), progress.get_states(['job0'])['job0'])
+        self.assertEqual([], os.listdir(os.path.join(VIDEO_STORAGE_ROOT, 'jobs')))
+        self.assertEqual({}, progress._cache().get_many(['FFMPEG_PROGRESS:job1', 'FFMPEG_PROGRESS:segment0']))
+
+    def test_check_progress_many(self):
+        backend = local_backend.Backend()
+        jobs = [
+            local_backend.Job('job0', ['HD']),
+            local_backend.Job('job1', ['SD']),
+            local_backend.SegmentedJob(['segment0', 'segment1'], ['LD']),
+        ]
+        progress.set('job0', 42)
+        progress.fail('job1', 'ffmpeg error')
+        progress.succeed('segment0')
+        progress.succeed('segment1')
+
+        with patch('contrib.plugins.local.progress.get_states', side_effect=progress.get_states) as mock_get_states:
+            results = backend.check_progress_many(jobs)
+
+        # All states are fetched at once
+        mock_get_states.assert_called_once_with(['job0', 'job1', 'segment0', 'segment1'])
+        self.assertEqual((42, False), results[0])
+        self.assertIsInstance(results[1], pipeline.exceptions.TranscodingFailed)
+        self.assertEqual('ffmpeg error', results[1].args[0])
+        self.assertEqual((100, True), results[2])
+
+    @override_settings(FFMPEG_HLS=True, FFMPEG_PRESETS={
+        'HD': {
+            'size': '1280x720',
+            'video_bitrate': '2200k',
+            'audio_bitrate': '128k',
+        },
+    })
+    @patch("contrib.plugins.local.tasks.ffmpeg_transcode_video")
+    def test_start_transcoding_with_hls(self, mock_ffmpeg_transcode_video):
+        backend = local_backend.Backend()
+        file_object = BytesIO(b"some content")
+        file_object.name = "somevideo.mp4"
+        backend.upload_video('videoid', file_object)
+
+        backend.start_transcoding('videoid')
+
+        self.assertEqual(
+            media_path('videoid', 'hls', 'HD'),
+            mock_ffmpeg_transcode_video.delay.call_args[1]['hls_dir']
+        )
+        with open(media_path('videoid', 'hls', 'master.m3u8')) as master_playlist:
+            self.assertEqual(
+                "#EXTM3U\n#EXT-X-VERSION:3\n"
+                "#EXT-X-STREAM-INF:BANDWIDTH=2383872,RESOLUTION=1280x720\nHD/index.m3u8\n",
+                master_playlist.read()
+            )
+
+    def test_hls_url(self):
+        backend = local_backend.Backend()
+        hls_url = backend.video_url('videoid', 'HLS')
+        with open(backend.make_file_path('videoid', 'hls', 'master.m3u8'), 'w') as f:
+            f.write('#EXTM3U')
+
+        response = self.client.get(hls_url)
+
+        self.assertEqual('/backend/storage/videos/videoid/hls/master.m3u8', hls_url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'#EXTM3U', response.getvalue())
+        self.assertEqual('*', response.get('Access-Control-Allow-Origin'))
+
+    def test_hls_url_outside_of_hls_directory(self):
+        backend = local_backend.Backend()
+        with open(backend.make_file_path('otherid', 'src', 'video.mp4'), 'w') as f:
+            f.write('source video')
+
+        response = self.client.get('/backend/storage/videos/videoid/hls/../../otherid/src/video.mp4')
+
+        self.assertEqual(404, response.status_code)
+        self.assertRaises(ValueError, backend.get_hls_file_path, 'videoid', '../src/video.mp4')
+
+    @override_settings(FFMPEG_PRESETS={
+        'HD': {
+            'video_bitrate': '2048k',
+            'audio_bitrate': '128k',
+        },
+        'SD': {
+            'video_bitrate': '1024k',
+            'audio_bitrate': '64k',
+        },
+    })
+    def test_iter_formats_with_hls(self):
+        backend = local_backend.Backend()
+        for format_name in ['HD', 'SD']:
+            with open(backend.make_file_path('videoid', format_name + '.mp4'), 'wb') as f:
+                f.write(b'content')
+            with open(backend.make_file_path('videoid', 'hls', format_name, 'index.m3u8'), 'w') as f:
+                f.write('#EXTM3U')
+
+        # No master playlist
+        self.assertEqual(['HD', 'SD'], sorted([name for name, _bitrate in backend.iter_formats('videoid')]))
+
+        with open(backend.make_file_path('videoid', 'hls', 'master.m3u8'), 'w') as f:
+            f.write('#EXTM3U')
+        formats = dict(backend.iter_formats('videoid'))
+        self.assertEqual(['HD', 'HLS', 'SD'], sorted(formats.keys()))
+        self.assertEqual(formats['HD'], formats['HLS'])
+
+    @override_settings(FFMPEG_PRESETS={
+        'HD': {
+            'size': '1280x720',
+            'video_bitrate': '2200k',
+            'audio_bitrate': '128k',
+        },
+        'LD': {
+            'size': '640x360',
+            'video_bitrate': '896k',
+            'audio_bitrate': '64k',
+        },
+    })
+    @patch("pipeline.media.probe", return_value={'streams': [{'codec_type': 'video', 'width': 640, 'height': 360}]})
+    @patch("contrib.plugins.local.tasks.ffmpeg_transcode_video")
+    def test_start_transcoding_skips_upscaled_formats(self, mock_ffmpeg_transcode_video, _mock_probe):
+        backend = local_backend.Backend()
+        file_object = BytesIO(b"some content")
+        file_object.name = "somevideo.mp4"
+        backend.upload_video('videoid', file_object)
+        # Previously transcoded HD video
+        with open(backend.make_file_path('videoid', 'HD.mp4'), 'wb') as f:
+            f.write(b'HD content')
+
+        jobs = backend.start_transcoding('videoid')
+
+        self.assertEqual(1, len(jobs))
+        self.assertEqual(backend.get_video_file_path('videoid', 'LD'), mock_ffmpeg_transcode_video.delay.call_args[0][1])
+        self.assertFalse(os.path.exists(backend.get_video_file_path('videoid', 'HD')))
+
+    @override_settings(FFMPEG_SKIP_UPSCALING=False, FFMPEG_PRESETS={
+        'HD': {
+            'size': '1280x720',
+            'video_bitrate': '2048k',
+            'audio_bitrate': '128k',
+        },
+        'LD': {
+            'size': '640x360',
+            'video_bitrate': '512k',
+            'audio_bitrate': '64k',
+        },
+    })
+    @patch("contrib.plugins.local.tasks.ffmpeg_transcode_video")
+    def test_start_transcoding_skip_formats(self, mock_ffmpeg_transcode_video):
+        backend = local_backend.Backend()
+        file_object = BytesIO(b"some content")
+        file_object.name = "somevideo.mp4"
+        backend.upload_video('videoid', file_object)
+        with open(backend.make_file_path('videoid', 'HD.mp4'), 'wb') as f:
+            f.write(b'HD content')
+        checksum = backend.get_format_checksum('videoid', 'HD')
+
+        jobs = backend.start_transcoding('videoid', skip_formats=['HD'])
+
+        self.assertEqual(1, len(jobs))
+        self.assertEqual(['LD'], backend.get_job_formats(jobs[0]))
+        mock_ffmpeg_transcode_video.delay.assert_called_once()
+        self.assertEqual(backend.get_video_file_path('videoid', 'LD'), mock_ffmpeg_transcode_video.delay.call_args[0][1])
+        self.assertEqual(checksum, backend.get_format_checksum('videoid', 'HD'))
+        self.assertEqual([], backend.start_transcoding('videoid', skip_formats=['HD', 'LD']))
+
+    def test_get_format_checksum(self):
+        backend = local_backend.Backend()
+        self.assertIsNone(backend.get_format_checksum('videoid', 'HD'))
+        with open(backend.make_file_path('videoid', 'HD.mp4'), 'wb') as f:
+            f.write(b'HD content')
+        checksum = backend.get_format_checksum('videoid', 'HD')
+        with open(backend.make_file_path('videoid', 'HD.mp4'), 'wb') as f:
+            f.write(b'Other HD content')
+
+        self.assertIsNotNone(checksum)
+        self.assertNotEqual(checksum, backend.get_format_checksum('videoid', 'HD'))
+
+    @override_settings(FFMPEG_THUMBNAILS_PRESET='HD', FFMPEG_PRESETS={
+        'HD': {'size': '1280x720'},
+        'SD': {'size': '854x480'},
+        'LD': {'size': '640x360'},
+    })
+    @patch('contrib.plugins.local.tasks.ffmpeg_create_thumbnail')
+    def test_create_thumbnail_from_largest_format(self, mock_ffmpeg_create_thumbnail):
+        backend = local_backend.Backend()
+        for format_name in ['SD', 'LD']:
+            with open(backend.make_file_path('videoid', format_name + '.mp4'), 'wb') as f:
+                f.write(b'content')
+
+        backend.create_thumbnail("videoid", "thumbid")
+
+        self.assertEqual(backend.get_video_file_path('videoid', 'SD'), mock_ffmpeg_create_thumbnail.call_args[0][0])
+
     def test_upload_subtitle(self):
         backend = local_backend.Backend()
 
@@ -267,6 +605,39 @@ class LocalBackendTests(TestCase):
         self.assertEqual('http://example.com/backend/storage/videos/videoid/thumbs/thumbid.jpg',
                          backend.thumbnail_url('videoid', 'thumbid'))
 
+    def test_bulk_urls(self):
+        backend = local_backend.Backend()
+        # Ids with characters that need to be quoted
+        video_formats = [('videoid', 'HD'), ('video id', 'SD'), ('videoid', backend.HLS_FORMAT_NAME)]
+        subtitles = [('videoid', 'subid', 'fr'), ('video%id', 'sub{id}', 'en')]
+        thumbnails = [('videoid', 'thumbid'), ('video?id', 'thumb#id')]
+
+        self.assertEqual(
+            [backend.video_url(*args) for args in video_formats],
+            backend.video_urls(video_formats)
+        )
+        self.assertEqual(
+            [backend.subtitle_url(*args) for args in subtitles],
+            backend.subtitle_urls(subtitles)
+        )
+        self.assertEqual(
+            [backend.thumbnail_url(*args) for args in thumbnails],
+            backend.thumbnail_urls(thumbnails)
+        )
+        self.assertEqual(
+            [backend.poster_frames_url(*args) for args in thumbnails],
+            backend.poster_frames_urls(thumbnails)
+        )
+        self.assertEqual('/backend/storage/videos/video%20id/SD.mp4', backend.video_urls(video_formats)[1])
+
+    @override_settings(ASSETS_ROOT_URL="http://example.com")
+    def test_bulk_urls_with_root_url(self):
+        backend = local_backend.Backend()
+        self.assertEqual(
+            ['http://example.com/backend/storage/videos/videoid/thumbs/thumbid.jpg'],
+            backend.thumbnail_urls([('videoid', 'thumbid')])
+        )
+
     @override_settings(FFMPEG_PRESETS={
         'HD': {
             'video_bitrate': '5120k',
@@ -0,0 +1,56 @@
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import Mock, patch
+
+from contrib.plugins.local import scheduler
+from contrib.plugins.local import tasks
+
+
+class SchedulerTests(TestCase):
+
+    def setUp(self):
+        scheduler_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scheduler_dir, True)
+        settings_override = override_settings(FFMPEG_ENCODE_SCHEDULER_DIR=scheduler_dir, FFMPEG_CPU_COUNT=8)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_thread_budget(self):
+        self.assertEqual(1, scheduler.thread_budget([{'size': '640x360'}]))
+        self.assertEqual(4, scheduler.thread_budget([{'size': '1280x720'}]))
+        self.assertEqual(5, scheduler.thread_budget([{'size': '1280x720'}, {'size': '640x360'}]))
+        # Thread budget is capped by the number of cores
+        self.assertEqual(8, scheduler.thread_budget([{'size': '1920x1080'}]))
+        self.assertEqual(1, scheduler.thread_budget([{}]))
+
+    def test_admission_control(self):
+        slot_id1 = scheduler.acquire(6)
+        slot_id2 = scheduler.acquire(2)
+        self.assertRaises(scheduler.NoCapacity, scheduler.acquire, 1)
+        self.assertEqual(
+            {'cpu_count': 8, 'threads_in_use': 8, 'encodings': 2, 'occupancy': 1},
+            scheduler.occupancy()
+        )
+
+        scheduler.release(slot_id1)
+        scheduler.release(slot_id2)
+        # Large encodings are admitted on idle nodes
+        scheduler.release(scheduler.acquire(16))
+        self.assertEqual(0, scheduler.occupancy()['encodings'])
+
+    def test_slots_of_dead_processes_are_released(self):
+        with patch('os.getpid', return_value=2**22 + 1):
+            scheduler.acquire(8)
+
+        scheduler.acquire(8)
+        self.assertEqual(1, scheduler.occupancy()['encodings'])
+
+    def test_encoding_task_is_retried_when_node_is_busy(self):
+        scheduler.acquire(8)
+        task = Mock(retry=Mock(return_value=ValueError('retry')))
+
+        self.assertRaises(ValueError, tasks.acquire_encode_slot, task, 1)
+        task.retry.assert_called_once_with(countdown=scheduler.retry_delay(), max_retries=None)
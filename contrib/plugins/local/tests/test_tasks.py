@@ -0,0 +1,186 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from contrib.plugins.local import progress
+from contrib.plugins.local import tasks
+
+
+# 720p h264/aac source video, as returned by ffprobe
+SOURCE_MEDIA_INFO = {
+    'format': {'duration': '60.0'},
+    'streams': [
+        {
+            'codec_type': 'video', 'codec_name': 'h264', 'pix_fmt': 'yuv420p',
+            'width': 1280, 'height': 720, 'avg_frame_rate': '30000/1001', 'bit_rate': '2000000',
+        },
+        {'codec_type': 'audio', 'codec_name': 'aac', 'bit_rate': '128000'},
+    ],
+}
+
+
+class TasksTests(TestCase):
+
+    def test_split_scale_filter(self):
+        self.assertEqual(
+            "[0:v]split=2[in0][in1];[in0]scale=1280:720[out0];[in1]scale=640:360[out1]",
+            tasks.split_scale_filter(['1280x720', '640x360'])
+        )
+
+    @patch('pipeline.backend.get')
+    @patch('pipeline.media.probe', return_value={'format': {'duration': '60'}, 'streams': []})
+    @patch('contrib.plugins.local.tasks.run_with_progress')
+    def test_ffmpeg_transcode_video_fails_before_encoding(self, mock_run_with_progress, _mock_probe, mock_backend):
+        jobs_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, jobs_dir, True)
+
+        # Presets without bitrates: the command cannot be built
+        with override_settings(FFMPEG_JOBS_DIR=jobs_dir):
+            with self.assertRaises(KeyError):
+                tasks.ffmpeg_transcode_video.apply(
+                    args=('src.mp4', 'HD.mp4', {'size': '1280x720'}),
+                    kwargs={'video_id': 'videoid'},
+                    task_id='jobid',
+                )
+            self.assertEqual(progress.STATUS_FAILED, progress.get_states(['jobid'])['jobid'][0])
+
+        mock_run_with_progress.assert_not_called()
+        mock_backend.return_value.notify_progress.assert_called_once_with('videoid')
+
+    @patch('pipeline.media.probe', return_value={'format': {'duration': '60'}, 'streams': []})
+    @patch('contrib.plugins.local.tasks.run_with_progress')
+    def test_ffmpeg_transcode_video_multi(self, mock_run_with_progress, _mock_probe):
+        tasks.ffmpeg_transcode_video_multi(
+            'src.mp4',
+            [
+                ('HD.mp4', {'size': '1280x720', 'video_bitrate': '2200k', 'audio_bitrate': '128k'}),
+                ('LD.mp4', {'size': '640x360', 'video_bitrate': '896k', 'audio_bitrate': '64k'}),
+            ]
+        )
+
+        command = mock_run_with_progress.call_args[0][0]
+        # Source is decoded once
+        self.assertEqual(1, command.count('-i'))
+        self.assertEqual(1, command.count('-filter_complex'))
+        self.assertEqual(['[out0]', '[out1]'], [command[i + 1] for i, arg in enumerate(command) if arg == '-map'][::2])
+        self.assertLess(command.index('HD.mp4'), command.index('[out1]'))
+        self.assertEqual('LD.mp4', command[-1])
+        self.assertEqual(60, mock_run_with_progress.call_args[0][1])
+
+    @patch('pipeline.media.probe', return_value=SOURCE_MEDIA_INFO)
+    @patch('contrib.plugins.local.tasks.run_with_progress')
+    def test_ffmpeg_transcode_video_stream_copy(self, mock_run_with_progress, _mock_probe):
+        tasks.ffmpeg_transcode_video(
+            'src.mp4', 'HD.mp4',
+            {'size': '1280x720', 'video_bitrate': '2200k', 'audio_bitrate': '128k'}
+        )
+
+        command = mock_run_with_progress.call_args[0][0]
+        self.assertIn('copy', command)
+        self.assertNotIn('libx264', command)
+        self.assertEqual('HD.mp4', command[-1])
+
+    @override_settings(FFMPEG_STREAM_COPY=False, FFMPEG_CPU_COUNT=8)
+    @patch('pipeline.media.probe', return_value=SOURCE_MEDIA_INFO)
+    @patch('contrib.plugins.local.tasks.run_with_progress')
+    def test_ffmpeg_transcode_video_stream_copy_disabled(self, mock_run_with_progress, _mock_probe):
+        tasks.ffmpeg_transcode_video(
+            'src.mp4', 'HD.mp4',
+            {'size': '1280x720', 'video_bitrate': '2200k', 'audio_bitrate': '128k'}
+        )
+
+        command = mock_run_with_progress.call_args[0][0]
+        self.assertNotIn('copy', command)
+        self.assertIn('libx264', command)
+        self.assertEqual('4', command[command.index('-threads') + 1])
+
+    @patch('pipeline.media.probe', return_value=SOURCE_MEDIA_INFO)
+    @patch('contrib.plugins.local.tasks.run_with_progress')
+    def test_ffmpeg_transcode_video_multi_stream_copy(self, mock_run_with_progress, _mock_probe):
+        tasks.ffmpeg_transcode_video_multi(
+            'src.mp4',
+            [
+                ('HD.mp4', {'size': '1280x720', 'video_bitrate': '2200k', 'audio_bitrate': '128k'}),
+                ('LD.mp4', {'size': '640x360', 'video_bitrate': '896k', 'audio_bitrate': '64k'}),
+            ]
+        )
+
+        command = mock_run_with_progress.call_args[0][0]
+        # Only the LD format goes through the filter graph
+        self.assertEqual("[0:v]split=1[in0];[in0]scale=640:360[out0]", command[command.index('-filter_complex') + 1])
+        self.assertLess(command.index('LD.mp4'), command.index('copy'))
+        self.assertEqual('HD.mp4', command[-1])
+
+    @patch('pipeline.media.probe', return_value=None)
+    @patch('contrib.plugins.local.tasks.ffmpeg_concat_segments')
+    @patch('contrib.plugins.local.tasks.run_with_progress')
+    def test_ffmpeg_transcode_segment_concatenates_last_segment(self, mock_run_with_progress,
+                                                                mock_concat_segments, _mock_probe):
+        def run_with_progress(command, duration, job_id):
+            with open(command[-1], 'wb') as f:
+                f.write(b'transcoded segment')
+        mock_run_with_progress.side_effect = run_with_progress
+
+        segments_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, segments_dir, True)
+        dst_paths = [os.path.join(segments_dir, '00000.mp4'), os.path.join(segments_dir, '00001.mp4')]
+        presets = {'size': '1280x720', 'video_bitrate': '2200k', 'audio_bitrate': '128k'}
+
+        tasks.ffmpeg_transcode_segment('00001.mkv', dst_paths[1], presets, dst_paths, 'HD.mp4')
+        mock_concat_segments.assert_not_called()
+        self.assertTrue(os.path.exists(dst_paths[1]))
+
+        tasks.ffmpeg_transcode_segment('00000.mkv', dst_paths[0], presets, dst_paths, 'HD.mp4')
+        mock_concat_segments.assert_called_once_with(dst_paths, 'HD.mp4')
+        self.assertFalse(os.path.exists(segments_dir))
+
+    @override_settings(FFMPEG_POSTER_FRAMES_SPRITE_COLUMNS=2, FFMPEG_POSTER_FRAMES_SPRITE_ROWS=1,
+                       FFMPEG_POSTER_FRAMES_MIN_INTERVAL=10)
+    @patch('pipeline.media.probe', return_value={'format': {'duration': '25.5'}, 'streams': []})
+    @patch('contrib.plugins.local.tasks.run')
+    def test_ffmpeg_create_poster_frames_sprites(self, mock_run, _mock_probe):
+        vtt_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, vtt_dir, True)
+        vtt_path = os.path.join(vtt_dir, 'posterid.vtt')
+
+        tasks.ffmpeg_create_poster_frames('src.mp4', vtt_path, 'posterid.vtt')
+
+        # Frames are scaled and tiled in a single ffmpeg pass
+        mock_run.assert_called_once()
+        command = mock_run.call_args[0][0]
+        self.assertEqual(1, command.count('-i'))
+        self.assertIn('fps=1/10,', command[command.index('-vf') + 1])
+        self.assertIn('tile=2x1', command[command.index('-vf') + 1])
+        self.assertEqual(vtt_path + '_%d.jpg', command[-1])
+        with open(vtt_path) as vtt_file:
+            self.assertEqual(
+                "WEBVTT\n\n"
+                "00:00:00.000 --> 00:00:10.000\nposterid.vtt_1.jpg#xywh=0,0,160,90\n\n"
+                "00:00:10.000 --> 00:00:20.000\nposterid.vtt_1.jpg#xywh=160,0,160,90\n\n"
+                "00:00:20.000 --> 00:00:25.500\nposterid.vtt_2.jpg#xywh=0,0,160,90",
+                vtt_file.read()
+            )
+
+    def test_poster_frames_interval(self):
+        # Short videos: one frame per second
+        self.assertEqual(1, tasks.poster_frames_interval(9))
+        self.assertEqual(9, tasks.poster_frames_vtt('posterid.vtt', 9, 1, 10, 10).count('posterid.vtt_'))
+        self.assertEqual(1, tasks.poster_frames_interval(200))
+        # Long videos: frame count is bounded
+        self.assertEqual(2, tasks.poster_frames_interval(201))
+        self.assertEqual(54, tasks.poster_frames_interval(3 * 3600))
+        self.assertLessEqual(3 * 3600 / tasks.poster_frames_interval(3 * 3600), 200)
+
+    @override_settings(FFMPEG_POSTER_FRAMES_MIN_INTERVAL=10, FFMPEG_POSTER_FRAMES_MAX_COUNT=100)
+    def test_poster_frames_interval_settings(self):
+        self.assertEqual(10, tasks.poster_frames_interval(9))
+        self.assertEqual(10, tasks.poster_frames_interval(60))
+        self.assertEqual(108, tasks.poster_frames_interval(3 * 3600))
+
+    def test_vtt_timestamp(self):
+        self.assertEqual("00:00:00.000", tasks.vtt_timestamp(0))
+        self.assertEqual("01:02:03.500", tasks.vtt_timestamp(3723.5))
@@ -0,0 +1,59 @@
+from django.test import TestCase
+
+from contrib.plugins.local import utils
+
+
+class UtilsTests(TestCase):
+
+    def test_iter_progress(self):
+        output = [
+            "frame=0\n",
+            "out_time_ms=N/A\n",
+            "progress=continue\n",
+            "frame=25\n",
+            "out_time_ms=1000000\n",
+            "progress=continue\n",
+            "out_time_ms=3000000\n",
+            "progress=end\n",
+        ]
+        self.assertEqual([25, 75, 100], list(utils.iter_progress(output, 4)))
+
+    def test_iter_progress_unknown_duration(self):
+        output = ["out_time_ms=1000000\n", "progress=end\n"]
+        self.assertEqual([100], list(utils.iter_progress(output, None)))
+
+    def test_probe_duration_of_missing_file(self):
+        self.assertIsNone(utils.probe_duration('/tmp/this/file/does/not/exist.mp4'))
+
+    def test_can_stream_copy(self):
+        media_info = {
+            'streams': [
+                {
+                    'codec_type': 'video', 'codec_name': 'h264', 'pix_fmt': 'yuv420p',
+                    'width': 1280, 'height': 720, 'avg_frame_rate': '25/1', 'bit_rate': '2000000',
+                },
+                {'codec_type': 'audio', 'codec_name': 'aac', 'bit_rate': '128000'},
+            ],
+        }
+        hd_presets = {'size': '1280x720', 'video_bitrate': '2200k', 'audio_bitrate': '128k'}
+        ld_presets = {'size': '640x360', 'video_bitrate': '896k', 'audio_bitrate': '64k'}
+
+        self.assertTrue(utils.can_stream_copy(media_info, hd_presets))
+        self.assertFalse(utils.can_stream_copy(media_info, ld_presets))
+
+        media_info['streams'][0]['codec_name'] = 'vp9'
+        self.assertFalse(utils.can_stream_copy(media_info, hd_presets))
+
+    def test_can_stream_copy_unknown_bitrate(self):
+        media_info = {
+            'streams': [
+                {
+                    'codec_type': 'video', 'codec_name': 'h264', 'pix_fmt': 'yuv420p',
+                    'width': 640, 'height': 360, 'avg_frame_rate': '25/1',
+                },
+            ],
+        }
+        presets = {'size': '1280x720', 'video_bitrate': '2200k', 'audio_bitrate': '128k'}
+        self.assertFalse(utils.can_stream_copy(media_info, presets))
+        self.assertFalse(utils.can_stream_copy(None, presets))
+
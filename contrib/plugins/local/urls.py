@@ -6,6 +6,11 @@ from . import backend
 
 urlpatterns = [
     # Note that these urls should be served by the webserver (ex: nginx) for efficiency reasons.
+    url(
+        r'^storage/videos/(?P<video_id>[^/]+)/{}/(?P<path>.+)$'.format(backend.Backend.HLS_DIRNAME),
+        views.storage_hls,
+        name='storage-hls'
+    ),
     url(r'^storage/videos/(?P<video_id>.+)/(?P<format_name>.+)\.mp4$', views.storage_video, name='storage-video'),
     url(
         r'^storage/videos/(?P<video_id>.+)/{}/(?P<subtitle_id>.+)\.(?P<language_code>.+)\.vtt$'.format(
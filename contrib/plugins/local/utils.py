@@ -1,21 +1,114 @@
+import os
+
 from django.conf import settings
-from PIL import Image
+
+import pipeline.media
 
 def ffmpeg_binary():
     return getattr(settings, 'FFMPEG_BINARY', 'ffmpeg')
 
-def resize_image(in_path, out_path, max_size):
+def probe_duration(path):
+    """
+    Returns the duration of a media file, in seconds, or None if it could not
+    be determined.
+    """
+    return pipeline.media.get_duration(pipeline.media.probe(path))
+
+def can_stream_copy(media_info, ffmpeg_presets):
+    """
+    Check whether a source video already fits a preset, such that it can be
+    copied without re-encoding. This is the case for yuv420p h264 videos with
+    aac audio (or no audio) that are not larger, and do not have a higher
+    frame rate or bitrate, than the preset.
+
+    Args:
+        media_info (dict): output of `pipeline.media.probe`
+        ffmpeg_presets (dict)
+    """
+    video = pipeline.media.get_stream(media_info, 'video')
+    audio = pipeline.media.get_stream(media_info, 'audio')
+    if video is None:
+        return False
+    if video.get('codec_name') != 'h264' or video.get('pix_fmt') != 'yuv420p':
+        return False
+    if audio is not None and audio.get('codec_name') != 'aac':
+        return False
+    try:
+        width, height = parse_size(ffmpeg_presets['size'])
+        if int(video['width']) > width or int(video['height']) > height:
+            return False
+        if pipeline.media.parse_frame_rate(video['avg_frame_rate']) > float(ffmpeg_presets.get('framerate', '30')):
+            return False
+        if int(video['bit_rate']) > bitrate_value(ffmpeg_presets['video_bitrate']):
+            return False
+        if audio is not None and int(audio['bit_rate']) > bitrate_value(ffmpeg_presets['audio_bitrate']):
+            return False
+    except (KeyError, ValueError, ZeroDivisionError):
+        # Some properties could not be determined
+        return False
+    return True
+
+def parse_size(size):
+    """
+    Convert a '1280x720' size string to a (width, height) tuple. Returns None
+    for undefined sizes.
+    """
+    if not size:
+        return None
+    width, height = size.split('x')
+    return int(width), int(height)
+
+def bitrate_value(str_bitrate):
+    """
+    Convert a bitrate string to integer.
+    """
+    if 'k' in str_bitrate:
+        return int(str_bitrate.replace("k", "")) * 1024
+    return int(str_bitrate)
+
+def file_checksum(path):
+    """
+    Returns a checksum of a file, or None if the file does not exist. The
+    checksum is made of the file size and modification time, such that it is
+    cheap to compute even for large video files: the file is not read.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return "{}-{}".format(stat.st_size, stat.st_mtime_ns)
+
+def create_file_exclusive(path):
+    """
+    Atomically create an empty file. Returns False if the file already exists.
+    This can be used as a lock across processes that share the same storage.
+    """
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+def iter_progress(lines, duration):
     """
-    Resize an image by keeping the aspect ratio such that the maximum of
-    (width, height) is equal to max_size. Note that this function may increase
-    the size of the input image.
+    Parse the output of ffmpeg's `-progress` option.
 
     Args:
-        in_path (str): path of the input image file
-        out_path (str): path of the output image file
-        max_size (int): maximum desired width and height
-    """
-    in_img = Image.open(in_path)
-    ratio = max_size * 1. / max(in_img.size)
-    out_img = in_img.resize((round(in_img.size[0] * ratio), round(in_img.size[1] * ratio)))
-    out_img.save(out_path)
\ No newline at end of file
+        lines (iterable of str): ffmpeg progress output
+        duration (float): total duration of the source file, in seconds
+
+    Yields:
+        progress (float): progress percentage between 0 and 100
+    """
+    for line in lines:
+        key, _sep, value = line.strip().partition('=')
+        # Note that, despite its name, out_time_ms is expressed in microseconds
+        if key in ('out_time_us', 'out_time_ms') and duration:
+            try:
+                elapsed = int(value) / 1000000.
+            except ValueError:
+                # Value is 'N/A' at the beginning of the transcoding
+                continue
+            yield min(max(elapsed * 100. / duration, 0), 100)
+        elif key == 'progress' and value == 'end':
+            yield 100
@@ -1,6 +1,7 @@
 import os
 
 from django.conf import settings
+from django.http import Http404
 from django.views import static
 
 from .backend import Backend
@@ -12,6 +13,13 @@ from .backend import Backend
 def storage_video(request, video_id, format_name):
     return serve_file_with_access_control(request, Backend.get_video_file_path(video_id, format_name))
 
+def storage_hls(request, video_id, path):
+    try:
+        file_path = Backend.get_hls_file_path(video_id, path)
+    except ValueError:
+        raise Http404
+    return serve_file_with_access_control(request, file_path)
+
 def storage_subtitle(request, video_id, subtitle_id, language_code):
     return serve_file_with_access_control(request, Backend.get_subtitle_file_path(video_id, subtitle_id, language_code))
 
@@ -5,6 +5,17 @@ from . import models
 
 class ProcessingStateInlineAdmin(admin.TabularInline):
     model = models.ProcessingState
+    readonly_fields = ('restart_claimed_until',)
+
+
+class VideoMetadataInlineAdmin(admin.StackedInline):
+    model = models.VideoMetadata
+    readonly_fields = ('probed_at',)
+
+
+class TranscodingJobInlineAdmin(admin.TabularInline):
+    model = models.TranscodingJob
+    readonly_fields = ('updated_at',)
 
 
 class VideoAdmin(admin.ModelAdmin):
@@ -15,7 +26,7 @@ class VideoAdmin(admin.ModelAdmin):
     search_fields = ('title', 'public_id',)
     list_filter = ('owner',)
     raw_id_fields = ('owner',)
-    inlines = [ProcessingStateInlineAdmin]
+    inlines = [ProcessingStateInlineAdmin, VideoMetadataInlineAdmin, TranscodingJobInlineAdmin]
 
     def get_queryset(self, request):
         qs = super(VideoAdmin, self).get_queryset(request)
@@ -1,5 +1,13 @@
 import importlib
+import threading
+
+from celery.signals import worker_process_init
 from django.conf import settings
+from django.core.signals import setting_changed
+
+from videofront.celery_videofront import send_task
+from . import events
+from . import exceptions
 
 
 class BaseBackend(object):
@@ -19,20 +27,73 @@ class BaseBackend(object):
         """
         raise NotImplementedError
 
-    def start_transcoding(self, video_id):
+    def probe_source(self, video_id):
+        """
+        Probe the source video file, e.g: with `pipeline.media.probe`. This is
+        done once, when the video is first transcoded: the results are stored
+        in the database and may then be obtained with
+        `VideoMetadata.objects.get_media_info`.
+
+        This feature is optional. If undefined, the source video properties
+        are unknown.
+
+        Args:
+            video_id (str)
+
+        Returns:
+            media_info (dict): ffprobe json output, or None
+        """
+        return None
+
+    def start_transcoding(self, video_id, skip_formats=None):
         """
         Create and start transcoding jobs.
 
+        Args:
+            video_id (str)
+            skip_formats (list of str): formats that were already transcoded,
+            and which must not be transcoded again. This argument is passed
+            only when transcoding is restarted and some formats were already
+            transcoded, which requires the backend to implement
+            `get_job_formats`.
+
         Returns:
             jobs: iterable of arbitrary job objects. Each of these job objects
             will be passed as argument to the `check_progress` method
         """
         raise NotImplementedError
 
+    def get_job_formats(self, job):
+        """
+        Names of the formats that are produced by a transcoding job. When
+        transcoding is restarted, formats that were successfully produced, and
+        whose file has not changed since (see `get_format_checksum`), are not
+        transcoded again.
+
+        This feature is optional. If undefined, all formats are transcoded
+        again when transcoding is restarted.
+
+        Args:
+            job: arbitrary object that was returned by the `start_transcoding` method
+
+        Returns:
+            format_names (list of str)
+        """
+        return []
+
+    def get_format_checksum(self, video_id, format_name):
+        """
+        Returns a checksum of the transcoded video file of a given format, or
+        None if the file does not exist.
+        """
+        return None
+
     def check_progress(self, job):
         """
         Monitor the progress of a transcoding job. This method will be called
-        periodically by the transcoding task.
+        by the `transcode_video_check` task (see `check_progress_many`) with
+        an increasing period, and right away whenever the backend calls
+        `notify_progress`.
 
         Args:
             job: arbitrary object that was returned by the `start_transcoding` method
@@ -47,6 +108,54 @@ class BaseBackend(object):
         """
         raise NotImplementedError
 
+    def check_progress_many(self, jobs):
+        """
+        Monitor the progress of all unfinished transcoding jobs of a video at
+        once. This is the method that is actually called by the
+        `transcode_video_check` task. Backends that can fetch the state of
+        multiple jobs in a single request should override it; by default,
+        `check_progress` is called for every job.
+
+        Args:
+            jobs (list): objects that were returned by the `start_transcoding` method
+
+        Returns:
+            results (list): for each job, either a (progress, finished) tuple,
+            or the TranscodingFailed exception of a failed job. Exceptions are
+            returned, and not raised, such that the failure of a job does not
+            prevent the others from being checked.
+        """
+        results = []
+        for job in jobs:
+            try:
+                results.append(self.check_progress(job))
+            except exceptions.TranscodingFailed as e:
+                results.append(e)
+        return results
+
+    def notify_progress(self, video_id):
+        """
+        Notify the transcoding task that one of the transcoding jobs of this
+        video has progressed, finished or failed. Backends that are aware of
+        job state changes should call this method: otherwise, state changes
+        will only be detected by polling `check_progress`, with a period that
+        increases up to TRANSCODING_POLL_MAX_INTERVAL.
+
+        This method should not be overridden.
+        """
+        events.publish(video_id)
+        send_task('transcode_video_check', args=(video_id,))
+
+    def clean_transcoding(self, video_id):
+        """
+        Remove the intermediate files of the transcoding jobs of a video. This
+        method is called by the `transcode_video_finalize` task once all jobs
+        are finished, whether they succeeded or failed.
+
+        This feature is optional. If undefined, nothing is removed.
+        """
+        pass
+
     def delete_video(self, video_id):
         """
         Delete all resources associated to a video. E.g: in case of transcoding
@@ -66,9 +175,10 @@ class BaseBackend(object):
         the given format. This is the url that will be passed to the html5
         video player.
 
-        Note that there will be one call to this method for every format and
-        for every video object, at every call to the videos API. So the result
-        of this method should either be fast, or cached.
+        Note that there will be one url for every format and for every video
+        object, at every call to the videos API. So the result of this method
+        should either be fast, or cached. Video urls are actually built in bulk
+        with `video_urls`, which calls this method by default.
         """
         raise NotImplementedError
 
@@ -130,8 +240,8 @@ class BaseBackend(object):
         """
         Returns the url at which the subtitle file can be downloaded. Note
         that this method will be called once for every subtitle object for
-        every API videos API call. So the result of this result should either
-        be fast or cached.
+        every API videos API call, unless `subtitle_urls` is overridden. So the
+        result of this result should either be fast or cached.
         """
         raise NotImplementedError
 
@@ -155,6 +265,52 @@ class BaseBackend(object):
         """
         return ''
 
+    def video_urls(self, video_formats):
+        """
+        Urls of many videos at once, in the same order. Video lists are
+        serialized with this method and the other bulk url methods, such that
+        backends may build urls much faster than with one call to `video_url`
+        per url, e.g: by computing the common part of all urls only once. By
+        default, `video_url` is called for every url.
+
+        Args:
+            video_formats (list): (video_id, format_name) tuples
+
+        Returns:
+            urls (list of str)
+        """
+        return [self.video_url(video_id, format_name) for video_id, format_name in video_formats]
+
+    def subtitle_urls(self, subtitles):
+        """
+        Same as `video_urls`, for subtitles.
+
+        Args:
+            subtitles (list): (video_id, subtitle_id, language_code) tuples
+        """
+        return [
+            self.subtitle_url(video_id, subtitle_id, language_code)
+            for video_id, subtitle_id, language_code in subtitles
+        ]
+
+    def thumbnail_urls(self, thumbnails):
+        """
+        Same as `video_urls`, for thumbnails.
+
+        Args:
+            thumbnails (list): (video_id, thumb_id) tuples
+        """
+        return [self.thumbnail_url(video_id, thumb_id) for video_id, thumb_id in thumbnails]
+
+    def poster_frames_urls(self, poster_frames):
+        """
+        Same as `video_urls`, for poster frames.
+
+        Args:
+            poster_frames (list): (video_id, poster_id) tuples
+        """
+        return [self.poster_frames_url(video_id, poster_id) for video_id, poster_id in poster_frames]
+
 
 class UndefinedPluginBackend(Exception):
     pass
@@ -166,7 +322,11 @@ class MissingPluginBackend(Exception):
 
 def get():
     """
-    Get the plugin backend based on the PLUGIN_BACKEND setting.
+    Get the plugin backend based on the PLUGIN_BACKEND setting. The backend is
+    instantiated once per process, and shared by all threads: backends should
+    not store request-specific state. The backend is instantiated again after
+    `reset` is called, which happens whenever settings are modified (e.g: in
+    tests) and in every new celery worker process.
 
     Raises:
         UndefinedPluginBackend in case of undefined setting
@@ -178,16 +338,43 @@ def get():
     if setting is None:
         raise UndefinedPluginBackend()
 
+    # The backend setting is stored along with the backend, such that a
+    # different backend is returned if the setting is modified without
+    # sending a setting_changed signal.
+    cached = _backend_cache.get('backend')
+    if cached is None or cached[0] != setting:
+        with _backend_cache_lock:
+            cached = _backend_cache.get('backend')
+            if cached is None or cached[0] != setting:
+                cached = (setting, _load(setting))
+                _backend_cache['backend'] = cached
+    return cached[1]
+
+def _load(setting):
     if hasattr(setting, '__call__'):
-        backend_object = setting()
-    else:
-        module_name, object_name = setting.rsplit(".", 1)
-        backend_module = importlib.import_module(module_name)
-        backend_class = getattr(backend_module, object_name, None)
-        if backend_class is None:
-            raise MissingPluginBackend(setting)
-        # Note that we could cache the plugin backend across calls; we don't do
-        # it for now, because it's not really useful.
-        backend_object = backend_class()
-
-    return backend_object
+        return setting()
+    module_name, object_name = setting.rsplit(".", 1)
+    backend_module = importlib.import_module(module_name)
+    backend_class = getattr(backend_module, object_name, None)
+    if backend_class is None:
+        raise MissingPluginBackend(setting)
+    return backend_class()
+
+def reset(**kwargs):
+    """
+    Drop the cached plugin backend: the next call to `get` will instantiate a
+    new backend. Keyword arguments are ignored, such that this function can be
+    connected to signals.
+    """
+    _backend_cache.clear()
+
+
+# Cached (PLUGIN_BACKEND setting, backend object) tuple
+_backend_cache = {}
+_backend_cache_lock = threading.Lock()
+
+# Backends may read any setting at instantiation, e.g: AWS credentials.
+setting_changed.connect(reset)
+# Clients and connection pools of the backend must not be shared by forked
+# worker processes.
+worker_process_init.connect(reset)
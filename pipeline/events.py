@@ -0,0 +1,34 @@
+from django.core.cache import cache
+
+
+# Events older than this are not useful: they are only used to reset the
+# polling period of running transcoding jobs.
+EVENTS_CACHE_TIMEOUT = 24 * 3600
+
+
+def _cache_key(public_video_id):
+    """
+    Key which stores the number of transcoding events that were published for
+    this video.
+    """
+    return "TRANSCODING_EVENTS:" + public_video_id
+
+def publish(public_video_id):
+    """
+    Record that one of the transcoding jobs of this video has progressed,
+    finished or failed.
+    """
+    key = _cache_key(public_video_id)
+    cache.add(key, 0, EVENTS_CACHE_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The key expired between add and incr
+        cache.set(key, 1, EVENTS_CACHE_TIMEOUT)
+
+def count(public_video_id):
+    """
+    Number of events that were published for this video. The absolute value is
+    meaningless: only changes in this value matter.
+    """
+    return cache.get(_cache_key(public_video_id), 0)
@@ -0,0 +1,239 @@
+from contextlib import contextmanager
+import importlib
+import logging
+import random
+import threading
+from time import sleep, time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.transaction import TransactionManagementError
+
+from . import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+class BaseLockBackend(object):
+    """
+    Storage of lock leases. A lease is an owner token stored under the lock
+    name, that expires automatically.
+    """
+
+    def add(self, name, token, timeout):
+        """
+        Store a lease, unless the lock is already leased.
+
+        Returns:
+            added (bool)
+        """
+        raise NotImplementedError
+
+    def get(self, name):
+        """
+        Returns:
+            token (str): token of the current lease owner, or None.
+        """
+        raise NotImplementedError
+
+    def set(self, name, token, timeout):
+        """
+        Store a lease, overriding any existing lease.
+        """
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+    def renew(self, name, token, timeout):
+        """
+        Extend a lease owned by `token`. An expired lease is acquired again,
+        provided that no one else acquired it in the meantime.
+
+        Note that the default implementation is not atomic: a lease that
+        expires right between the ownership check and the update could be
+        overridden. Leases should be renewed well before they expire.
+
+        Returns:
+            renewed (bool): False if the lock is owned by someone else.
+        """
+        owner = self.get(name)
+        if owner is None:
+            return self.add(name, token, timeout)
+        if owner != token:
+            return False
+        self.set(name, token, timeout)
+        return True
+
+    def release(self, name, token):
+        """
+        Delete a lease, only if it is owned by `token`. As for `renew`, the
+        default implementation is not atomic.
+
+        Returns:
+            released (bool)
+        """
+        if self.get(name) != token:
+            return False
+        self.delete(name)
+        return True
+
+
+class CacheLockBackend(BaseLockBackend):
+    """
+    Leases are stored in the LOCK_CACHE Django cache. The default database
+    cache is shared by all web servers and workers; in production, a faster
+    store shared by all nodes, such as memcached or redis, may be used instead.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.LOCK_CACHE]
+
+    def add(self, name, token, timeout):
+        return self.cache.add(name, token, timeout=timeout)
+
+    def get(self, name):
+        return self.cache.get(name)
+
+    def set(self, name, token, timeout):
+        self.cache.set(name, token, timeout=timeout)
+
+    def delete(self, name):
+        self.cache.delete(name)
+
+
+def get_backend():
+    """
+    Get the lock backend based on the LOCK_BACKEND setting.
+    """
+    module_name, class_name = settings.LOCK_BACKEND.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class Lease(object):
+    """
+    Distributed lock that expires unless it is renewed by its owner. Each lease
+    is identified by a random owner token: only the owner may renew or release
+    the lock. The token may be stored and passed to other processes, such that
+    the lock can be held across consecutive tasks.
+
+    Usage:
+
+        with Lease('mylockname', timeout=60) as lease:
+            if lease.is_acquired:
+                run_not_thread_safe_code()
+
+        with Lease('mylockname', timeout=60, wait=True, wait_timeout=10) as lease:
+            # Block until the lock is available, for at most 10 seconds
+            ...
+
+        with Lease('mylockname', timeout=60) as lease:
+            if lease.is_acquired:
+                with lease.heartbeat():
+                    run_code_that_may_outlive_the_timeout()
+    """
+
+    def __init__(self, name, timeout=60, token=None, wait=False, wait_timeout=None):
+        """
+        Args:
+            name (str)
+            timeout (int): lease duration, in seconds.
+            token (str): owner token of an existing lease. A new token is
+            generated if undefined.
+            wait (bool): if True, block until the lock can be acquired.
+            wait_timeout (float): maximum waiting time, in seconds. Wait
+            indefinitely if None.
+        """
+        self.name = name
+        self.timeout = timeout
+        self.token = token or uuid.uuid4().hex
+        self.wait = wait
+        self.wait_timeout = wait_timeout
+        self.is_acquired = False
+        self.backend = get_backend()
+
+    def __enter__(self):
+        try:
+            self.acquire(wait=self.wait, wait_timeout=self.wait_timeout)
+        except exceptions.LockUnavailable:
+            pass
+        return self
+
+    def __exit__(self, exc_t, exc_v, trace):
+        if self.is_acquired:
+            self.release()
+
+    def acquire(self, wait=False, wait_timeout=None):
+        """
+        Acquire the lock. While waiting, attempts are spaced with an exponential
+        backoff, from 50 ms up to 2 s, with random jitter such that concurrent
+        waiters do not retry simultaneously.
+
+        Raises:
+            LockUnavailable if the lock could not be acquired
+        """
+        started_at = time()
+        delay = 0.05
+        while not self.backend.add(self.name, self.token, self.timeout):
+            if not wait or (wait_timeout is not None and time() - started_at + delay > wait_timeout):
+                raise exceptions.LockUnavailable(self.name)
+            sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(2 * delay, 2)
+        self.is_acquired = True
+        return True
+
+    def renew(self):
+        """
+        Extend the lease by `timeout` seconds.
+
+        Returns:
+            renewed (bool): False if the lock was acquired by someone else.
+        """
+        self.is_acquired = self.backend.renew(self.name, self.token, self.timeout)
+        return self.is_acquired
+
+    def release(self):
+        """
+        Release the lock, if we own it.
+        """
+        # Note that in unit tests, and in case the wrapped code raises an
+        # IntegrityError, releasing a lock stored in the database will result
+        # in a TransactionManagementError. This is because unit tests run
+        # inside atomic blocks. We cannot execute queries inside an atomic
+        # block if a transaction needs to be rollbacked.
+        try:
+            self.backend.release(self.name, self.token)
+        except TransactionManagementError:
+            logger.error("Could not release lock %s", self.name)
+        self.is_acquired = False
+
+    @contextmanager
+    def heartbeat(self):
+        """
+        Context manager that renews the lease in a background thread, every
+        third of the lease duration, for as long as the wrapped code runs.
+        """
+        stopped = threading.Event()
+
+        def beat():
+            try:
+                while not stopped.wait(self.timeout / 3.):
+                    if not self.renew():
+                        logger.error("Lost lock %s", self.name)
+                        return
+            finally:
+                # Database connections are thread-local
+                connection.close()
+
+        thread = threading.Thread(target=beat)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield self
+        finally:
+            stopped.set()
+            thread.join()
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from pipeline import models
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the API documents of all videos. This is required after an upgrade, and whenever the backend '
+        'settings that affect asset urls are modified.'
+    )
+
+    BATCH_SIZE = 200
+
+    def handle(self, *args, **options):
+        video_ids = list(models.Video.objects.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(video_ids), self.BATCH_SIZE):
+            batch_ids = video_ids[start:start + self.BATCH_SIZE]
+            models.rebuild_video_documents(models.Video.objects.filter(id__in=batch_ids))
+        self.stdout.write("Rebuilt {} video documents.".format(len(video_ids)))
@@ -1,6 +1,13 @@
+from datetime import timedelta
+import json
 from time import time
 
 from django.db import models
+from django.db.models import Q
+from django.utils.timezone import now
+
+from . import backend
+from . import media
 
 
 class VideoUploadUrlManager(models.Manager):
@@ -20,3 +27,94 @@ class VideoUploadUrlManager(models.Manager):
         Unused upload urls that have expired.
         """
         return self.filter(expires_at__lt=time() - 2*self.EXPIRE_DELAY, was_used=False)
+
+
+class ProcessingStateManager(models.Manager):
+
+    def update_progress(self, public_video_id, progress):
+        """
+        Set the progress of a processing video with a single UPDATE query of
+        the modified columns. This does not send any post_save signal: the
+        video document must then be updated with `models.update_video_document`.
+
+        Returns:
+            updated (int): number of updated rows (0 if the video was deleted)
+        """
+        return self.filter(video__public_id=public_video_id).update(
+            status=self.model.STATUS_PROCESSING,
+            progress=progress,
+        )
+
+    def claim_restarts(self, limit, claim_duration):
+        """
+        Processing states with a 'restart' status form a queue of videos to
+        transcode again. Claim at most `limit` unclaimed videos from this queue,
+        in order of creation: claimed videos are not returned again for
+        `claim_duration` seconds, or until their transcoding starts. The status
+        index returns the queue in order of creation, such that the cost of this
+        query does not depend on the number of videos.
+
+        Returns:
+            public_video_ids (list of str): claimed videos
+        """
+        claimed_at = now()
+        unclaimed = Q(restart_claimed_until__isnull=True) | Q(restart_claimed_until__lt=claimed_at)
+        restart_ids = list(self.filter(
+            unclaimed, status=self.model.STATUS_RESTART
+        ).order_by('id').values_list('id', flat=True)[:limit])
+        if not restart_ids:
+            return []
+        claimed_until = claimed_at + timedelta(seconds=claim_duration)
+        self.filter(unclaimed, id__in=restart_ids).update(restart_claimed_until=claimed_until)
+        return list(self.filter(
+            id__in=restart_ids, restart_claimed_until=claimed_until
+        ).order_by('id').values_list('video__public_id', flat=True))
+
+
+class VideoMetadataManager(models.Manager):
+
+    def probe_source(self, video):
+        """
+        Probe the source file of a video with the backend and store the
+        results. This is done once, when the video is first transcoded.
+
+        Returns:
+            metadata (VideoMetadata)
+        """
+        media_info = backend.get().probe_source(video.public_id)
+        video_stream = media.get_stream(media_info, 'video') or {}
+        audio_stream = media.get_stream(media_info, 'audio') or {}
+        width, height = media.get_video_size(media_info) or (None, None)
+        try:
+            frame_rate = media.parse_frame_rate(video_stream['avg_frame_rate'])
+        except (KeyError, ValueError, ZeroDivisionError):
+            frame_rate = None
+        try:
+            bitrate = int(media_info['format']['bit_rate'])
+        except (TypeError, KeyError, ValueError):
+            bitrate = None
+        metadata, _created = self.update_or_create(
+            video=video,
+            defaults={
+                'duration': media.get_duration(media_info),
+                'width': width,
+                'height': height,
+                'frame_rate': frame_rate,
+                'bitrate': bitrate,
+                'video_codec': video_stream.get('codec_name', ''),
+                'audio_codec': audio_stream.get('codec_name', ''),
+                'probe_output': json.dumps(media_info) if media_info else '',
+            }
+        )
+        return metadata
+
+    def get_media_info(self, public_video_id):
+        """
+        Media info of the source file of a video, as probed before transcoding.
+
+        Returns:
+            media_info (dict): see `media.probe`, or None if the source was
+            not, or could not be, probed.
+        """
+        metadata = self.filter(video__public_id=public_video_id).first()
+        return metadata.media_info if metadata else None
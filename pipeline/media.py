@@ -0,0 +1,70 @@
+import json
+import subprocess
+
+from django.conf import settings
+
+
+def ffprobe_binary():
+    return getattr(settings, 'FFPROBE_BINARY', 'ffprobe')
+
+def probe(path):
+    """
+    Probe the format and streams of a media file with ffprobe.
+
+    Args:
+        path (str): file path or url
+
+    Returns:
+        media_info (dict): parsed ffprobe json output, with 'format' and
+        'streams' keys, or None if the file could not be probed.
+    """
+    command = [
+        ffprobe_binary(),
+        '-v', 'quiet',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        path,
+    ]
+    try:
+        output = subprocess.check_output(command)
+        return json.loads(output.decode('utf-8'))
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+def get_stream(media_info, codec_type):
+    """
+    Returns the first stream of the given type ('video', 'audio') from the
+    output of `probe`, or None.
+    """
+    for stream in (media_info or {}).get('streams', []):
+        if stream.get('codec_type') == codec_type:
+            return stream
+    return None
+
+def get_duration(media_info):
+    """
+    Returns the duration from the output of `probe`, in seconds, or None.
+    """
+    try:
+        return float(media_info['format']['duration'])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+def get_video_size(media_info):
+    """
+    Returns the (width, height) of the first video stream from the output of
+    `probe`, or None.
+    """
+    stream = get_stream(media_info, 'video')
+    try:
+        return int(stream['width']), int(stream['height'])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+def parse_frame_rate(frame_rate):
+    """
+    Convert an ffprobe '30000/1001' frame rate to float.
+    """
+    numerator, _sep, denominator = frame_rate.partition('/')
+    return float(numerator) / float(denominator or 1)
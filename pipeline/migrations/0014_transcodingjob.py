@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pipeline', '0013_video_public_poster_frames_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscodingJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('format', 'Format'), ('thumbnail', 'Thumbnail'), ('poster_frames', 'Poster frames')], default='format', max_length=32)),
+                ('name', models.CharField(blank=True, max_length=128, verbose_name='Format name')),
+                ('status', models.CharField(choices=[('processing', 'Processing'), ('failed', 'Failed'), ('success', 'Success')], default='processing', max_length=32)),
+                ('checksum', models.CharField(blank=True, max_length=128, verbose_name='Checksum of the transcoded file')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transcoding_jobs', to='pipeline.Video')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='transcodingjob',
+            unique_together=set([('video', 'kind', 'name')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pipeline', '0014_transcodingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoMetadata',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('duration', models.FloatField(blank=True, null=True, verbose_name='Duration (seconds)')),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('frame_rate', models.FloatField(blank=True, null=True)),
+                ('bitrate', models.IntegerField(blank=True, null=True, verbose_name='Bitrate (bits/s)')),
+                ('video_codec', models.CharField(blank=True, max_length=32)),
+                ('audio_codec', models.CharField(blank=True, max_length=32)),
+                ('probe_output', models.TextField(blank=True, verbose_name='ffprobe json output')),
+                ('probed_at', models.DateTimeField(auto_now=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='metadata', to='pipeline.Video')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pipeline', '0015_videometadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingstate',
+            name='restart_claimed_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Time until which the restart is claimed by a transcoding task'),
+        ),
+    ]
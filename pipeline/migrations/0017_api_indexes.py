@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pipeline', '0016_processingstate_restart_queue'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processingstate',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('failed', 'Failed'), ('success', 'Success'), ('restart', 'Restart')], db_index=True, default='pending', max_length=32, verbose_name='Status'),
+        ),
+        migrations.AlterField(
+            model_name='videouploadurl',
+            name='expires_at',
+            field=models.IntegerField(verbose_name='Timestamp at which the url expires'),
+        ),
+        migrations.AlterField(
+            model_name='videouploadurl',
+            name='was_used',
+            field=models.BooleanField(default=False, verbose_name='Was the upload url used?'),
+        ),
+        migrations.AlterIndexTogether(
+            name='videouploadurl',
+            index_together=set([('owner', 'was_used', 'expires_at'), ('was_used', 'expires_at')]),
+        ),
+    ]
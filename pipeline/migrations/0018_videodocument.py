@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('pipeline', '0017_api_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoDocument',
+            fields=[
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='pipeline.Video')),
+                ('public_id', models.CharField(max_length=20, null=True, unique=True)),
+                ('processing_status', models.CharField(blank=True, max_length=32)),
+                ('content', models.TextField(verbose_name='API representation, in json')),
+                ('stale', models.BooleanField(default=False, verbose_name='Must the document be rebuilt before it is read?')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='videodocument',
+            index_together=set([('owner', 'video')]),
+        ),
+    ]
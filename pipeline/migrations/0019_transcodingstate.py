@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pipeline', '0018_videodocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscodingState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_video_id', models.CharField(max_length=20, unique=True)),
+                ('state', models.BinaryField(verbose_name='Pickled transcoding state')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
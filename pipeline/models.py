@@ -1,3 +1,6 @@
+import json
+import logging
+
 from django.conf.global_settings import LANGUAGES
 from django.contrib.auth.models import User
 from django.core.validators import MinLengthValidator, MinValueValidator, MaxValueValidator
@@ -7,11 +10,13 @@ from django.dispatch import receiver
 from django.utils.timezone import now
 
 from . import backend
-from . import cache
 from . import managers
 from . import utils
 
 
+logger = logging.getLogger(__name__)
+
+
 class Video(models.Model):
     title = models.CharField(max_length=100)
     public_id = models.CharField(
@@ -50,6 +55,13 @@ class Video(models.Model):
     def processing_started_at(self):
         return self.processing_state.started_at if self.processing_state else None
 
+    @property
+    def duration(self):
+        try:
+            return self.metadata.duration
+        except VideoMetadata.DoesNotExist:
+            return None
+
     @property
     def thumbnail_url(self):
         return backend.get().thumbnail_url(self.public_id, self.public_thumbnail_id)
@@ -98,12 +110,10 @@ class VideoUploadUrl(models.Model):
     )
     expires_at = models.IntegerField(
         verbose_name="Timestamp at which the url expires",
-        db_index=True
     )
     was_used = models.BooleanField(
         verbose_name="Was the upload url used?",
         default=False,
-        db_index=True
     )
     owner = models.ForeignKey(User, related_name='video_upload_urls')
     playlist = models.ForeignKey(
@@ -119,6 +129,14 @@ class VideoUploadUrl(models.Model):
 
     objects = managers.VideoUploadUrlManager()
 
+    class Meta:
+        index_together = [
+            # Available upload urls of a user
+            ('owner', 'was_used', 'expires_at'),
+            # Obsolete upload urls
+            ('was_used', 'expires_at'),
+        ]
+
     def __str__(self):
         return self.public_video_id
 
@@ -148,14 +166,22 @@ class ProcessingState(models.Model):
         default=0,
         validators=[MinValueValidator(0), MaxValueValidator(100)]
     )
+    # Indexed for the restart queue (see ProcessingStateManager.claim_restarts)
     status = models.CharField(
         verbose_name="Status",
         max_length=32,
         choices=STATUSES,
         blank=False,
         default=STATUS_PENDING,
+        db_index=True
     )
     message = models.CharField(max_length=1024, blank=True)
+    restart_claimed_until = models.DateTimeField(
+        verbose_name="Time until which the restart is claimed by a transcoding task",
+        null=True, blank=True
+    )
+
+    objects = managers.ProcessingStateManager()
 
     def __str__(self):
         return '{} - {}'.format(self.video, self.status)
@@ -164,11 +190,7 @@ class ProcessingState(models.Model):
         self.progress = 0
         self.status = self.STATUS_PENDING
         self.started_at = now()
-        self.save()
-
-    def set_processing(self, progress):
-        self.progress = progress
-        self.status = self.STATUS_PROCESSING
+        self.restart_claimed_until = None
         self.save()
 
     def set_success(self):
@@ -224,20 +246,327 @@ class VideoFormat(models.Model):
         return '{} - {} [{}]'.format(self.name, self.video, self.bitrate)
 
 
-@receiver([post_save, post_delete], sender=Video)
-def invalidate_video_cache(sender, instance=None, created=False, **kwargs):
+class TranscodingJob(models.Model):
+    """
+    Checkpoint of a transcoding step of a video: either the transcoding of a
+    single format, or the creation of the thumbnail or of the poster frames.
+    When transcoding is restarted, successful steps are not performed again.
+    """
+
+    KIND_FORMAT = 'format'
+    KIND_THUMBNAIL = 'thumbnail'
+    KIND_POSTER_FRAMES = 'poster_frames'
+    KINDS = (
+        (KIND_FORMAT, 'Format'),
+        (KIND_THUMBNAIL, 'Thumbnail'),
+        (KIND_POSTER_FRAMES, 'Poster frames'),
+    )
+
+    STATUS_PROCESSING = 'processing'
+    STATUS_FAILED = 'failed'
+    STATUS_SUCCESS = 'success'
+    STATUSES = (
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_SUCCESS, 'Success'),
+    )
+
+    video = models.ForeignKey(Video, related_name='transcoding_jobs')
+    kind = models.CharField(max_length=32, choices=KINDS, default=KIND_FORMAT)
+    name = models.CharField(
+        verbose_name="Format name",
+        max_length=128,
+        blank=True
+    )
+    status = models.CharField(
+        max_length=32,
+        choices=STATUSES,
+        default=STATUS_PROCESSING,
+    )
+    checksum = models.CharField(
+        verbose_name="Checksum of the transcoded file",
+        max_length=128,
+        blank=True
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('video', 'kind', 'name')
+
+    def __str__(self):
+        return '{} - {} {} [{}]'.format(self.video, self.kind, self.name, self.status)
+
+
+class TranscodingState(models.Model):
+    """
+    State of the transcoding jobs of a video, which is passed from one
+    transcoding task to the next (see `pipeline.transcoding_state`). States are
+    stored in the database, and not in a cache, such that they are never
+    evicted while the jobs are running. They are not related to the video
+    objects, which may be deleted during transcoding.
+    """
+
+    public_video_id = models.CharField(max_length=20, unique=True)
+    state = models.BinaryField(verbose_name="Pickled transcoding state")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{}'.format(self.public_video_id)
+
+
+class VideoMetadata(models.Model):
+    """
+    Properties of the source file of a video, probed once before transcoding.
+    """
+
+    video = models.OneToOneField(Video, related_name='metadata')
+    duration = models.FloatField(verbose_name="Duration (seconds)", null=True, blank=True)
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+    frame_rate = models.FloatField(null=True, blank=True)
+    bitrate = models.IntegerField(verbose_name="Bitrate (bits/s)", null=True, blank=True)
+    video_codec = models.CharField(max_length=32, blank=True)
+    audio_codec = models.CharField(max_length=32, blank=True)
+    probe_output = models.TextField(
+        verbose_name="ffprobe json output",
+        blank=True
+    )
+    probed_at = models.DateTimeField(auto_now=True)
+
+    objects = managers.VideoMetadataManager()
+
+    def __str__(self):
+        return '{} - {}x{} {}s'.format(self.video, self.width, self.height, self.duration)
+
+    @property
+    def media_info(self):
+        return json.loads(self.probe_output) if self.probe_output else None
+
+
+class VideoDocument(models.Model):
+    """
+    Denormalized API representation of a video, with its processing state,
+    subtitles, formats and asset urls. Documents are updated whenever the video
+    or one of its related objects is saved or deleted, such that videos can be
+    listed and retrieved by reading documents only: no join, no prefetch and no
+    backend call.
+
+    Asset urls depend on the backend settings: documents must be rebuilt with
+    the `rebuild-video-documents` command whenever these settings change.
+    Documents whose urls could not be built by the backend are stale: they are
+    rebuilt when they are read (see `refresh_stale_video_documents`).
+    """
+    DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+    video = models.OneToOneField(Video, primary_key=True, related_name='document')
+    public_id = models.CharField(max_length=20, unique=True, null=True)
+    owner = models.ForeignKey(User, related_name='+')
+    processing_status = models.CharField(max_length=32, blank=True)
+    content = models.TextField(verbose_name="API representation, in json")
+    stale = models.BooleanField(
+        verbose_name="Must the document be rebuilt before it is read?",
+        default=False
+    )
+
+    class Meta:
+        index_together = [
+            # Videos of a user, by order of creation
+            ('owner', 'video'),
+        ]
+
+    def __str__(self):
+        return '{}'.format(self.public_id)
+
+    @property
+    def data(self):
+        return json.loads(self.content)
+
+
+def _serialize_video_rows(videos):
+    """
+    Build the API representation of videos, as stored in video documents. This
+    is the same representation as `api.v1.serializers.VideoSerializer`, but it
+    is built from rows fetched with `values()`, without instantiating models:
+    this is an order of magnitude faster. Any modification of
+    `VideoSerializer` and its nested serializers must be reflected here.
+
+    Args:
+        videos (QuerySet): Video objects
+
+    Returns:
+        videos (list): (values() row, representation) tuples, in the order of
+        the queryset
+    """
+    rows = list(videos.select_related(None).prefetch_related(None).values(
+        'id', 'public_id', 'title', 'owner_id', 'public_thumbnail_id', 'public_poster_frames_id',
+        'processing_state__id', 'processing_state__status', 'processing_state__progress',
+        'processing_state__started_at', 'metadata__duration',
+    ))
+    if not rows:
+        return []
+    public_ids = {row['id']: row['public_id'] for row in rows}
+
+    # Subtitles and formats are fetched in the same order as the prefetched
+    # objects of each video
+    subtitle_rows = list(
+        Subtitle.objects.filter(video_id__in=public_ids).order_by('id').values_list(
+            'video_id', 'public_id', 'language'
+        )
+    )
+    format_rows = list(
+        VideoFormat.objects.filter(video_id__in=public_ids).order_by('id').values_list(
+            'video_id', 'name', 'bitrate'
+        )
+    )
+
+    plugin_backend = backend.get()
+    subtitle_urls = _build_urls(plugin_backend.subtitle_urls, [
+        (public_ids[video_id], subtitle_id, language) for video_id, subtitle_id, language in subtitle_rows
+    ])
+    format_urls = _build_urls(plugin_backend.video_urls, [
+        (public_ids[video_id], name) for video_id, name, _bitrate in format_rows
+    ])
+    thumbnail_urls = _build_urls(plugin_backend.thumbnail_urls, [
+        (row['public_id'], row['public_thumbnail_id']) for row in rows
+    ])
+    poster_frames_urls = _build_urls(plugin_backend.poster_frames_urls, [
+        (row['public_id'], row['public_poster_frames_id']) for row in rows
+    ])
+
+    subtitles = {video_id: [] for video_id in public_ids}
+    for (video_id, subtitle_id, language), url in zip(subtitle_rows, subtitle_urls):
+        subtitles[video_id].append({'id': subtitle_id, 'language': language, 'url': url})
+    formats = {video_id: [] for video_id in public_ids}
+    for (video_id, name, bitrate), url in zip(format_rows, format_urls):
+        formats[video_id].append({'name': name, 'url': url, 'bitrate': float(bitrate)})
+
+    return [
+        (row, {
+            'id': row['public_id'],
+            'title': row['title'],
+            'processing': _serialize_processing_state(row),
+            'subtitles': subtitles[row['id']],
+            'formats': formats[row['id']],
+            'thumbnail': thumbnail_url,
+            'poster_frames': poster_frames_url,
+            'duration': None if row['metadata__duration'] is None else float(row['metadata__duration']),
+        })
+        for row, thumbnail_url, poster_frames_url in zip(rows, thumbnail_urls, poster_frames_urls)
+    ]
+
+def _build_urls(bulk_url_method, assets):
+    """
+    Call one of the bulk url methods of the backend.
+
+    Returns:
+        urls (list): one url per asset
+    """
+    if not assets:
+        return []
+    return list(bulk_url_method(assets))
+
+def _serialize_processing_state(row):
+    if row['processing_state__id'] is None:
+        return None
+    started_at = row['processing_state__started_at']
+    return {
+        'status': row['processing_state__status'],
+        'progress': float(row['processing_state__progress']),
+        'started_at': started_at.strftime(VideoDocument.DATETIME_FORMAT) if started_at else None,
+    }
+
+def rebuild_video_documents(videos, create=True):
+    """
+    Rebuild the documents of the given videos.
+
+    Documents are rebuilt whenever a video or one of its related objects is
+    written: a backend that cannot build asset urls must not make these writes
+    fail. In case of error, the documents are marked as stale instead, and
+    their content is left untouched until they are read.
+
+    Args:
+        videos (QuerySet): Video objects
+        create (bool): create missing documents. Documents are not created
+        when a related object is deleted: the video might be being deleted,
+        too.
+    """
+    try:
+        documents = [(row, _document_fields(row, data)) for row, data in _serialize_video_rows(videos)]
+    except Exception:# pylint: disable=broad-except
+        logger.exception("Could not build video documents, which are marked as stale")
+        documents = [
+            (row, _document_fields(row, None))
+            for row in videos.select_related(None).prefetch_related(None).values(
+                'id', 'public_id', 'owner_id', 'processing_state__status'
+            )
+        ]
+    for row, fields in documents:
+        if create:
+            VideoDocument.objects.update_or_create(video_id=row['id'], defaults=fields)
+        else:
+            VideoDocument.objects.filter(video_id=row['id']).update(**fields)
+
+def _document_fields(row, data):
+    """
+    Args:
+        row (dict): values() row of a video
+        data (dict): API representation of the video, or None if it could not
+        be built.
+    """
+    fields = {
+        'public_id': row['public_id'],
+        'owner_id': row['owner_id'],
+        'processing_status': row['processing_state__status'] or '',
+        'stale': data is None,
+    }
+    if data is not None:
+        fields['content'] = json.dumps(data)
+    return fields
+
+def refresh_stale_video_documents(documents):
+    """
+    Rebuild the stale documents among the documents that are about to be read.
+    Contrary to writes, reads fail if the asset urls still cannot be built:
+    documents are never served without their urls.
+
+    Args:
+        documents (list of VideoDocument)
+
+    Returns:
+        documents (list of VideoDocument): the same documents, in the same
+        order, with the stale documents rebuilt.
+    """
+    stale_video_ids = [document.video_id for document in documents if document.stale]
+    if not stale_video_ids:
+        return documents
+    rebuilt_documents = {}
+    for row, data in _serialize_video_rows(Video.objects.filter(id__in=stale_video_ids)):
+        fields = _document_fields(row, data)
+        VideoDocument.objects.filter(video_id=row['id']).update(**fields)
+        rebuilt_documents[row['id']] = VideoDocument(video_id=row['id'], **fields)
+    return [rebuilt_documents.get(document.video_id, document) for document in documents]
+
+def update_video_document(public_video_id):
+    """
+    Rebuild the document of a video after its related objects were modified
+    without sending any post_save signal, e.g: with `QuerySet.update`.
+    """
+    rebuild_video_documents(Video.objects.filter(public_id=public_video_id))
+
+
+@receiver(post_save, sender=Video)
+def update_video_document_on_save(sender, instance=None, created=False, **kwargs):
     if instance:
-        invalidate_cache(instance.public_id)
+        rebuild_video_documents(Video.objects.filter(pk=instance.pk))
 
 @receiver([post_save, post_delete], sender=Subtitle)
 @receiver([post_save, post_delete], sender=ProcessingState)
 @receiver([post_save, post_delete], sender=VideoFormat)
-def invalidate_related_video_cache(sender, instance=None, created=False, **kwargs):
+@receiver([post_save, post_delete], sender=VideoMetadata)
+def update_related_video_document(sender, instance=None, signal=None, **kwargs):
     """
-    Invalidate the video cache whenever a related object is saved.
+    Rebuild the video document whenever a related object is saved or deleted.
+    Documents of deleted videos are deleted along with the videos.
     """
     if instance:
-        invalidate_cache(instance.video.public_id)
-
-def invalidate_cache(public_video_id):
-    cache.invalidate(public_video_id)
+        rebuild_video_documents(Video.objects.filter(pk=instance.video_id), create=signal is post_save)
@@ -1,86 +1,27 @@
+from contextlib import contextmanager
 import logging
 from tempfile import NamedTemporaryFile
-from time import sleep
+from time import time
 
 from celery import shared_task
-from django.db.transaction import TransactionManagementError
-from django.core.cache import cache
+from django.conf import settings
 import pycaption
 
 from videofront.celery_videofront import send_task
 from . import backend
+from . import events
 from . import exceptions
+from . import locks
 from . import models
+from . import transcoding_state
 from . import utils
 
 
 logger = logging.getLogger(__name__)
 
-
-class Lock(object):
-    """
-    Lock context manager.
-
-    Usage:
-
-        with Lock('mylockname', timeout=3600) as lock:
-            if lock.is_acquired:
-                run_not_thread_safe_code()
-    """
-
-    def __init__(self, name, timeout=60, wait=False):
-        """
-        Args:
-            name (str)
-            timeout (int): lock expiry duration, in seconds. Set to None if the
-            lock should not expire (not recommended).
-            wait (bool): if True, and if there is a concurrent call to this
-            function, it will block until completion of the concurrent task.
-            Note, however, that in this case the lock will *not* be acquired.
-        """
-        self.name = name
-        self.timeout = timeout
-        self.wait = wait
-        self.is_acquired = False
-
-    def __enter__(self):
-        try:
-            acquire_lock(self.name, expires_in=self.timeout)
-            self.is_acquired = True
-        except exceptions.LockUnavailable:
-            if self.wait:
-                while cache.get(self.name) is not None:
-                    sleep(0.1)
-        return self
-
-    def __exit__(self, exc_t, exc_v, trace):
-        if self.is_acquired:
-            release_lock(self.name)
-            self.is_acquired = False
-
-
-def acquire_lock(name, expires_in=None):
-    """
-    Acquire a database lock. Raises LockUnavailable when the lock is unavailable.
-    """
-    if cache.add(name, True, timeout=expires_in):
-        return True
-    raise exceptions.LockUnavailable(name)
-
-def release_lock(name):
-    """
-    Release a lock for all. Note that the lock will be released even if it was
-    never acquired.
-    """
-    # Note that in unit tests, and in case the wrapped code raises an
-    # IntegrityError, releasing the cache will result in a
-    # TransactionManagementError. This is because unit tests run inside atomic
-    # blocks. We cannot execute queries inside an atomic block if a transaction
-    # needs to be rollbacked.
-    try:
-        cache.delete(name)
-    except TransactionManagementError:
-        logger.error("Could not release lock %s", name)
+# The transcoding lock of a video is renewed every time the progress of its
+# transcoding jobs is checked.
+TRANSCODE_VIDEO_LOCK_TIMEOUT = 3600
 
 def upload_video(public_video_id, file_object):
     """
@@ -112,106 +53,399 @@ def upload_video(public_video_id, file_object):
 
 @shared_task(name='transcode_video_restart')
 def transcode_video_restart():
-    with Lock('TASK_LOCK_TRANSCODE_VIDEO_RESTART', 60) as lock:
-        if lock.is_acquired:
-            for processing_state in models.ProcessingState.objects.filter(status=models.ProcessingState.STATUS_RESTART):
-                send_task('transcode_video', args=(processing_state.video.public_id,), kwargs={'delete': False})
+    """
+    Start transcoding the videos that were marked for restart. Each video is
+    claimed for TRANSCODING_RESTART_CLAIM_DURATION seconds, such that it is not
+    sent twice to the workers: if its transcoding did not start in the meantime
+    (e.g: because it was still being transcoded), it is claimed again.
+    """
+    with locks.Lease('TASK_LOCK_TRANSCODE_VIDEO_RESTART', 60) as lease:
+        if lease.is_acquired:
+            public_video_ids = models.ProcessingState.objects.claim_restarts(
+                settings.TRANSCODING_RESTART_BATCH_SIZE,
+                settings.TRANSCODING_RESTART_CLAIM_DURATION
+            )
+            for public_video_id in public_video_ids:
+                send_task(
+                    'transcode_video',
+                    args=(public_video_id,),
+                    kwargs={'delete': False, 'resume': True}
+                )
+
+def _transcode_video_lease(public_video_id, token=None):
+    """
+    The transcoding lock of a video is held from the start of the transcoding
+    jobs until they are finalized. Its owner token is stored in the
+    transcoding state.
+    """
+    return locks.Lease(
+        'TASK_LOCK_TRANSCODE_VIDEO:' + public_video_id,
+        timeout=TRANSCODE_VIDEO_LOCK_TIMEOUT,
+        token=token
+    )
 
 @shared_task(name='transcode_video')
-def transcode_video(public_video_id, delete=True):
+def transcode_video(public_video_id, delete=True, resume=False):
     """
+    Start transcoding a video. Transcoding is performed by a chain of
+    non-blocking tasks: this task starts the transcoding jobs, then
+    `transcode_video_check` monitors them and `transcode_video_finalize`
+    creates the thumbnail, poster frames and video formats. Workers never wait
+    for the transcoding jobs to complete.
+
     Args:
         public_video_id (str)
         delete (bool): delete video on failure
+        resume (bool): skip the transcoding steps that were successful during
+        the previous transcoding attempt.
     """
-    with Lock('TASK_LOCK_TRANSCODE_VIDEO:' + public_video_id, 3600) as lock:
-        if lock.is_acquired:
-            try:
-                models.invalidate_cache(public_video_id)
-                _transcode_video(public_video_id, delete=delete)
-            except Exception as e:
-                # Store error message
-                message = "\n".join([str(arg) for arg in e.args])
-                models.ProcessingState.objects.filter(
-                    video__public_id=public_video_id
-                ).update(
-                    status=models.ProcessingState.STATUS_FAILED,
-                    message=message,
-                )
-                raise
-            finally:
-                models.invalidate_cache(public_video_id)
+    lease = _transcode_video_lease(public_video_id)
+    try:
+        lease.acquire()
+    except exceptions.LockUnavailable:
+        # Video is already being transcoded
+        return
+
+    with _transcoding_step(public_video_id, lease):
+        processing_state = models.ProcessingState.objects.select_related('video').get(
+            video__public_id=public_video_id
+        )
+        processing_state.set_pending()
+
+        # Probe source video once and for all, on the workers rather than in
+        # the upload request
+        if not models.VideoMetadata.objects.filter(video_id=processing_state.video_id).exists():
+            models.VideoMetadata.objects.probe_source(processing_state.video)
+
+        video_transcoding_jobs = models.TranscodingJob.objects.filter(video__public_id=public_video_id)
+        if not resume:
+            video_transcoding_jobs.delete()
+
+        # Restart only the formats that were not successfully transcoded
+        skip_formats = _get_transcoded_formats(public_video_id)
+        if skip_formats:
+            jobs = list(backend.get().start_transcoding(public_video_id, skip_formats=skip_formats))
+        else:
+            jobs = list(backend.get().start_transcoding(public_video_id))
+        job_formats = [list(backend.get().get_job_formats(job)) for job in jobs]
+        video_transcoding_jobs.filter(
+            kind=models.TranscodingJob.KIND_FORMAT
+        ).exclude(name__in=skip_formats).delete()
+        models.TranscodingJob.objects.bulk_create([
+            models.TranscodingJob(
+                video_id=processing_state.video_id,
+                kind=models.TranscodingJob.KIND_FORMAT,
+                name=format_name
+            )
+            for format_names in job_formats for format_name in format_names
+        ])
+
+        transcoding_state.set(public_video_id, {
+            'jobs': jobs,
+            'job_formats': job_formats,
+            'delete': delete,
+            'progress': [0] * len(jobs),
+            'finished': [False] * len(jobs),
+            'progressed_at': time(),
+            'errors': [],
+            'poll_interval': settings.TRANSCODING_POLL_MIN_INTERVAL,
+            'event_count': events.count(public_video_id),
+            'check_id': None,
+            'finalizing': False,
+            'lock_token': lease.token,
+        })
+
+    send_task('transcode_video_check', args=(public_video_id,))
+
+@shared_task(name='transcode_video_check')
+def transcode_video_check(public_video_id, check_id=None):
+    """
+    Check the progress of the transcoding jobs of a video once. If some jobs
+    are not finished, another check is scheduled with a period that doubles
+    after every check, up to TRANSCODING_POLL_MAX_INTERVAL. The period is
+    reset whenever the backend publishes an event. Jobs that did not progress
+    for TRANSCODING_STALLED_TIMEOUT seconds, e.g: because their worker was
+    killed, are considered as failed. Once all jobs are finished, finalization
+    is claimed by the check that observed it, such that
+    `transcode_video_finalize` is sent only once.
+
+    Args:
+        public_video_id (str)
+        check_id (str): identifier of the scheduled check. Scheduled checks
+        that were superseded by a more recent check do nothing. Checks that are
+        triggered by the backend (see `BaseBackend.notify_progress`) have no
+        identifier.
+    """
+    with locks.Lease('TASK_LOCK_TRANSCODE_VIDEO_CHECK:' + public_video_id, 60) as check_lease:
+        if not check_lease.is_acquired:
+            # A concurrent check will schedule the next check
+            return
+        state = transcoding_state.get(public_video_id)
+        if state is None:
+            # Video is not being transcoded
+            return
+        if check_id is not None and check_id != state['check_id']:
+            return
+        if state.get('finalizing'):
+            # Jobs are finished: this is a late check, e.g: triggered by
+            # simultaneous backend notifications.
+            return
+        # The transcoding lock is held until all jobs are finished
+        lease = _transcode_video_lease(public_video_id, state['lock_token'])
+        if not lease.renew():
+            logger.error("Transcoding lock of video %s was acquired by another task", public_video_id)
+            return
+        with _transcoding_step(public_video_id, lease):
+            _check_transcoding_progress(public_video_id, state)
+
+    if state['finalizing']:
+        send_task('transcode_video_finalize', args=(public_video_id,))
+    else:
+        send_task(
+            'transcode_video_check',
+            args=(public_video_id, state['check_id']),
+            countdown=state['countdown'],
+        )
 
-def _transcode_video(public_video_id, delete=True):
+def _check_transcoding_progress(public_video_id, state):
     """
-    This function is not thread-safe. It should only be called by the transcode_video task.
+    Update the transcoding state and the processing state of a video with the
+    progress of its transcoding jobs.
     """
-    video = models.Video.objects.get(public_id=public_video_id)
-    processing_state = video.processing_state
-    processing_state.set_pending()
+    job_indexes = [job_index for job_index, finished in enumerate(state['finished']) if not finished]
+    previous_progress = list(state['progress'])
+    results = backend.get().check_progress_many([state['jobs'][job_index] for job_index in job_indexes])
+    for job_index, result in zip(job_indexes, results):
+        if isinstance(result, exceptions.TranscodingFailed):
+            _fail_job(public_video_id, state, job_index, result.args[0] if result.args else "")
+        else:
+            state['progress'][job_index], state['finished'][job_index] = result
+            if state['finished'][job_index]:
+                _save_job_formats_success(public_video_id, state['job_formats'][job_index])
+
+    # Jobs that are lost, e.g: because their worker was killed, would
+    # otherwise hold the transcoding lock forever
+    if state['progress'] != previous_progress or any(state['finished'][job_index] for job_index in job_indexes):
+        state['progressed_at'] = time()
+    elif time() - state['progressed_at'] > settings.TRANSCODING_STALLED_TIMEOUT:
+        for job_index in job_indexes:
+            _fail_job(
+                public_video_id, state, job_index,
+                "Transcoding job stalled: no progress for {} seconds".format(settings.TRANSCODING_STALLED_TIMEOUT)
+            )
+
+    # Note that we do not delete original assets once transcoding has
+    # ended. This is because we want to keep the possibility of restarting
+    # the transcoding process.
+    if state['jobs']:
+        progress = sum(state['progress']) * 1. / len(state['jobs'])
+        _save_progress(public_video_id, state, progress, force=all(state['finished']))
+
+    # Poll right away after an event, and with an increasing period otherwise
+    event_count = events.count(public_video_id)
+    if event_count != state['event_count']:
+        state['event_count'] = event_count
+        state['poll_interval'] = settings.TRANSCODING_POLL_MIN_INTERVAL
+    state['countdown'] = state['poll_interval']
+    state['poll_interval'] = min(2 * state['poll_interval'], settings.TRANSCODING_POLL_MAX_INTERVAL)
+    state['check_id'] = utils.generate_random_id()
+    state['finalizing'] = all(state['finished'])
+    transcoding_state.set(public_video_id, state)
+
+def _fail_job(public_video_id, state, job_index, error_message):
+    state['finished'][job_index] = True
+    state['errors'].append(error_message)
+    models.TranscodingJob.objects.filter(
+        video__public_id=public_video_id,
+        kind=models.TranscodingJob.KIND_FORMAT,
+        name__in=state['job_formats'][job_index],
+    ).update(status=models.TranscodingJob.STATUS_FAILED)
+
+def _get_transcoded_formats(public_video_id):
+    """
+    Names of the formats that were successfully transcoded, and whose files have
+    not changed since.
+    """
+    format_names = []
+    for transcoding_job in models.TranscodingJob.objects.filter(
+            video__public_id=public_video_id,
+            kind=models.TranscodingJob.KIND_FORMAT,
+            status=models.TranscodingJob.STATUS_SUCCESS
+    ):
+        checksum = backend.get().get_format_checksum(public_video_id, transcoding_job.name)
+        if checksum is not None and checksum == transcoding_job.checksum:
+            format_names.append(transcoding_job.name)
+    return format_names
+
+def _save_job_formats_success(public_video_id, format_names):
+    """
+    Store the checksums of the formats that were produced by a successful
+    transcoding job.
+    """
+    for format_name in format_names:
+        models.TranscodingJob.objects.filter(
+            video__public_id=public_video_id,
+            kind=models.TranscodingJob.KIND_FORMAT,
+            name=format_name,
+        ).update(
+            status=models.TranscodingJob.STATUS_SUCCESS,
+            checksum=backend.get().get_format_checksum(public_video_id, format_name) or '',
+        )
+
+def _save_progress(public_video_id, state, progress, force=False):
+    """
+    Save the processing progress of a video, unless it was saved recently. The
+    progress is saved the first time, and then whenever it has changed by at
+    least TRANSCODING_PROGRESS_MIN_DELTA or was last saved more than
+    TRANSCODING_PROGRESS_MIN_INTERVAL seconds ago. This bounds the rate of
+    database writes, whatever the number of videos being transcoded.
 
-    # Start transcoding
-    jobs = backend.get().start_transcoding(public_video_id)# TODO what if this raises an error?
-
-    # Monitor transcoding progress
-    success_job_indexes = []
-    error_job_indexes = []
-    errors = []
-    jobs_progress = [0] * len(jobs)
-    while len(success_job_indexes) + len(error_job_indexes) < len(jobs):
-        for job_index, job in enumerate(jobs):
-            if job_index not in success_job_indexes and job_index not in error_job_indexes:
-                try:
-                    jobs_progress[job_index], finished = backend.get().check_progress(job)
-                    if finished:
-                        success_job_indexes.append(job_index)
-                except exceptions.TranscodingFailed as e:
-                    error_job_indexes.append(job_index)
-                    error_message = e.args[0] if e.args else ""
-                    errors.append(error_message)
-
-        # Note that we do not delete original assets once transcoding has
-        # ended. This is because we want to keep the possibility of restarting
-        # the transcoding process.
-        processing_state.set_processing(sum(jobs_progress) * 1. / len(jobs))
-
-    # Create thumbnail
-    if not errors:
-        try:
-            backend.get().create_thumbnail(public_video_id, video.public_thumbnail_id)
-        except Exception as e:# pylint: disable=broad-except
-            error_message = "thumbnail creation: " + "\n".join(e.args)
-            errors.append(error_message)
+    Args:
+        state (dict): transcoding state, which stores the last saved progress
+        force (bool): save the progress if it has changed, whatever the delta
+        and the interval.
+    """
+    saved_progress = state.get('saved_progress')
+    if saved_progress is not None:
+        if progress == saved_progress:
+            return
+        if not force and \
+                abs(progress - saved_progress) < settings.TRANSCODING_PROGRESS_MIN_DELTA and \
+                time() - state['progress_saved_at'] < settings.TRANSCODING_PROGRESS_MIN_INTERVAL:
+            return
+    if models.ProcessingState.objects.update_progress(public_video_id, progress):
+        models.update_video_document(public_video_id)
+    state['saved_progress'] = progress
+    state['progress_saved_at'] = time()
+
+@shared_task(name='transcode_video_finalize')
+def transcode_video_finalize(public_video_id):
+    """
+    Create thumbnail, poster frames and video formats once all transcoding jobs
+    of a video are finished, then release the transcoding lock.
+    """
+    state = transcoding_state.get(public_video_id)
+    if state is None:
+        return
+    lease = _transcode_video_lease(public_video_id, state['lock_token'])
+    if not lease.renew():
+        logger.error("Transcoding lock of video %s was acquired by another task", public_video_id)
+        return
+    with _transcoding_step(public_video_id, lease):
+        # Creating thumbnails and poster frames may take a while
+        with lease.heartbeat():
+            _finalize_transcoding(public_video_id, state['errors'], delete=state['delete'])
+    transcoding_state.delete(public_video_id)
+    lease.release()
+
+def _finalize_transcoding(public_video_id, errors, delete=True):
+    # If the video was deleted while the file was transcoding, wipe all data
+    video = models.Video.objects.filter(public_id=public_video_id).first()
+    if video is None:
+        delete_video(public_video_id)
+        return
+    backend.get().clean_transcoding(public_video_id)
 
-    # Create poster frames
+    # Create thumbnail and poster frames, unless they were already created
+    # during a previous transcoding attempt
     if not errors:
-        try:
-            backend.get().create_poster_frames(public_video_id, video.public_poster_frames_id)
-        except Exception as e:# pylint: disable=broad-except
-            error_message = "poster frame creation: " + "\n".join(e.args)
-            errors.append(error_message)
-
-    # Delete related formats (to be re-created)
-    models.VideoFormat.objects.filter(video=video).delete()
+        error = _create_artifact(
+            video, models.TranscodingJob.KIND_THUMBNAIL, 'create_thumbnail', video.public_thumbnail_id
+        )
+        if error:
+            errors.append("thumbnail creation: " + error)
+    if not errors:
+        error = _create_artifact(
+            video, models.TranscodingJob.KIND_POSTER_FRAMES, 'create_poster_frames', video.public_poster_frames_id
+        )
+        if error:
+            errors.append("poster frame creation: " + error)
 
     # Check status
+    processing_state = video.processing_state
     processing_state.set_errors(errors)
     if errors:
+        # Delete related formats (to be re-created)
+        models.VideoFormat.objects.filter(video=video).delete()
         if delete:
             # In case of errors, wipe all data
             delete_video(public_video_id)
     else:
         # Create video formats first so that they are available as soon as the
         # video object becomes available from the API
-        for format_name, bitrate in backend.get().iter_formats(public_video_id):
-            models.VideoFormat.objects.create(video=video, name=format_name, bitrate=bitrate)
-
+        _update_video_formats(video)
         processing_state.set_success()
 
-    # If the video was deleted while the file was transcoding, wipe all data
+    # If the video was deleted while the formats were being created, wipe all data
     if not models.Video.objects.filter(public_id=public_video_id).exists():
         delete_video(public_video_id)
-        processing_state.delete()
+
+def _create_artifact(video, kind, method_name, artifact_id):
+    """
+    Create the thumbnail or the poster frames of a video, unless they were
+    already created.
+
+    Args:
+        method_name (str): name of the backend method that creates the
+        artifact. Backends that do not implement it fail to create it.
+
+    Returns:
+        error (str): error message, or None in case of success.
+    """
+    transcoding_job, _created = models.TranscodingJob.objects.get_or_create(video=video, kind=kind)
+    if transcoding_job.status == models.TranscodingJob.STATUS_SUCCESS:
+        return None
+    try:
+        getattr(backend.get(), method_name)(video.public_id, artifact_id)
+    except Exception as e:# pylint: disable=broad-except
+        transcoding_job.status = models.TranscodingJob.STATUS_FAILED
+        transcoding_job.save()
+        return "\n".join(e.args)
+    transcoding_job.status = models.TranscodingJob.STATUS_SUCCESS
+    transcoding_job.save()
+    return None
+
+def _update_video_formats(video):
+    """
+    Synchronize the video formats with the formats that are available from the
+    backend. Unchanged formats are left untouched.
+    """
+    existing_formats = {video_format.name: video_format for video_format in video.formats.all()}
+    format_names = []
+    for format_name, bitrate in backend.get().iter_formats(video.public_id):
+        format_names.append(format_name)
+        video_format = existing_formats.get(format_name)
+        if video_format is None:
+            models.VideoFormat.objects.create(video=video, name=format_name, bitrate=bitrate)
+        elif video_format.bitrate != bitrate:
+            video_format.bitrate = bitrate
+            video_format.save()
+    models.VideoFormat.objects.filter(video=video).exclude(name__in=format_names).delete()
+
+@contextmanager
+def _transcoding_step(public_video_id, lease):
+    """
+    Context manager that wraps each transcoding task. Unexpected errors are
+    stored in the processing state and interrupt the transcoding process: the
+    transcoding lock `lease` is then released. The video document is updated in
+    all cases.
+    """
+    try:
+        yield
+    except Exception as e:
+        # Store error message
+        message = "\n".join([str(arg) for arg in e.args])
+        models.ProcessingState.objects.filter(
+            video__public_id=public_video_id
+        ).update(
+            status=models.ProcessingState.STATUS_FAILED,
+            message=message,
+        )
+        transcoding_state.delete(public_video_id)
+        lease.release()
+        raise
+    finally:
+        models.update_video_document(public_video_id)
 
 def upload_subtitle(public_video_id, subtitle_public_id, language_code, content):
     """
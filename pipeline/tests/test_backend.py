@@ -1,5 +1,9 @@
+import threading
+from time import sleep
+
 from django.test import TestCase
 from django.test.utils import override_settings
+from mock import Mock
 
 from pipeline import backend
 
@@ -24,3 +28,50 @@ class PipelineBackendTests(TestCase):
 
         self.assertIsNotNone(dummy)
         self.assertEqual(42, dummy)
+
+    def test_backend_is_cached(self):
+        plugin_backend = Mock(return_value=Mock())
+        with override_settings(PLUGIN_BACKEND=plugin_backend):
+            backend1 = backend.get()
+            backend2 = backend.get()
+
+        self.assertIs(backend1, backend2)
+        plugin_backend.assert_called_once_with()
+
+    def test_reset_backend(self):
+        plugin_backend = Mock(side_effect=lambda: Mock())
+        with override_settings(PLUGIN_BACKEND=plugin_backend):
+            backend1 = backend.get()
+            backend.reset()
+            backend2 = backend.get()
+
+        self.assertIsNot(backend1, backend2)
+
+    def test_backend_is_reset_on_settings_change(self):
+        plugin_backend = Mock(side_effect=lambda: Mock())
+        with override_settings(PLUGIN_BACKEND=plugin_backend):
+            backend1 = backend.get()
+            with override_settings(AWS_REGION='someregion'):
+                backend2 = backend.get()
+
+        self.assertIsNot(backend1, backend2)
+        self.assertEqual(2, plugin_backend.call_count)
+
+    def test_backend_is_instantiated_once_by_concurrent_threads(self):
+        def create_backend():
+            # Give other threads a chance to run while the backend is created
+            sleep(0.1)
+            return Mock()
+        plugin_backend = Mock(side_effect=create_backend)
+        backends = []
+
+        with override_settings(PLUGIN_BACKEND=plugin_backend):
+            threads = [threading.Thread(target=lambda: backends.append(backend.get())) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(1, plugin_backend.call_count)
+        self.assertEqual(4, len(backends))
+        self.assertTrue(all([b is backends[0] for b in backends]))
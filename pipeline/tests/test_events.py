@@ -0,0 +1,15 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from pipeline import events
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EventsTests(TestCase):
+
+    def test_publish(self):
+        count = events.count('videoid')
+        events.publish('videoid')
+
+        self.assertNotEqual(count, events.count('videoid'))
+        self.assertEqual(0, events.count('othervideoid'))
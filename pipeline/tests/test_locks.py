@@ -0,0 +1,146 @@
+from time import sleep
+
+from django.db.utils import IntegrityError
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from pipeline import exceptions
+from pipeline import locks
+from pipeline import models
+
+
+class LeaseTests(TransactionTestCase):
+    """
+    Tests in this test case will not be wrapped inside an atomic transaction. Do not create data in this test case.
+    """
+
+    def setUp(self):
+        locks.get_backend().delete('dummylock')
+
+    def tearDown(self):
+        locks.get_backend().delete('dummylock')
+
+    def test_acquire_release_lease_cycle(self):
+        lease = locks.Lease('dummylock')
+        self.assertTrue(lease.acquire())
+        self.assertRaises(exceptions.LockUnavailable, locks.Lease('dummylock').acquire)
+        lease.release()
+        self.assertTrue(locks.Lease('dummylock').acquire())
+
+    def test_release_lease_with_integrity_error(self):
+        def failing_task():
+            lease = locks.Lease('dummylock', 3600)
+            lease.acquire()
+
+            try:
+                models.Video.objects.create(public_id="id")
+                models.Video.objects.create(public_id="id")
+            finally:
+                lease.release()
+
+        self.assertRaises(IntegrityError, failing_task)
+        self.assertTrue(locks.Lease('dummylock').acquire())
+
+    def test_context_manager(self):
+
+        # 1) Lock is available
+        with locks.Lease('dummylock') as lease:
+            self.assertTrue(lease.is_acquired)
+            self.assertRaises(exceptions.LockUnavailable, locks.Lease('dummylock').acquire)
+
+        self.assertFalse(lease.is_acquired)
+
+        # 2) Lock is unavailable
+        locks.Lease('dummylock').acquire()
+        with locks.Lease('dummylock') as lease:
+            self.assertFalse(lease.is_acquired)
+
+        self.assertRaises(exceptions.LockUnavailable, locks.Lease('dummylock').acquire)
+
+    def test_only_owner_releases_lease(self):
+        owner = locks.Lease('dummylock')
+        owner.acquire()
+        intruder = locks.Lease('dummylock')
+
+        intruder.release()
+        self.assertRaises(exceptions.LockUnavailable, locks.Lease('dummylock').acquire)
+        owner.release()
+        self.assertTrue(locks.Lease('dummylock').acquire())
+
+    def test_renew(self):
+        owner = locks.Lease('dummylock')
+        owner.acquire()
+
+        # Lease is renewed by its owner, or by processes that know its token
+        self.assertTrue(owner.renew())
+        self.assertTrue(locks.Lease('dummylock', token=owner.token).renew())
+        self.assertFalse(locks.Lease('dummylock').renew())
+
+        # Expired lease is acquired again
+        locks.get_backend().delete('dummylock')
+        self.assertTrue(owner.renew())
+        self.assertRaises(exceptions.LockUnavailable, locks.Lease('dummylock').acquire)
+
+    @patch('pipeline.locks.sleep')
+    def test_wait_with_backoff(self, mock_sleep):
+        locks.Lease('dummylock').acquire()
+
+        self.assertRaises(
+            exceptions.LockUnavailable,
+            locks.Lease('dummylock').acquire, wait=True, wait_timeout=1
+        )
+
+        delays = [call[0][0] for call in mock_sleep.call_args_list]
+        self.assertLess(0, len(delays))
+        self.assertLess(len(delays), 10)
+        self.assertLess(delays[0], delays[-1])
+
+    @patch('pipeline.locks.sleep')
+    def test_wait_until_released(self, mock_sleep):
+        owner = locks.Lease('dummylock')
+        owner.acquire()
+        mock_sleep.side_effect = lambda delay: owner.release()
+
+        with locks.Lease('dummylock', wait=True) as lease:
+            self.assertTrue(lease.is_acquired)
+        mock_sleep.assert_called_once()
+
+
+class LockBackendTests(TestCase):
+
+    @override_settings(LOCK_BACKEND='pipeline.tests.test_locks.MemoryLockBackend')
+    def test_lock_backend_setting(self):
+        MemoryLockBackend.leases.clear()
+        with locks.Lease('dummylock') as lease:
+            self.assertEqual(lease.token, MemoryLockBackend.leases['dummylock'])
+        self.assertEqual({}, MemoryLockBackend.leases)
+
+    @override_settings(LOCK_BACKEND='pipeline.tests.test_locks.MemoryLockBackend')
+    def test_heartbeat(self):
+        MemoryLockBackend.leases.clear()
+        lease = locks.Lease('dummylock', timeout=0.03)
+        lease.acquire()
+
+        with patch.object(MemoryLockBackend, 'renew', autospec=True, return_value=True) as mock_renew:
+            with lease.heartbeat():
+                sleep(0.1)
+
+        self.assertLess(0, mock_renew.call_count)
+        self.assertTrue(lease.is_acquired)
+
+
+class MemoryLockBackend(locks.BaseLockBackend):
+    leases = {}
+
+    def add(self, name, token, timeout):
+        return self.leases.setdefault(name, token) == token
+
+    def get(self, name):
+        return self.leases.get(name)
+
+    def set(self, name, token, timeout):
+        self.leases[name] = token
+
+    def delete(self, name):
+        self.leases.pop(name, None)
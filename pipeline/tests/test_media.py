@@ -0,0 +1,38 @@
+from django.test import TestCase
+
+from pipeline import media
+
+
+MEDIA_INFO = {
+    'format': {'duration': '60.0'},
+    'streams': [
+        {'codec_type': 'audio', 'codec_name': 'aac'},
+        {'codec_type': 'video', 'codec_name': 'h264', 'width': 1280, 'height': 720},
+    ],
+}
+
+
+class MediaTests(TestCase):
+
+    def test_probe_missing_file(self):
+        self.assertIsNone(media.probe('/tmp/this/file/does/not/exist.mp4'))
+
+    def test_get_stream(self):
+        self.assertEqual('h264', media.get_stream(MEDIA_INFO, 'video')['codec_name'])
+        self.assertEqual('aac', media.get_stream(MEDIA_INFO, 'audio')['codec_name'])
+        self.assertIsNone(media.get_stream(MEDIA_INFO, 'subtitle'))
+        self.assertIsNone(media.get_stream(None, 'video'))
+
+    def test_get_duration(self):
+        self.assertEqual(60, media.get_duration(MEDIA_INFO))
+        self.assertIsNone(media.get_duration({'format': {'duration': 'N/A'}}))
+        self.assertIsNone(media.get_duration(None))
+
+    def test_get_video_size(self):
+        self.assertEqual((1280, 720), media.get_video_size(MEDIA_INFO))
+        self.assertIsNone(media.get_video_size({'streams': [{'codec_type': 'video'}]}))
+        self.assertIsNone(media.get_video_size(None))
+
+    def test_parse_frame_rate(self):
+        self.assertEqual(25, media.parse_frame_rate('25/1'))
+        self.assertAlmostEqual(29.97, media.parse_frame_rate('30000/1001'), places=2)
@@ -1,9 +1,14 @@
+from datetime import timedelta
 from time import time
 
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+from mock import Mock
 
 from pipeline import models
 from pipeline.tests import factories
+from pipeline.tests.utils import mock_plugin_backend, override_plugin_backend
 
 
 class VideoUploadUrlTests(TestCase):
@@ -33,3 +38,161 @@ class VideoUploadUrlTests(TestCase):
         self.assertIn('almost_expired', available_video_ids)
         self.assertNotIn('used', available_video_ids)
         self.assertNotIn('expired', available_video_ids)
+
+
+class ProcessingStateTests(TestCase):
+
+    def test_update_progress(self):
+        factories.VideoFactory(public_id='videoid')
+
+        with self.assertNumQueries(1):
+            updated = models.ProcessingState.objects.update_progress('videoid', 42)
+
+        self.assertEqual(1, updated)
+        processing_state = models.ProcessingState.objects.get()
+        self.assertEqual(models.ProcessingState.STATUS_PROCESSING, processing_state.status)
+        self.assertEqual(42, processing_state.progress)
+        self.assertEqual(0, models.ProcessingState.objects.update_progress('deletedvideoid', 42))
+
+    def test_claim_restarts(self):
+        for public_id in ['video1', 'video2', 'video3', 'notrestarted']:
+            factories.VideoFactory(public_id=public_id)
+        models.ProcessingState.objects.exclude(video__public_id='notrestarted').update(
+            status=models.ProcessingState.STATUS_RESTART
+        )
+
+        self.assertEqual(['video1', 'video2'], models.ProcessingState.objects.claim_restarts(2, 600))
+        # Claimed videos are not returned again
+        self.assertEqual(['video3'], models.ProcessingState.objects.claim_restarts(2, 600))
+        self.assertEqual([], models.ProcessingState.objects.claim_restarts(2, 600))
+
+        # Expired claims are claimed again
+        models.ProcessingState.objects.filter(video__public_id='video1').update(
+            restart_claimed_until=now() - timedelta(seconds=1)
+        )
+        self.assertEqual(['video1'], models.ProcessingState.objects.claim_restarts(2, 600))
+
+    def test_set_pending_releases_restart_claim(self):
+        factories.VideoFactory(public_id='videoid')
+        models.ProcessingState.objects.update(status=models.ProcessingState.STATUS_RESTART)
+        models.ProcessingState.objects.claim_restarts(1, 600)
+
+        models.ProcessingState.objects.get().set_pending()
+        models.ProcessingState.objects.update(status=models.ProcessingState.STATUS_RESTART)
+
+        self.assertEqual(['videoid'], models.ProcessingState.objects.claim_restarts(1, 600))
+
+
+class VideoMetadataTests(TestCase):
+
+    def test_probe_source_failure(self):
+        video = factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(probe_source=Mock(return_value=None))
+
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            metadata = models.VideoMetadata.objects.probe_source(video)
+
+        self.assertIsNone(metadata.duration)
+        self.assertIsNone(metadata.media_info)
+        self.assertIsNone(models.VideoMetadata.objects.get_media_info('videoid'))
+        self.assertIsNone(models.VideoMetadata.objects.get_media_info('unknownvideoid'))
+        self.assertIsNone(models.Video.objects.get().duration)
+
+
+@override_plugin_backend(
+    video_url=lambda video_id, format_name: "http://example.com/{}/{}.mp4".format(video_id, format_name),
+    subtitle_url=lambda video_id, subtitle_id, language: "http://example.com/{}/{}.vtt".format(video_id, subtitle_id),
+)
+class VideoDocumentTests(TestCase):
+
+    def get_data(self, public_video_id):
+        return models.VideoDocument.objects.get(public_id=public_video_id).data
+
+    def test_document_is_created_with_video(self):
+        video = factories.VideoFactory(public_id='videoid', title='sometitle')
+
+        document = models.VideoDocument.objects.get()
+        self.assertEqual(video.id, document.video_id)
+        self.assertEqual(video.owner, document.owner)
+        self.assertEqual('videoid', document.public_id)
+        self.assertEqual(models.ProcessingState.STATUS_PENDING, document.processing_status)
+        self.assertEqual('videoid', document.data['id'])
+        self.assertEqual('sometitle', document.data['title'])
+        self.assertEqual(models.ProcessingState.STATUS_PENDING, document.data['processing']['status'])
+
+    def test_document_is_updated_with_video(self):
+        video = factories.VideoFactory(public_id='videoid', title='sometitle')
+        video.title = 'othertitle'
+        video.save()
+
+        self.assertEqual('othertitle', self.get_data('videoid')['title'])
+
+    def test_document_is_updated_with_related_objects(self):
+        video = factories.VideoFactory(public_id='videoid')
+        subtitle = video.subtitles.create(public_id='subid', language='fr')
+        video.formats.create(name='SD', bitrate=128)
+        models.VideoMetadata.objects.create(video=video, duration=42.5)
+        processing_state = models.ProcessingState.objects.get(video=video)
+        processing_state.status = models.ProcessingState.STATUS_SUCCESS
+        processing_state.save()
+
+        data = self.get_data('videoid')
+        self.assertEqual([{'id': 'subid', 'language': 'fr', 'url': 'http://example.com/videoid/subid.vtt'}],
+                         data['subtitles'])
+        self.assertEqual([{'name': 'SD', 'url': 'http://example.com/videoid/SD.mp4', 'bitrate': 128}],
+                         data['formats'])
+        self.assertEqual(42.5, data['duration'])
+        self.assertEqual(models.ProcessingState.STATUS_SUCCESS, data['processing']['status'])
+        self.assertEqual(
+            models.ProcessingState.STATUS_SUCCESS,
+            models.VideoDocument.objects.get().processing_status
+        )
+
+        subtitle.delete()
+        self.assertEqual([], self.get_data('videoid')['subtitles'])
+
+    def test_document_is_stale_when_urls_cannot_be_built(self):
+        video = factories.VideoFactory(public_id='videoid')
+        # The default backend cannot build video urls
+        with override_plugin_backend():
+            video.formats.create(name='SD', bitrate=128)
+
+        document = models.VideoDocument.objects.get()
+        self.assertTrue(document.stale)
+        self.assertEqual([], document.data['formats'])
+
+        # Urls still cannot be built
+        with override_plugin_backend():
+            self.assertRaises(NotImplementedError, models.refresh_stale_video_documents, [document])
+
+        document = models.refresh_stale_video_documents([document])[0]
+        self.assertFalse(document.stale)
+        self.assertEqual([{'name': 'SD', 'url': 'http://example.com/videoid/SD.mp4', 'bitrate': 128}],
+                         document.data['formats'])
+        self.assertFalse(models.VideoDocument.objects.get().stale)
+        self.assertEqual(document.data, self.get_data('videoid'))
+
+    def test_document_is_created_stale_when_urls_cannot_be_built(self):
+        with override_plugin_backend(thumbnail_url=Mock(side_effect=ValueError)):
+            factories.VideoFactory(public_id='videoid')
+
+        document = models.VideoDocument.objects.get()
+        self.assertTrue(document.stale)
+        self.assertEqual('videoid', document.public_id)
+        self.assertEqual('videoid', models.refresh_stale_video_documents([document])[0].data['id'])
+
+    def test_update_video_document(self):
+        factories.VideoFactory(public_id='videoid')
+        models.ProcessingState.objects.update_progress('videoid', 42)
+        self.assertEqual(0, self.get_data('videoid')['processing']['progress'])
+
+        models.update_video_document('videoid')
+        self.assertEqual(42, self.get_data('videoid')['processing']['progress'])
+
+    def test_document_is_deleted_with_video(self):
+        video = factories.VideoFactory(public_id='videoid')
+        video.subtitles.create(language='fr')
+        video.formats.create(name='SD', bitrate=128)
+        video.delete()
+
+        self.assertEqual(0, models.VideoDocument.objects.count())
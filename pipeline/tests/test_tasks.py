@@ -1,74 +1,34 @@
 import os
 from time import time
-from mock import Mock
+from mock import Mock, patch
 
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db.utils import IntegrityError
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase
 from django.test.utils import override_settings
 
 from pipeline import exceptions
+from pipeline.backend import BaseBackend
+from pipeline.managers import ProcessingStateManager
 from pipeline import models
 from pipeline import tasks
 from pipeline.tests import factories
+from pipeline.tests.utils import mock_plugin_backend, override_plugin_backend
 from videofront.celery_videofront import send_task
 
 
-class LockTests(TransactionTestCase):
-    """
-    Tests in this test case will not be wrapped inside an atomic transaction. Do not create data in this test case.
-    """
-
-    def setUp(self):
-        tasks.release_lock('dummylock')
-
-    def tearDown(self):
-        tasks.release_lock('dummylock')
-
-    def test_acquire_release_lock_cycle(self):
-        self.assertTrue(tasks.acquire_lock("dummylock"))
-        self.assertRaises(exceptions.LockUnavailable, tasks.acquire_lock, "dummylock")
-        tasks.release_lock('dummylock')
-        self.assertTrue(tasks.acquire_lock("dummylock"))
-
-    def test_release_lock_with_integrity_error(self):
-        def failing_task():
-            tasks.acquire_lock('dummylock', 3600)
-
-            try:
-                models.Video.objects.create(public_id="id")
-                models.Video.objects.create(public_id="id")
-            finally:
-                tasks.release_lock('dummylock')
-
-        self.assertRaises(IntegrityError, failing_task)
-        self.assertTrue(tasks.acquire_lock("dummylock"))
-
-    def test_context_manager(self):
-
-        # 1) Lock is available
-        with tasks.Lock('dummylock') as lock:
-            self.assertTrue(lock.is_acquired)
-            self.assertRaises(exceptions.LockUnavailable, tasks.acquire_lock, "dummylock")
-
-        self.assertFalse(lock.is_acquired)
-
-        # 2) Lock is unavailable
-        tasks.acquire_lock("dummylock")
-        with tasks.Lock('dummylock') as lock:
-            self.assertFalse(lock.is_acquired)
-
-        self.assertRaises(exceptions.LockUnavailable, tasks.acquire_lock, "dummylock")
-
-
 class TasksTests(TestCase):
 
     def test_upload_video(self):
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             upload_video=Mock(),
+            probe_source=Mock(return_value={
+                'format': {'duration': '60.0', 'bit_rate': '2128000'},
+                'streams': [{'codec_type': 'video', 'codec_name': 'h264', 'width': 1280, 'height': 720}],
+            }),
             start_transcoding=Mock(return_value=[]),
             iter_formats=Mock(return_value=[]),
-        ))
+        )
         factories.VideoUploadUrlFactory(
             was_used=False,
             public_video_id='videoid',
@@ -86,11 +46,40 @@ class TasksTests(TestCase):
         self.assertEqual("Some video.mp4", video.title)
         self.assertLess(10, len(video.public_thumbnail_id))
         self.assertTrue(video_upload_url.was_used)
+        # Source video was probed once
+        mock_backend.return_value.probe_source.assert_called_once_with('videoid')
+        self.assertEqual(60, video.metadata.duration)
+        self.assertEqual((1280, 720), (video.metadata.width, video.metadata.height))
+
+    def test_source_is_probed_once_by_the_transcoding_task(self):
+        mock_backend = mock_plugin_backend(
+            upload_video=Mock(),
+            probe_source=Mock(return_value={'format': {'duration': '60.0'}, 'streams': []}),
+            start_transcoding=Mock(return_value=[]),
+            iter_formats=Mock(return_value=[]),
+        )
+        factories.VideoUploadUrlFactory(
+            was_used=False,
+            public_video_id='videoid',
+            expires_at=time() + 3600
+        )
+        file_object = Mock()
+        file_object.name = "Some video.mp4"
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            with patch('pipeline.tasks.send_task'):
+                tasks.upload_video('videoid', file_object)
+            # Source is not probed in the upload request
+            mock_backend.return_value.probe_source.assert_not_called()
+            tasks.transcode_video('videoid')
+            tasks.transcode_video('videoid', resume=True)
+
+        mock_backend.return_value.probe_source.assert_called_once_with('videoid')
+        self.assertEqual(60, models.VideoMetadata.objects.get().duration)
 
     def test_upload_url_invalidated_after_failed_upload(self):
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             upload_video=Mock(side_effect=ValueError),
-        ))
+        )
         factories.VideoUploadUrlFactory(
             was_used=False,
             public_video_id='videoid',
@@ -107,12 +96,13 @@ class TasksTests(TestCase):
 
     def test_transcode_video_success(self):
         factories.VideoFactory(public_id='videoid', public_thumbnail_id='thumbid')
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
             check_progress=Mock(return_value=(42, True)),
             iter_formats=Mock(return_value=[('SD', 128)]),
             create_thumbnail=Mock(),
-        ))
+        )
 
         with override_settings(PLUGIN_BACKEND=mock_backend):
             tasks.transcode_video('videoid')
@@ -124,12 +114,221 @@ class TasksTests(TestCase):
         self.assertEqual(42, video_processing_state.progress)
         mock_backend.return_value.create_thumbnail.assert_called_once_with('videoid', 'thumbid')
         mock_backend.return_value.check_progress.assert_called_once_with('job1')
+        mock_backend.return_value.clean_transcoding.assert_called_once_with('videoid')
         self.assertEqual(1, models.VideoFormat.objects.count())
         video_format = models.VideoFormat.objects.get()
         self.assertEqual('videoid', video_format.video.public_id)
         self.assertEqual('SD', video_format.name)
         self.assertEqual(128, video_format.bitrate)
 
+    def test_transcode_video_polling_backoff(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(side_effect=[(0, False), (0, False), (50, False), (100, True)]),
+            iter_formats=Mock(return_value=[]),
+        )
+
+        with override_settings(PLUGIN_BACKEND=mock_backend,
+                               TRANSCODING_POLL_MIN_INTERVAL=1,
+                               TRANSCODING_POLL_MAX_INTERVAL=3):
+            with patch('pipeline.tasks.send_task', side_effect=send_task) as mock_send_task:
+                with patch('pipeline.managers.ProcessingStateManager.update_progress', autospec=True,
+                           side_effect=ProcessingStateManager.update_progress) as mock_update_progress:
+                    tasks.transcode_video('videoid')
+
+        # No event was received: polling period increases up to the max
+        check_calls = [call for call in mock_send_task.call_args_list if call[0][0] == 'transcode_video_check']
+        self.assertEqual([None, 1, 2, 3], [call[1].get('countdown') for call in check_calls])
+        self.assertEqual(
+            ['transcode_video_finalize'],
+            [call[0][0] for call in mock_send_task.call_args_list if call[0][0] != 'transcode_video_check']
+        )
+        # Processing state is saved only when progress changes
+        self.assertEqual(
+            [0, 50, 100],
+            [call[0][2] for call in mock_update_progress.call_args_list]
+        )
+        self.assertEqual(
+            models.ProcessingState.STATUS_SUCCESS,
+            models.ProcessingState.objects.get().status
+        )
+
+    def test_transcode_video_progress_is_throttled(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(side_effect=[(0, False), (5, False), (8, False), (20, False), (21, True)]),
+            iter_formats=Mock(return_value=[]),
+        )
+
+        with override_settings(PLUGIN_BACKEND=mock_backend,
+                               TRANSCODING_PROGRESS_MIN_DELTA=10,
+                               TRANSCODING_PROGRESS_MIN_INTERVAL=3600):
+            with patch('pipeline.managers.ProcessingStateManager.update_progress', autospec=True,
+                       side_effect=ProcessingStateManager.update_progress) as mock_update_progress:
+                tasks.transcode_video('videoid')
+
+        # Small progress changes are not saved, except for the last one
+        self.assertEqual(
+            [0, 20, 21],
+            [call[0][2] for call in mock_update_progress.call_args_list]
+        )
+        self.assertEqual(21, models.ProcessingState.objects.get().progress)
+
+    def test_transcode_video_event_resets_polling_period(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(side_effect=[(0, False), (0, False), (0, False), (100, True)]),
+            iter_formats=Mock(return_value=[]),
+        )
+
+        with override_settings(PLUGIN_BACKEND=mock_backend,
+                               TRANSCODING_POLL_MIN_INTERVAL=1,
+                               TRANSCODING_POLL_MAX_INTERVAL=60):
+            # An event is published before the second check
+            with patch('pipeline.events.count', side_effect=[0, 0, 1, 1, 1]):
+                with patch('pipeline.tasks.send_task', side_effect=send_task) as mock_send_task:
+                    tasks.transcode_video('videoid')
+
+        check_calls = [call for call in mock_send_task.call_args_list if call[0][0] == 'transcode_video_check']
+        self.assertEqual([None, 1, 1, 2], [call[1].get('countdown') for call in check_calls])
+
+    def test_transcode_video_check_superseded(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(return_value=(0, False)),
+        )
+
+        # Prevent the chain of checks from running
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            with patch('pipeline.tasks.send_task'):
+                tasks.transcode_video('videoid')
+                tasks.transcode_video_check('videoid')
+                tasks.transcode_video_check('videoid', 'outdatedcheckid')
+
+        mock_backend.return_value.check_progress.assert_called_once_with('job1')
+
+    def test_notify_progress_triggers_check(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(return_value=(0, False)),
+            iter_formats=Mock(return_value=[]),
+        )
+
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            with patch('pipeline.tasks.send_task'):
+                tasks.transcode_video('videoid')
+            mock_backend.return_value.check_progress.return_value = (100, True)
+            BaseBackend().notify_progress('videoid')
+
+        self.assertEqual(
+            models.ProcessingState.STATUS_SUCCESS,
+            models.ProcessingState.objects.get().status
+        )
+
+    def test_late_notified_check_does_not_finalize_twice(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1', 'job2']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(return_value=(100, True)),
+        )
+
+        # The last two jobs notify their completion at the same time
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            with patch('pipeline.tasks.send_task') as mock_send_task:
+                tasks.transcode_video('videoid')
+                tasks.transcode_video_check('videoid')
+                tasks.transcode_video_check('videoid')
+
+        self.assertEqual(
+            ['transcode_video_check', 'transcode_video_finalize'],
+            [call[0][0] for call in mock_send_task.call_args_list]
+        )
+        self.assertEqual(2, mock_backend.return_value.check_progress.call_count)
+
+    def test_transcode_video_state_is_not_cached(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(return_value=(0, False)),
+            iter_formats=Mock(return_value=[]),
+        )
+
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            with patch('pipeline.tasks.send_task'):
+                tasks.transcode_video('videoid')
+            # Cache entries may be evicted at any time
+            cache.clear()
+            mock_backend.return_value.check_progress.return_value = (100, True)
+            tasks.transcode_video_check('videoid')
+
+        self.assertEqual(
+            models.ProcessingState.STATUS_SUCCESS,
+            models.ProcessingState.objects.get().status
+        )
+        self.assertEqual(0, models.TranscodingState.objects.count())
+
+    def test_transcode_video_stalled(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1', 'job2']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(side_effect=[(10, False), (10, False), (100, True), (10, False), (10, False)]),
+            iter_formats=Mock(return_value=[]),
+        )
+
+        with override_settings(PLUGIN_BACKEND=mock_backend, TRANSCODING_STALLED_TIMEOUT=3600):
+            with patch('pipeline.tasks.send_task') as mock_send_task:
+                with patch('pipeline.tasks.time', return_value=0):
+                    tasks.transcode_video('videoid', delete=False)
+                    tasks.transcode_video_check('videoid')
+                # job1 finishes: jobs are not stalled
+                with patch('pipeline.tasks.time', return_value=3000):
+                    tasks.transcode_video_check('videoid')
+                # job2 did not progress for an hour
+                with patch('pipeline.tasks.time', return_value=6601):
+                    tasks.transcode_video_check('videoid')
+                with patch('pipeline.tasks.time', return_value=6602):
+                    tasks.transcode_video_check('videoid')
+            self.assertEqual(
+                ['transcode_video_check'] * 3 + ['transcode_video_finalize'],
+                [call[0][0] for call in mock_send_task.call_args_list]
+            )
+            tasks.transcode_video_finalize('videoid')
+
+        processing_state = models.ProcessingState.objects.get()
+        self.assertEqual(models.ProcessingState.STATUS_FAILED, processing_state.status)
+        self.assertEqual("Transcoding job stalled: no progress for 3600 seconds", processing_state.message)
+        self.assertEqual(5, mock_backend.return_value.check_progress.call_count)
+        # Transcoding lock is released
+        self.assertTrue(tasks._transcode_video_lease('videoid').acquire())
+
+    def test_transcode_video_lock_is_held_during_transcoding(self):
+        factories.VideoFactory(public_id='videoid')
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
+            check_progress=Mock(return_value=(0, False)),
+        )
+
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            with patch('pipeline.tasks.send_task'):
+                tasks.transcode_video('videoid')
+                tasks.transcode_video('videoid')
+
+        mock_backend.return_value.start_transcoding.assert_called_once_with('videoid')
+
     def test_transcode_video_failure(self):
         factories.VideoFactory(public_id='videoid')
 
@@ -141,11 +340,12 @@ class TasksTests(TestCase):
                 # job2 finishes
                 return 100, True
 
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=Mock(return_value=['job1', 'job2']),
+            get_job_formats=Mock(return_value=[]),
             check_progress=check_progress,
             iter_formats=Mock(return_value=[]),
-        ))
+        )
 
         with override_settings(PLUGIN_BACKEND=mock_backend):
             tasks.transcode_video('videoid')
@@ -156,8 +356,9 @@ class TasksTests(TestCase):
         self.assertEqual("error message", video_processing_state.message)
         self.assertEqual(50, video_processing_state.progress)
         mock_backend.return_value.create_thumbnail.assert_not_called()
+        mock_backend.return_value.clean_transcoding.assert_called_once_with('videoid')
 
-    def test_video_transcoding_failure_invalidates_cache(self):
+    def test_video_transcoding_failure_updates_document(self):
         # Login
         user = models.User.objects.create(username="test", is_active=True)
         user.set_password("password")
@@ -166,10 +367,11 @@ class TasksTests(TestCase):
 
         factories.VideoFactory(public_id='videoid', owner=user)
 
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=Mock(return_value=['job']),
+            get_job_formats=Mock(return_value=[]),
             check_progress=Mock(side_effect=exceptions.TranscodingFailed),
-        ))
+        )
 
         video_pre_transcoding = self.client.get(reverse("api:v1:video-detail", kwargs={"id": 'videoid'})).json()
         with override_settings(PLUGIN_BACKEND=mock_backend):
@@ -183,9 +385,9 @@ class TasksTests(TestCase):
     def test_transcode_video_unexpected_failure(self):
         factories.VideoFactory(public_id='videoid')
 
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=Mock(side_effect=ValueError(666, "random error"))
-        ))
+        )
 
         with override_settings(PLUGIN_BACKEND=mock_backend):
             self.assertRaises(ValueError, tasks.transcode_video, 'videoid')
@@ -196,10 +398,11 @@ class TasksTests(TestCase):
 
     def test_transcode_video_twice(self):
         factories.VideoFactory(public_id='videoid')
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=Mock(return_value=['job1']),
+            get_job_formats=Mock(return_value=[]),
             iter_formats=Mock(return_value=[]),
-        ))
+        )
 
         # First attempt: failure
         mock_backend.return_value.check_progress = Mock(side_effect=exceptions.TranscodingFailed)
@@ -220,10 +423,10 @@ class TasksTests(TestCase):
         video = factories.VideoFactory(public_id='videoid')
         models.ProcessingState.objects.filter(video=video).update(status=models.ProcessingState.STATUS_RESTART)
 
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=Mock(return_value=[]),
             iter_formats=Mock(return_value=[]),
-        ))
+        )
         with override_settings(PLUGIN_BACKEND=mock_backend):
             tasks.transcode_video_restart()
 
@@ -233,14 +436,27 @@ class TasksTests(TestCase):
             models.ProcessingState.objects.get(video=video).status
         )
 
+    def test_transcode_video_restart_does_not_resend_claimed_videos(self):
+        factories.VideoFactory(public_id='videoid')
+        models.ProcessingState.objects.update(status=models.ProcessingState.STATUS_RESTART)
+
+        with patch('pipeline.tasks.send_task') as mock_send_task:
+            tasks.transcode_video_restart()
+            tasks.transcode_video_restart()
+
+        mock_send_task.assert_called_once_with(
+            'transcode_video', args=('videoid',), kwargs={'delete': False, 'resume': True}
+        )
+
     def test_transcode_video_restart_fails(self):
         video = factories.VideoFactory(public_id='videoid')
         models.ProcessingState.objects.filter(video=video).update(status=models.ProcessingState.STATUS_RESTART)
 
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=Mock(return_value=[1]),
+            get_job_formats=Mock(return_value=[]),
             check_progress=Mock(side_effect=exceptions.TranscodingFailed),
-        ))
+        )
         with override_settings(PLUGIN_BACKEND=mock_backend):
             tasks.transcode_video_restart()
 
@@ -250,13 +466,85 @@ class TasksTests(TestCase):
         )
         mock_backend.return_value.delete_video.assert_not_called()
 
+    def test_transcode_video_restart_resumes_failed_formats(self):
+        video = factories.VideoFactory(public_id='videoid')
+
+        def check_progress(job):
+            if job == 'jobSD':
+                raise exceptions.TranscodingFailed('error message')
+            return 100, True
+
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=['jobHD', 'jobSD']),
+            get_job_formats=lambda job: [job[3:]],
+            get_format_checksum=lambda video_id, format_name: 'checksum' + format_name,
+            check_progress=check_progress,
+            iter_formats=Mock(return_value=[('HD', 128), ('SD', 64)]),
+        )
+
+        # First attempt: SD fails
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            tasks.transcode_video('videoid', delete=False)
+        self.assertEqual(
+            {('HD', models.TranscodingJob.STATUS_SUCCESS, 'checksumHD'),
+             ('SD', models.TranscodingJob.STATUS_FAILED, '')},
+            set(models.TranscodingJob.objects.filter(
+                kind=models.TranscodingJob.KIND_FORMAT
+            ).values_list('name', 'status', 'checksum'))
+        )
+        mock_backend.return_value.create_thumbnail.assert_not_called()
+
+        # Restart: only SD is transcoded
+        models.ProcessingState.objects.filter(video=video).update(status=models.ProcessingState.STATUS_RESTART)
+        mock_backend.return_value.start_transcoding.return_value = ['jobSD']
+        mock_backend.return_value.check_progress = Mock(return_value=(100, True))
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            tasks.transcode_video_restart()
+
+        mock_backend.return_value.start_transcoding.assert_called_with('videoid', skip_formats=['HD'])
+        self.assertEqual(
+            models.ProcessingState.STATUS_SUCCESS,
+            models.ProcessingState.objects.get(video=video).status
+        )
+        self.assertEqual(2, models.VideoFormat.objects.filter(video=video).count())
+        mock_backend.return_value.create_thumbnail.assert_called_once_with('videoid', video.public_thumbnail_id)
+
+        # Second restart: thumbnail is not created again
+        models.ProcessingState.objects.filter(video=video).update(status=models.ProcessingState.STATUS_RESTART)
+        mock_backend.return_value.start_transcoding.return_value = []
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            tasks.transcode_video_restart()
+
+        self.assertEqual(
+            ['HD', 'SD'],
+            sorted(mock_backend.return_value.start_transcoding.call_args[1]['skip_formats'])
+        )
+        mock_backend.return_value.create_thumbnail.assert_called_once_with('videoid', video.public_thumbnail_id)
+
+    def test_transcode_video_restart_with_modified_format(self):
+        video = factories.VideoFactory(public_id='videoid')
+        models.TranscodingJob.objects.create(
+            video=video, name='HD', status=models.TranscodingJob.STATUS_SUCCESS, checksum='oldchecksum'
+        )
+        mock_backend = mock_plugin_backend(
+            start_transcoding=Mock(return_value=[]),
+            get_format_checksum=Mock(return_value='newchecksum'),
+            iter_formats=Mock(return_value=[]),
+        )
+
+        with override_settings(PLUGIN_BACKEND=mock_backend):
+            tasks.transcode_video('videoid', resume=True)
+
+        mock_backend.return_value.start_transcoding.assert_called_once_with('videoid')
+        self.assertFalse(models.TranscodingJob.objects.filter(kind=models.TranscodingJob.KIND_FORMAT).exists())
+
     def test_transcode_video_thumbnail_create_fails(self):
         video = factories.VideoFactory(public_id='videoid')
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=Mock(return_value=[]),
             iter_formats=Mock(return_value=[]),
             create_thumbnail=Mock(side_effect=ValueError("description")),
-        ))
+        )
 
         with override_settings(PLUGIN_BACKEND=mock_backend):
             tasks.transcode_video('videoid')
@@ -265,6 +553,19 @@ class TasksTests(TestCase):
         self.assertEqual(models.ProcessingState.STATUS_FAILED, processing_state.status)
         self.assertEqual("thumbnail creation: description", processing_state.message)
 
+    def test_transcode_video_poster_frames_not_implemented(self):
+        video = factories.VideoFactory(public_id='videoid')
+        # The backend does not implement create_poster_frames
+        with override_plugin_backend(
+            start_transcoding=lambda video_id: [],
+            create_thumbnail=lambda video_id, thumb_id: None,
+        ):
+            tasks.transcode_video('videoid', delete=False)
+
+        processing_state = models.ProcessingState.objects.get(video=video)
+        self.assertEqual(models.ProcessingState.STATUS_FAILED, processing_state.status)
+        self.assertTrue(processing_state.message.startswith("poster frame creation: "))
+
     def test_video_is_deleted_during_transcoding(self):
         factories.VideoFactory(public_id='videoid')
 
@@ -272,10 +573,10 @@ class TasksTests(TestCase):
             models.Video.objects.filter(public_id='videoid').delete()
             return []
 
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             start_transcoding=start_transcoding,
             iter_formats=Mock(return_value=[]),
-        ))
+        )
 
         with override_settings(PLUGIN_BACKEND=mock_backend):
             tasks.transcode_video('videoid')
@@ -311,13 +612,13 @@ My name is VIDEOFRONT and I am awesome.
 Also I have utf8 characters: é û ë ï 你好.
 """
 
-        mock_backend = Mock(return_value=Mock(upload_subtitle=Mock()))
+        mock_backend = mock_plugin_backend(upload_subtitle=Mock())
         with override_settings(PLUGIN_BACKEND=mock_backend):
             tasks.upload_subtitle('videoid', 'subtitleid', 'fr', srt_content.encode('utf-8'))
         mock_backend.return_value.upload_subtitle.assert_called_once_with('videoid', 'subtitleid', 'fr', vtt_content)
 
     def test_upload_subtitle_with_invalid_format(self):
-        mock_backend = Mock(return_value=Mock(upload_subtitle=Mock()))
+        mock_backend = mock_plugin_backend(upload_subtitle=Mock())
         with override_settings(PLUGIN_BACKEND=mock_backend):
             self.assertRaises(
                 exceptions.SubtitleInvalid,
@@ -357,10 +658,10 @@ class UploadThumbnailTests(TestCase):
         factories.VideoFactory(public_id="videoid", public_thumbnail_id="old_thumbid")
         img = open(os.path.join(os.path.dirname(__file__), 'fixtures', 'elcapitan.jpg'), 'rb')
 
-        mock_backend = Mock(return_value=Mock(
+        mock_backend = mock_plugin_backend(
             upload_thumbnail=Mock(),
             delete_thumbnail=Mock(),
-        ))
+        )
         with override_settings(PLUGIN_BACKEND=mock_backend):
             tasks.upload_thumbnail("videoid", img)
 
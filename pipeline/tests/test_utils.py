@@ -36,3 +36,21 @@ class UtilsTests(TestCase):
 
         resized_image = Image.open(out_img.name)
         self.assertEqual((576, 1024), resized_image.size)
+
+    def test_select_formats(self):
+        format_sizes = [('HD', (1280, 720)), ('SD', (854, 480)), ('LD', (640, 360))]
+
+        self.assertEqual(['HD', 'SD', 'LD'], utils.select_formats(format_sizes, None))
+        self.assertEqual(['HD', 'SD', 'LD'], utils.select_formats(format_sizes, (1920, 1080)))
+        self.assertEqual(['SD', 'LD'], utils.select_formats(format_sizes, (854, 480)))
+        # Portrait videos are not upscaled
+        self.assertEqual(['HD', 'SD', 'LD'], utils.select_formats(format_sizes, (720, 1280)))
+        # Smallest format is always selected
+        self.assertEqual(['LD'], utils.select_formats(format_sizes, (320, 180)))
+        # Formats with unknown size are always selected
+        self.assertEqual(['HD', 'LD'], utils.select_formats([('HD', None), ('LD', (640, 360))], (320, 180)))
+        self.assertEqual(
+            ['HD', 'LD'],
+            utils.select_formats([('HD', None), ('SD', (854, 480)), ('LD', (640, 360))], (320, 180))
+        )
+        self.assertEqual(['HD'], utils.select_formats([('HD', None)], (320, 180)))
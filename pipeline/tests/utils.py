@@ -1,4 +1,7 @@
+from functools import partial
+
 from django.test.utils import override_settings
+from mock import Mock
 
 import pipeline.backend
 
@@ -29,3 +32,21 @@ def override_plugin_backend(**kwargs):
     Example: @override_plugin_backend(upload_video=lambda x: 42)
     """
     return override_settings(PLUGIN_BACKEND=TestPluginBackendFactory(**kwargs))
+
+def mock_plugin_backend(**kwargs):
+    """
+    Mock plugin backend class, whose instances mock a selection of methods.
+    Transcoding jobs are checked one by one with the mocked `check_progress`
+    method, and asset urls are built one by one with the mocked url methods,
+    as in `BaseBackend`. Unless they are mocked, url methods return empty urls,
+    such that video documents can be built, and source videos cannot be probed.
+
+    Example: mock_plugin_backend(check_progress=Mock(return_value=(100, True)))
+    """
+    for name in ['video_url', 'subtitle_url', 'thumbnail_url', 'poster_frames_url']:
+        kwargs.setdefault(name, Mock(return_value=''))
+    kwargs.setdefault('probe_source', Mock(return_value=None))
+    backend = Mock(**kwargs)
+    for name in ['check_progress_many', 'video_urls', 'subtitle_urls', 'thumbnail_urls', 'poster_frames_urls']:
+        setattr(backend, name, partial(getattr(pipeline.backend.BaseBackend, name), backend))
+    return Mock(return_value=backend)
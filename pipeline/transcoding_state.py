@@ -0,0 +1,30 @@
+import pickle
+
+from . import models
+
+
+def get(public_video_id):
+    """
+    Returns:
+        state (dict): value that was stored by `set`, or None if the video is
+        not being transcoded.
+    """
+    state = models.TranscodingState.objects.filter(
+        public_video_id=public_video_id
+    ).values_list('state', flat=True).first()
+    return None if state is None else pickle.loads(bytes(state))
+
+def set(public_video_id, state):
+    """
+    Args:
+        public_video_id (str)
+        state (dict): must be picklable, including the transcoding jobs
+        returned by the backend.
+    """
+    models.TranscodingState.objects.update_or_create(
+        public_video_id=public_video_id,
+        defaults={'state': pickle.dumps(state)}
+    )
+
+def delete(public_video_id):
+    models.TranscodingState.objects.filter(public_video_id=public_video_id).delete()
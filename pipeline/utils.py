@@ -48,3 +48,33 @@ def resize_image(in_path, out_path, max_size):
     ratio = max_size * 1. / max(in_img.size)
     out_img = in_img.resize((round(in_img.size[0] * ratio), round(in_img.size[1] * ratio)))
     out_img.save(out_path)
+
+def select_formats(format_sizes, source_size):
+    """
+    Select the formats that would not be upscaled from the source video. A
+    format is upscaled if it is both wider and higher than the source. The
+    smallest format of known size is always selected.
+
+    Args:
+        format_sizes (list): (format_name, (width, height)) tuples. The size
+        may be None if it is unknown, in which case the format is selected.
+        source_size (tuple): (width, height) of the source video, or None if
+        unknown, in which case all formats are selected.
+
+    Returns:
+        format_names (list): selected format names, in the same order
+    """
+    if source_size is None:
+        return [format_name for format_name, _size in format_sizes]
+    source_width, source_height = source_size
+    known_format_sizes = [(format_name, size) for format_name, size in format_sizes if size is not None]
+    selected = set(
+        format_name for format_name, size in known_format_sizes
+        if size[0] <= source_width or size[1] <= source_height
+    )
+    if not selected and known_format_sizes:
+        smallest_format_name, _size = min(
+            known_format_sizes, key=lambda format_size: format_size[1][0] * format_size[1][1]
+        )
+        selected.add(smallest_format_name)
+    return [format_name for format_name, size in format_sizes if size is None or format_name in selected]
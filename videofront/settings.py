@@ -127,6 +127,9 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.TokenAuthentication',
     ),
+    # Default number of objects per page of the paginated lists (see
+    # api.v1.pagination.CursorPagination)
+    'PAGE_SIZE': 100,
 }
 
 # Logging
@@ -222,5 +225,37 @@ SUBTITLES_MAX_BYTES = 1024*1024*5 # 5 Mb
 # Override this setting to provide your own custom implementation of pipeline tasks.
 PLUGIN_BACKEND = 'pipeline.backend.BaseBackend'
 
+# Distributed locks are leases stored by this backend. The default backend
+# stores them in the LOCK_CACHE cache, which must be shared by all web servers
+# and celery workers. In production, you may want to point LOCK_CACHE to a
+# faster store than the database cache, such as memcached or redis.
+LOCK_BACKEND = 'pipeline.locks.CacheLockBackend'
+LOCK_CACHE = 'default'
+
 # Maximum of width and height size for video thumbnails
 THUMBNAILS_SIZE = 1024
+
+# Transcoding jobs progress is checked right away whenever the backend notifies
+# the transcoding tasks. Otherwise, progress is polled by scheduled tasks with a
+# period that doubles after every check, between these two values (in seconds).
+TRANSCODING_POLL_MIN_INTERVAL = 1
+TRANSCODING_POLL_MAX_INTERVAL = 60
+
+# The transcoding progress of a video is saved to the database only when it has
+# changed by this percentage, or when it was last saved more than this number of
+# seconds ago.
+TRANSCODING_PROGRESS_MIN_DELTA = 1
+TRANSCODING_PROGRESS_MIN_INTERVAL = 5
+
+# Transcoding jobs that did not progress during this number of seconds are
+# considered as failed: the transcoding of their video then fails, and it may
+# be restarted. Note that jobs that wait for an available worker do not
+# progress either.
+TRANSCODING_STALLED_TIMEOUT = 24 * 3600
+
+# Videos marked for restart are sent to the workers in batches of
+# TRANSCODING_RESTART_BATCH_SIZE videos by the periodic transcode_video_restart
+# task. A video is sent again only if its transcoding did not start after
+# TRANSCODING_RESTART_CLAIM_DURATION seconds.
+TRANSCODING_RESTART_BATCH_SIZE = 100
+TRANSCODING_RESTART_CLAIM_DURATION = 600
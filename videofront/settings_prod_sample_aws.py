@@ -38,4 +38,8 @@ ELASTIC_TRANSCODER_PRESETS = [
     ('HD', '1351620000001-000001', 5400), # System preset: Generic 1080p
 ]
 ELASTIC_TRANSCODER_THUMBNAILS_PRESET = '1351620000001-000001'
+# Skip presets that are both wider and higher than the source video, except
+# for the smallest preset. This requires ffprobe on the celery workers, where
+# source videos are probed before transcoding.
+# ELASTIC_TRANSCODER_SKIP_UPSCALING = False
 ELASTIC_TRANSCODER_PIPELINE_ID = 'yourpipelineid'
@@ -33,6 +33,21 @@ VIDEO_STORAGE_ROOT = '/opt/videofront/storage/' # FIXME
 # Override this settings if ffmpeg is not in your path.
 # Replace by 'avconv' on Ubuntu 14.04.
 # FFMPEG_BINARY = 'ffmpeg'
+# FFPROBE_BINARY = 'ffprobe'
+
+# Transcoding progress is published every time it increases by this percentage.
+# FFMPEG_PROGRESS_STEP = 1
+
+# Progress of the running ffmpeg tasks is stored in this Django cache, and not
+# in the celery result backend. It is fetched in a single request for all the
+# transcoding jobs of a video. A cache that is shared by all nodes, such as
+# memcached or redis, is faster than the default database cache.
+# FFMPEG_JOBS_CACHE = 'default'
+
+# Final states of the ffmpeg tasks must not be evicted: they are stored in
+# files of this directory, which must be shared by all nodes, until they are
+# read. Defaults to VIDEO_STORAGE_ROOT/jobs, which is publicly served.
+# FFMPEG_JOBS_DIR = '/opt/videofront/jobs/'
 
 # Presets suggestions:
 # https://support.google.com/youtube/answer/1722171
@@ -55,7 +70,60 @@ FFMPEG_PRESETS = {
     },
 }
 
+# Transcode to all presets with a single ffmpeg process. The source video is
+# then decoded only once, which saves CPU time, but all formats are transcoded
+# on the same worker.
+# FFMPEG_SINGLE_PASS = False
+
+# Videos that last more than twice this duration (in seconds) are split in
+# segments of approximately this duration. Segments are transcoded in parallel
+# by all available celery workers, and then concatenated. Note that in this
+# case FFMPEG_SINGLE_PASS is ignored.
+# FFMPEG_SEGMENT_DURATION = 300
+
+# Package transcoded videos in HLS format for adaptive bitrate streaming. The
+# HLS master playlist will be available from the video API as an additional
+# 'HLS' format.
+# FFMPEG_HLS = False
+# FFMPEG_HLS_SEGMENT_DURATION = 6
+
+# By default, presets that are both wider and higher than the source video are
+# skipped, except for the smallest preset. Set this to False to transcode
+# videos to all presets.
+# FFMPEG_SKIP_UPSCALING = True
+
+# Source videos that already fit a preset (h264/aac, not larger and with no
+# higher frame rate or bitrate than the preset) are copied to an mp4 container
+# instead of being re-encoded. This is disabled when FFMPEG_HLS is True.
+# FFMPEG_STREAM_COPY = True
+
+# ffmpeg processes that run on the same node share its cores. Each encoding is
+# assigned one thread per FFMPEG_PIXELS_PER_THREAD pixels of its output
+# formats, and is started only if the node has enough free cores: otherwise,
+# the encoding task is retried after FFMPEG_ENCODE_SCHEDULER_RETRY_DELAY
+# seconds. Core reservations are stored in FFMPEG_ENCODE_SCHEDULER_DIR. The
+# occupancy of a node can be obtained with: ./manage.py encode-occupancy
+# FFMPEG_ENCODE_SCHEDULER = True
+# FFMPEG_CPU_COUNT = None # defaults to the number of cores of the node
+# FFMPEG_PIXELS_PER_THREAD = 640 * 360
+# FFMPEG_ENCODE_SCHEDULER_RETRY_DELAY = 10
+# FFMPEG_ENCODE_SCHEDULER_DIR = '/tmp/videofront'
+
+# Poster frames are sampled every FFMPEG_POSTER_FRAMES_MIN_INTERVAL seconds:
+# short videos get one poster frame per second. For long videos, the interval
+# is increased such that there are at most FFMPEG_POSTER_FRAMES_MAX_COUNT
+# poster frames per video.
+# FFMPEG_POSTER_FRAMES_MIN_INTERVAL = 1
+# FFMPEG_POSTER_FRAMES_MAX_COUNT = 200
+
+# Poster frames are tiled in sprite sheets of FFMPEG_POSTER_FRAMES_SPRITE_COLUMNS
+# x FFMPEG_POSTER_FRAMES_SPRITE_ROWS frames, such that video players need to
+# download only a few images to display scrubbing previews.
+# FFMPEG_POSTER_FRAMES_SPRITE_COLUMNS = 10
+# FFMPEG_POSTER_FRAMES_SPRITE_ROWS = 10
+
 # Name of the FFMPEG_PRESETS preset that will be used to generate a thumbnail.
 # Note that the thumbnail will automatically be resized, so you should pick the
-# preset with the best video size.
+# preset with the best video size. If this preset is skipped, the largest
+# transcoded format is used instead.
 FFMPEG_THUMBNAILS_PRESET = 'HD'